@@ -0,0 +1,419 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmarks of the sequence and metadata hot paths.
+
+Runs micro-benchmarks of the lookup and read functions, then a load test of
+the app in process, over ASGI, on a dataset written by benchmarks/synthetic.py.
+Results are written as JSON, to be compared between commits:
+
+    PYTHONPATH=src python benchmarks/run.py /tmp/refget-bench -o before.json
+    git checkout ...
+    PYTHONPATH=src python benchmarks/run.py /tmp/refget-bench -o after.json \\
+        --compare before.json
+
+The app is configured as usual, from the environment or .env. INDEXDBPATH and
+SEQPATH are set to the dataset.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+DATATYPES = ("seq", "cdna", "cds", "pep")
+
+
+class Sequence(NamedTuple):
+    md5: str
+    sha: str
+    length: int
+    circular: bool
+
+
+def read_sequences(datadir: Path) -> Dict[str, List[Sequence]]:
+    """
+    Read the sequences of a dataset from its hashes files, by data type.
+    """
+    sequences: Dict[str, List[Sequence]] = {datatype: [] for datatype in DATATYPES}
+    for datatype in DATATYPES:
+        for hashes in sorted(datadir.glob(f"*/{datatype}.hashes")):
+            with open(hashes) as file:
+                for line in file:
+                    _, md5, sha, _, length, circular = line.rstrip("\n").split("\t")
+                    sequences[datatype].append(
+                        Sequence(md5, sha, int(length), circular == "1")
+                    )
+    return sequences
+
+
+def summary(times: List[float], number: int) -> Dict[str, float]:
+    return {
+        "number": number,
+        "min_us": min(times),
+        "median_us": statistics.median(times),
+    }
+
+
+def timed(func: Callable[[], Any], number: int, repeat: int) -> Dict[str, float]:
+    """
+    Time number calls of func, repeat times. Returns the time per call of the
+    fastest and the median repeat, in microseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - started) / number * 1e6)
+    return summary(times, number)
+
+
+async def timed_async(
+    func: Callable[[], Any], number: int, repeat: int
+) -> Dict[str, float]:
+    """
+    Like timed, for a coroutine function.
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            await func()
+        times.append((time.perf_counter() - started) / number * 1e6)
+    return summary(times, number)
+
+
+async def drain(content) -> int:
+    size = 0
+    async for chunk in content:
+        size += len(chunk)
+    return size
+
+
+async def micro_benchmarks(
+    sequences: Dict[str, List[Sequence]], number: int, repeat: int, rng: random.Random
+) -> Dict[str, Dict[str, float]]:
+    """
+    Benchmark the lookup and read functions of refget.main on their own.
+    """
+    import refget.main as main
+    from refget.framecache import FrameCache
+    from refget.indexcache import IndexCache
+
+    results = {}
+    genes = sequences["cdna"] + sequences["cds"] + sequences["pep"]
+    ids = [rng.choice(genes) for _ in range(number)]
+
+    def cycle(items):
+        iterator = iter(items * (repeat + 1))
+        return lambda: next(iterator)
+
+    # Index lookups, with and without the record caches
+    for cached in (False, True):
+        suffix = "_cached" if cached else ""
+        size = main.RECORD_CACHE_SIZE if cached else 0
+        main.RECORD_CACHE = IndexCache("record", size)
+        main.MD5_CACHE = IndexCache("md5", size)
+        next_sha = cycle([sequence.sha for sequence in ids])
+        results["get_record" + suffix] = timed(
+            lambda: main.get_record(next_sha()), number, repeat
+        )
+        next_md5 = cycle([sequence.md5 for sequence in ids])
+        results["id_to_sha_md5" + suffix] = timed(
+            lambda: main.id_to_sha(next_md5()), number, repeat
+        )
+    next_ga4gh = cycle([main.sha_to_ga4gh(sequence.sha) for sequence in ids])
+    results["id_to_sha_ga4gh"] = timed(
+        lambda: main.id_to_sha(next_ga4gh()), number, repeat
+    )
+    results["parse_range"] = timed(
+        lambda: main.parse_range("bytes=1000000-1999999"), number, repeat
+    )
+
+    # Reads from a chromosome, with and without the frame cache
+    chromosome = max(sequences["seq"], key=lambda sequence: sequence.length)
+    record = main.get_record(chromosome.sha)
+    pool = await main.open_datafile(os.path.join(main.SEQPATH, record.path))
+    reads = {
+        "read_zstd_10k": 10_000,
+        "read_zstd_1m": 1024 * 1024,
+    }
+    for cached in (False, True):
+        suffix = "_cached" if cached else ""
+        main.FRAME_CACHE = FrameCache(main.FRAME_CACHE_SIZE if cached else 0)
+        for name, length in reads.items():
+            if length > record.length:
+                continue
+            # Few distinct ranges when cached, so that they stay in the cache
+            starts = [
+                record.start + rng.randrange(0, record.length - length + 1)
+                for _ in range(4 if cached else number)
+            ]
+            next_start = cycle(starts * (number // len(starts)))
+            results[name + suffix] = await timed_async(
+                lambda: drain(main.read_zstd(pool, next_start(), length)),
+                max(1, number // 100),
+                repeat,
+            )
+
+    # A circular read, in two regions
+    circular = [
+        sequence
+        for sequence in sequences["seq"]
+        if sequence.circular and sequence.length > 1_000_000
+    ]
+    if circular:
+        record = main.get_record(circular[0].sha)
+        pool = await main.open_datafile(os.path.join(main.SEQPATH, record.path))
+        regions = main.sequence_regions(
+            record.length - 500_000, 500_000, record.start, record.length, True
+        )
+        results["multi_read_zstd_circular_1m"] = await timed_async(
+            lambda: drain(main.multi_read_zstd(pool, regions)),
+            max(1, number // 100),
+            repeat,
+        )
+    return results
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def load_test(
+    sequences: Dict[str, List[Sequence]],
+    requests: int,
+    concurrency: int,
+    full_max: int,
+    rng: random.Random,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Send a mix of requests to the app in process, concurrency at a time.
+    Returns latency, throughput and error counts by kind of request.
+    """
+    import httpx
+    from refget.main import app
+
+    everything = [
+        sequence for datatype in DATATYPES for sequence in sequences[datatype]
+    ]
+    small = [sequence for sequence in everything if sequence.length <= full_max]
+    # Ranges fit in the sequence, circular ones wrap around its origin
+    chromosomes = [
+        sequence for sequence in sequences["seq"] if sequence.length >= 10_000
+    ]
+    circular = [
+        sequence
+        for sequence in sequences["seq"]
+        if sequence.circular and sequence.length >= 100_000
+    ]
+
+    def query(kind: str):
+        if kind == "full":
+            sequence = rng.choice(small)
+            return f"/sequence/{sequence.md5}", {}
+        if kind == "range":
+            sequence = rng.choice(chromosomes)
+            start = rng.randrange(0, sequence.length - 10_000 + 1)
+            return f"/sequence/{sequence.sha}", {"start": start, "end": start + 10_000}
+        if kind == "circular":
+            sequence = rng.choice(circular)
+            start = sequence.length - rng.randrange(1, 50_000)
+            end = rng.randrange(1, 50_000)
+            return f"/sequence/{sequence.md5}", {"start": start, "end": end}
+        sequence = rng.choice(everything)
+        return f"/sequence/{sequence.md5}/metadata", {}
+
+    kinds = ["full", "metadata"]
+    kinds += (["range"] if chromosomes else []) + (["circular"] if circular else [])
+    queue = [(kind, *query(kind)) for kind in rng.choices(kinds, k=requests)]
+
+    latencies: Dict[str, List[float]] = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    sizes = {kind: 0 for kind in kinds}
+
+    transport = httpx.ASGITransport(app=app)
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+    async with client:
+
+        async def worker():
+            while queue:
+                kind, url, params = queue.pop()
+                started = time.perf_counter()
+                response = await client.get(url, params=params)
+                latencies[kind].append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors[kind] += 1
+                sizes[kind] += len(response.content)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    results = {}
+    for kind in kinds:
+        results[kind] = {
+            "requests": len(latencies[kind]),
+            "errors": errors[kind],
+            "bytes": sizes[kind],
+            "p50_ms": percentile(latencies[kind], 0.50) * 1e3,
+            "p95_ms": percentile(latencies[kind], 0.95) * 1e3,
+            "p99_ms": percentile(latencies[kind], 0.99) * 1e3,
+        }
+    everything_latencies = [value for values in latencies.values() for value in values]
+    results["total"] = {
+        "requests": len(everything_latencies),
+        "errors": sum(errors.values()),
+        "bytes": sum(sizes.values()),
+        "p50_ms": percentile(everything_latencies, 0.50) * 1e3,
+        "p95_ms": percentile(everything_latencies, 0.95) * 1e3,
+        "p99_ms": percentile(everything_latencies, 0.99) * 1e3,
+        "requests_per_s": len(everything_latencies) / elapsed,
+        "mb_per_s": sum(sizes.values()) / elapsed / 1e6,
+    }
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results: Dict, previous: Dict):
+    """
+    Print the change of each timing against a previous run. Lower is better
+    for all of them but throughput.
+    """
+    print(f"\nChange against {previous['meta'].get('commit') or 'previous run'}:")
+    timings = (("micro", "median_us"), ("load", "p50_ms"), ("load", "p99_ms"))
+    for section, key in timings:
+        for name, values in results[section].items():
+            before = previous.get(section, {}).get(name, {}).get(key)
+            if before:
+                change = (values[key] - before) / before * 100
+                print(
+                    f"  {section} {name} {key}: "
+                    f"{before:.1f} -> {values[key]:.1f} ({change:+.1f}%)"
+                )
+    before = previous.get("load", {}).get("total", {}).get("requests_per_s")
+    if before:
+        after = results["load"]["total"]["requests_per_s"]
+        change = (after - before) / before * 100
+        print(f"  load requests/s: {before:.1f} -> {after:.1f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("datadir", help="Dataset written by benchmarks/synthetic.py")
+    parser.add_argument(
+        "--index",
+        default="indexdb.tkh",
+        help="Index file in datadir. Default indexdb.tkh",
+    )
+    parser.add_argument(
+        "-o", "--output", default="benchmark.json", help="Default benchmark.json"
+    )
+    parser.add_argument("--compare", help="Results of a previous run to compare with")
+    parser.add_argument(
+        "--number", type=int, default=10_000, help="Calls per micro-benchmark"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Default 5")
+    parser.add_argument(
+        "--requests", type=int, default=2000, help="Requests of the load test"
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="Default 16")
+    parser.add_argument(
+        "--full-max",
+        type=int,
+        default=16 * 1024 * 1024,
+        help="Longest sequence to download in full in the load test. Default 16 MiB",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Default 1")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    args = parser.parse_args()
+
+    datadir = Path(args.datadir).resolve()
+    os.environ["INDEXDBPATH"] = str(datadir / args.index)
+    os.environ["SEQPATH"] = f"{datadir}/"
+    sequences = read_sequences(datadir)
+
+    async def run():
+        results: Dict[str, Any] = {"micro": {}, "load": {}}
+        if not args.skip_micro:
+            results["micro"] = await micro_benchmarks(
+                sequences, args.number, args.repeat, random.Random(args.seed)
+            )
+        if not args.skip_load:
+            results["load"] = await load_test(
+                sequences,
+                args.requests,
+                args.concurrency,
+                args.full_max,
+                random.Random(args.seed),
+            )
+        return results
+
+    results = asyncio.run(run())
+
+    dataset = {}
+    if (datadir / "dataset.json").is_file():
+        with open(datadir / "dataset.json") as file:
+            dataset = json.load(file)
+    results["meta"] = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "dataset": dataset,
+        "index": args.index,
+        "args": vars(args),
+    }
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+
+    for section in ("micro", "load"):
+        for name, values in results[section].items():
+            line = ", ".join(f"{key}={value:.4g}" for key, value in values.items())
+            print(f"{section} {name}: {line}")
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
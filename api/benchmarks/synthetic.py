@@ -0,0 +1,274 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Synthetic, reproducible datasets for the benchmarks.
+
+Writes genomes laid out like the ones of the pipeline: for each genome a
+directory named by a uuid, with {seq,cdna,cds,pep}.hashes and the data files
+seqs/{seq,cdna,cds,pep}.txt.zst. Data files are in the zstd seekable format
+with frames of 512 KiB, as written by t2sz (see pipeline/bin/compress.pl).
+The index is then built with pipeline/indexer/create_indexdb.py.
+
+Sequences are random, from a seeded generator, so the same arguments always
+give the same dataset. For example, two genomes with 2 GiB of chromosomes each:
+
+    PYTHONPATH=src python benchmarks/synthetic.py /tmp/refget-bench \\
+        --genomes 2 --genome-size 2G
+
+Needs the zstandard module and, to build the index, tkrzw.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import BinaryIO, List, Tuple
+import argparse
+import hashlib
+import json
+import random
+import struct
+import subprocess
+import sys
+import uuid
+
+import zstandard
+
+FRAME_SIZE = 512 * 1024
+
+# Seek table of the zstd seekable format: a skippable frame with the
+# compressed and uncompressed size of each frame, and a footer
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+
+INDEXER = Path(__file__).parents[2] / "pipeline" / "indexer" / "create_indexdb.py"
+
+# Random bytes are mapped to these alphabets
+NUCLEOTIDES = bytes(b"ACGT"[i % 4] for i in range(256))
+AMINO_ACIDS = bytes(b"ACDEFGHIKLMNPQRSTVWY"[i % 20] for i in range(256))
+
+
+class SeekableWriter:
+    """
+    Write data to a file in the zstd seekable format, one frame per
+    frame_size bytes of data.
+    """
+
+    def __init__(self, file: BinaryIO, frame_size: int = FRAME_SIZE, level: int = 1):
+        self.file = file
+        self.frame_size = frame_size
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.frames: List[Tuple[int, int]] = []
+        self.buffer = bytearray()
+
+    def write(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) >= self.frame_size:
+            self._frame(bytes(self.buffer[: self.frame_size]))
+            del self.buffer[: self.frame_size]
+
+    def _frame(self, data: bytes):
+        compressed = self.compressor.compress(data)
+        self.file.write(compressed)
+        self.frames.append((len(compressed), len(data)))
+
+    def close(self):
+        if self.buffer:
+            self._frame(bytes(self.buffer))
+            self.buffer.clear()
+        table = b"".join(struct.pack("<II", *frame) for frame in self.frames)
+        footer = struct.pack("<IBI", len(self.frames), 0, SEEKABLE_MAGIC)
+        self.file.write(struct.pack("<II", SKIPPABLE_MAGIC, len(table) + len(footer)))
+        self.file.write(table + footer)
+
+
+def sequence_lengths(
+    rng: random.Random, datatype: str, genome_size: int, chromosomes: int, genes: int
+) -> List[int]:
+    """
+    Lengths of the sequences of a data file. Chromosomes split the genome size
+    evenly, transcripts and proteins are drawn from the ranges seen in real
+    genomes.
+    """
+    if datatype == "seq":
+        length = genome_size // chromosomes
+        return [length] * (chromosomes - 1) + [genome_size - length * (chromosomes - 1)]
+    if datatype == "pep":
+        return [rng.randint(50, 2000) for _ in range(genes)]
+    return [rng.randint(150, 6000) for _ in range(genes)]
+
+
+def write_datafile(
+    rng: random.Random,
+    genome_dir: Path,
+    datatype: str,
+    lengths: List[int],
+) -> int:
+    """
+    Write the data file and hashes file of one data type of a genome. The last
+    chromosome is circular. Returns the number of sequences.
+    """
+    alphabet = AMINO_ACIDS if datatype == "pep" else NUCLEOTIDES
+    seqs = genome_dir / "seqs"
+    seqs.mkdir(parents=True, exist_ok=True)
+    with (
+        open(seqs / f"{datatype}.txt.zst", "wb") as datafile,
+        open(genome_dir / f"{datatype}.hashes", "w") as hashes,
+    ):
+        writer = SeekableWriter(datafile)
+        for number, length in enumerate(lengths):
+            md5 = hashlib.md5()
+            sha = hashlib.sha512()
+            remaining = length
+            while remaining > 0:
+                data = rng.randbytes(min(FRAME_SIZE, remaining)).translate(alphabet)
+                md5.update(data)
+                sha.update(data)
+                writer.write(data)
+                remaining -= len(data)
+            circular = "1" if datatype == "seq" and number == len(lengths) - 1 else ""
+            name = f"{datatype}{number + 1}"
+            trunc512 = sha.hexdigest()[:48]
+            print(
+                f"{name}\t{md5.hexdigest()}\t{trunc512}\t\t{length}\t{circular}",
+                file=hashes,
+            )
+        writer.close()
+    return len(lengths)
+
+
+def generate(
+    outdir: Path,
+    genomes: int,
+    genome_size: int,
+    chromosomes: int,
+    genes: int,
+    seed: int,
+) -> List[str]:
+    """
+    Write the genomes of a dataset to outdir. Returns their directory names.
+    """
+    rng = random.Random(seed)
+    dirnames = []
+    for _ in range(genomes):
+        dirname = str(uuid.UUID(int=rng.getrandbits(128), version=1))
+        dirnames.append(dirname)
+        for datatype in ("seq", "cdna", "cds", "pep"):
+            lengths = sequence_lengths(rng, datatype, genome_size, chromosomes, genes)
+            count = write_datafile(rng, outdir / dirname, datatype, lengths)
+            print(f"{dirname} {datatype}: {count} sequences")
+    return dirnames
+
+
+def build_index(outdir: Path, entries: int, index_format: str, static: bool):
+    """
+    Build indexdb.tkh in outdir with the indexer of the pipeline, with frame
+    offsets, and export it to indexdb.sidx if static is set.
+    """
+    dbfile = outdir / "indexdb.tkh"
+    dbfile.unlink(missing_ok=True)
+    subprocess.run(
+        [
+            sys.executable,
+            str(INDEXER),
+            "--datadir",
+            str(outdir),
+            "--dbfile",
+            str(dbfile),
+            "--dbsize",
+            str(max(1000, entries * 12 // 10)),
+            "--format",
+            index_format,
+            "--frame-offsets",
+        ],
+        check=True,
+    )
+    if static:
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "refget.staticindex",
+                str(dbfile),
+                str(outdir / "indexdb.sidx"),
+            ],
+            check=True,
+        )
+
+
+def parse_size(size: str) -> int:
+    """
+    Parse a size like 512M or 2G.
+    """
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if size[-1:].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+    return int(size)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic dataset and its index for the benchmarks."
+    )
+    parser.add_argument("outdir", help="Directory to write the dataset to")
+    parser.add_argument("--genomes", type=int, default=1, help="Default 1")
+    parser.add_argument(
+        "--genome-size",
+        type=parse_size,
+        default=parse_size("256M"),
+        help="Size of the chromosomes of each genome, e.g. 2G. Default 256M",
+    )
+    parser.add_argument(
+        "--chromosomes", type=int, default=20, help="Per genome. Default 20"
+    )
+    parser.add_argument(
+        "--genes",
+        type=int,
+        default=20_000,
+        help="Number of cdna, cds and pep sequences per genome. Default 20000",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Default 1")
+    parser.add_argument(
+        "--format",
+        choices=["text", "binary"],
+        default="binary",
+        help="Format of the index. Default binary",
+    )
+    parser.add_argument(
+        "--static", action="store_true", help="Also write a static index"
+    )
+    parser.add_argument(
+        "--no-index", action="store_true", help="Only write the genomes"
+    )
+    args = parser.parse_args()
+
+    outdir = Path(args.outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    dirnames = generate(
+        outdir,
+        args.genomes,
+        args.genome_size,
+        args.chromosomes,
+        args.genes,
+        args.seed,
+    )
+    with open(outdir / "dataset.json", "w") as dataset:
+        json.dump({"genomes": dirnames, **vars(args)}, dataset, indent=2)
+
+    if not args.no_index:
+        entries = 2 * args.genomes * (args.chromosomes + 3 * args.genes)
+        build_index(outdir, entries, args.format, args.static)
+
+
+if __name__ == "__main__":
+    main()
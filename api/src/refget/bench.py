@@ -0,0 +1,287 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Replay production traffic against a refget server, for capacity planning.
+
+Requests are read from uvicorn access logs, or from trace files with one query
+per line:
+
+    <id>                 the whole sequence
+    <id> <start> <end>   a range of it, end may be "-" for the end
+    <id> metadata        its metadata
+
+Lines of both kinds may be mixed. Only GET and HEAD requests of access logs are
+replayed. Requests are sent to a running server (--url), or to the app in
+process, at a fixed concurrency. Throughput, latency percentiles, bytes/s and
+errors are reported by route:
+
+    refget-bench --url http://localhost:8000 --concurrency 32 access.log
+"""
+
+from __future__ import annotations
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from urllib.parse import urlencode, urlsplit
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+
+import httpx
+
+_ACCESS_LOG = re.compile(r'"(GET|HEAD) (\S+) HTTP/[0-9.]+"')
+_RANGE_PARAMS = re.compile(r"(^|&)(start|end)=")
+
+ROUTES = ("sequence_full", "sequence_range", "metadata", "other")
+
+
+class Query(NamedTuple):
+    method: str
+    # Path with query string
+    path: str
+    route: str
+
+
+def route_of(path: str) -> str:
+    """
+    Route of a request path: a whole sequence, a range of one, metadata, or
+    other.
+    """
+    parts = urlsplit(path)
+    segments = parts.path.rstrip("/").split("/")
+    if "sequence" not in segments[:-1]:
+        return "other"
+    tail = segments[segments.index("sequence") + 1 :]
+    if tail[:1] in (["service-info"], ["batch"]):
+        return "other"
+    if len(tail) == 2 and tail[1] == "metadata":
+        return "metadata"
+    if len(tail) == 1:
+        if _RANGE_PARAMS.search(parts.query):
+            return "sequence_range"
+        return "sequence_full"
+    return "other"
+
+
+def parse_line(line: str) -> Optional[Query]:
+    """
+    Parse a line of an access log or trace file. None for lines without a
+    request to replay.
+    """
+    match = _ACCESS_LOG.search(line)
+    if match is not None:
+        method, path = match.groups()
+        return Query(method, path, route_of(path))
+
+    fields = line.split()
+    if not fields or fields[0].startswith("#"):
+        return None
+    qid = fields[0]
+    if fields[1:] == ["metadata"]:
+        path = f"/sequence/{qid}/metadata"
+    elif len(fields) == 1:
+        path = f"/sequence/{qid}"
+    elif len(fields) == 3 and fields[1].isdigit():
+        params = {"start": fields[1]}
+        if fields[2] != "-":
+            params["end"] = fields[2]
+        path = f"/sequence/{qid}?{urlencode(params)}"
+    else:
+        return None
+    return Query("GET", path, route_of(path))
+
+
+def read_queries(lines: Iterable[str]) -> List[Query]:
+    queries = []
+    for line in lines:
+        query = parse_line(line)
+        if query is not None:
+            queries.append(query)
+    return queries
+
+
+class RouteStats:
+    """
+    Latencies, bytes and errors of the requests of one route.
+    """
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.bytes = 0
+        self.client_errors = 0
+        self.errors = 0
+
+    def report(self, elapsed: float) -> Dict[str, float]:
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+        return {
+            "requests": len(latencies),
+            "requests_per_s": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(0.50) * 1e3,
+            "p95_ms": percentile(0.95) * 1e3,
+            "p99_ms": percentile(0.99) * 1e3,
+            "bytes": self.bytes,
+            "bytes_per_s": self.bytes / elapsed if elapsed else 0.0,
+            "client_errors": self.client_errors,
+            "errors": self.errors,
+        }
+
+
+async def replay(
+    client: httpx.AsyncClient, queries: List[Query], concurrency: int
+) -> Dict[str, Dict[str, float]]:
+    """
+    Send the queries with client, concurrency at a time, in order. Returns the
+    report of each route with requests, and of all of them as "total".
+
+    Errors are responses with a 5xx status and failed requests. Responses with
+    a 4xx status are counted as client errors, and are normal in production
+    traffic (e.g. unknown ids).
+    """
+    stats = {route: RouteStats() for route in ROUTES}
+    total = RouteStats()
+    pending = iter(queries)
+
+    async def send(query: Query):
+        size = 0
+        status = 0
+        started = time.perf_counter()
+        try:
+            async with client.stream(query.method, query.path) as response:
+                status = response.status_code
+                async for chunk in response.aiter_raw():
+                    size += len(chunk)
+        except httpx.HTTPError:
+            pass
+        latency = time.perf_counter() - started
+
+        for route_stats in (stats[query.route], total):
+            route_stats.latencies.append(latency)
+            route_stats.bytes += size
+            if status == 0 or status >= 500:
+                route_stats.errors += 1
+            elif status >= 400:
+                route_stats.client_errors += 1
+
+    async def worker():
+        for query in pending:
+            await send(query)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    report = {
+        route: route_stats.report(elapsed)
+        for route, route_stats in stats.items()
+        if route_stats.latencies
+    }
+    report["total"] = total.report(elapsed)
+    return report
+
+
+def print_report(report: Dict[str, Dict[str, float]], file=sys.stdout):
+    print(
+        f"{'route':<16}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'MB/s':>10}{'4xx':>8}{'errors':>8}",
+        file=file,
+    )
+    for route, values in report.items():
+        print(
+            f"{route:<16}{values['requests']:>10}{values['requests_per_s']:>10.1f}"
+            f"{values['p50_ms']:>10.1f}{values['p95_ms']:>10.1f}"
+            f"{values['p99_ms']:>10.1f}{values['bytes_per_s'] / 1e6:>10.2f}"
+            f"{values['client_errors']:>8}{values['errors']:>8}",
+            file=file,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0].strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n\n".join(__doc__.split("\n\n")[1:]),
+    )
+    parser.add_argument(
+        "files", nargs="+", help='Access logs or trace files, "-" for stdin'
+    )
+    parser.add_argument(
+        "--url",
+        help=(
+            "Base URL of the server, including the mount path if any. Default"
+            " is the app in process, configured from the environment or .env"
+        ),
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="Default 16")
+    parser.add_argument(
+        "--requests", type=int, help="Number of requests to send. Default all"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Number of times to replay the requests. Default 1",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60, help="Request timeout in s. Default 60"
+    )
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    queries = []
+    for name in args.files:
+        if name == "-":
+            queries.extend(read_queries(sys.stdin))
+            continue
+        with open(name) as file:
+            queries.extend(read_queries(file))
+    queries *= args.repeat
+    if args.requests is not None:
+        queries = queries[: args.requests]
+    if not queries:
+        parser.error("No requests to replay")
+
+    transport: Optional[httpx.AsyncBaseTransport] = None
+    base_url = args.url
+    if base_url is None:
+        from refget.main import app
+
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://refget"
+
+    async def run():
+        async with httpx.AsyncClient(
+            transport=transport,
+            base_url=base_url,
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        ) as client:
+            return await replay(client, queries, args.concurrency)
+
+    report = asyncio.run(run())
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Thread pool for blocking reads on the compressed data files.
+
+Seeking and reading an IndexedZstdFile decompresses data and may wait on slow
+(NFS) storage. Doing this on the event loop would stall every other request
+handled by the same worker. The ReadExecutor moves these calls to a bounded
+thread pool.
+"""
+
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Set, TypeVar
+import asyncio
+import weakref
+
+from refget.metrics import READS_INFLIGHT, READS_QUEUED
+
+T = TypeVar("T")
+
+
+class ReadExecutor:
+    """
+    Run blocking reads in a thread pool, with one queue per data file.
+
+    Reads with the same key (normally the data file name) are run one after
+    the other, in the order they were submitted. An IndexedZstdFile only has a
+    single seek cursor, so it must not be used by two threads at once. Reads
+    with different keys run in parallel, up to max_workers at a time.
+
+    The number of outstanding (queued or running) reads is tracked so that
+    callers can reject new work with full() before it is queued.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="refget-read"
+        )
+        self._queues: weakref.WeakValueDictionary[Hashable, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        self._background: Set[asyncio.Future] = set()
+
+    def full(self) -> bool:
+        """
+        True if the read queue is at its depth limit.
+        """
+        return self.pending >= self.max_pending
+
+    def _queue(self, key: Hashable) -> asyncio.Lock:
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = asyncio.Lock()
+            self._queues[key] = queue
+        return queue
+
+    async def run(self, key: Hashable, func: Callable[..., T], *args: Any) -> T:
+        """
+        Queue func(*args) behind all earlier calls for key and run it on the
+        thread pool. Returns the result of the call.
+        """
+        loop = asyncio.get_running_loop()
+        queue = self._queue(key)
+
+        self.pending += 1
+        READS_QUEUED.inc()
+        try:
+            await queue.acquire()
+        except BaseException:
+            self.pending -= 1
+            READS_QUEUED.dec()
+            raise
+
+        def done(_):
+            queue.release()
+            self.pending -= 1
+
+        future = loop.run_in_executor(self._pool, _call, func, args)
+        future.add_done_callback(done)
+        # If the caller goes away (e.g. the client disconnected), the call
+        # keeps running and holds the queue for its key until it is done. It
+        # may be using the file already and cannot be interrupted.
+        return await asyncio.shield(future)
+
+    def close_later(self, key: Hashable, file: Any):
+        """
+        Close file once all reads queued for key have finished.
+        """
+        task = asyncio.ensure_future(self.run(key, file.close))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+
+def _call(func: Callable[..., T], args: tuple) -> T:
+    READS_QUEUED.dec()
+    READS_INFLIGHT.inc()
+    try:
+        return func(*args)
+    finally:
+        READS_INFLIGHT.dec()
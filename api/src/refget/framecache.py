@@ -0,0 +1,106 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Cache of decompressed zstd frames.
+
+The data files are compressed as independent frames of 512 KiB (see
+pipeline/bin/compress.pl). Any read, however small, has to decompress at least
+one whole frame. Popular sequences hit the same few frames over and over, so
+these are kept decompressed in memory, shared by all requests of a worker.
+"""
+
+from __future__ import annotations
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+import asyncio
+
+from cachetools import LRUCache
+
+from refget.metrics import (
+    FRAME_CACHE_BYTES,
+    FRAME_CACHE_EVICTIONS,
+    FRAME_CACHE_HITS,
+    FRAME_CACHE_MISSES,
+)
+
+
+class _FrameLRU(LRUCache):
+    def popitem(self):
+        key, frame = super().popitem()
+        FRAME_CACHE_EVICTIONS.inc()
+        FRAME_CACHE_BYTES.dec(len(frame))
+        return key, frame
+
+
+class FrameCache:
+    """
+    LRU cache of decompressed frames, limited to maxbytes bytes of frame data.
+    A maxbytes of 0 disables caching.
+
+    Frames are keyed by (filename, frame index). Only used from the event loop,
+    so there is no locking. Concurrent requests for a frame that is not cached
+    wait for a single load of it.
+
+    Frames larger than max_frame bytes, by default an eighth of maxbytes, are
+    not cached, so that a single one can't take over the cache.
+    """
+
+    def __init__(self, maxbytes: int, max_frame: Optional[int] = None):
+        self.maxbytes = maxbytes
+        self.max_frame = maxbytes // 8 if max_frame is None else max_frame
+        self._frames: Optional[_FrameLRU] = None
+        if maxbytes > 0:
+            self._frames = _FrameLRU(maxsize=maxbytes, getsizeof=len)
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+
+    async def get(
+        self, key: Hashable, load: Callable[[], Awaitable[bytes]], keep: bool = True
+    ) -> bytes:
+        """
+        Return the frame for key. On a miss, the frame is loaded by awaiting
+        load() and then cached, unless keep is False. Long reads that go over
+        many frames once don't keep them, so they don't flush the hot frames
+        out of the cache.
+        """
+        if self._frames is not None:
+            frame = self._frames.get(key)
+            if frame is not None:
+                FRAME_CACHE_HITS.inc()
+                return frame
+
+        loading = self._loading.get(key)
+        if loading is not None and not loading.done():
+            FRAME_CACHE_HITS.inc()
+            return await asyncio.shield(loading)
+
+        FRAME_CACHE_MISSES.inc()
+        loading = asyncio.ensure_future(load())
+        self._loading[key] = loading
+        try:
+            frame = await asyncio.shield(loading)
+        finally:
+            if self._loading.get(key) is loading:
+                del self._loading[key]
+
+        if keep:
+            self.put(key, frame)
+        return frame
+
+    def put(self, key: Hashable, frame: bytes):
+        if self._frames is None or len(frame) > self.max_frame:
+            return
+        if key in self._frames:
+            return
+        self._frames[key] = frame
+        FRAME_CACHE_BYTES.inc(len(frame))
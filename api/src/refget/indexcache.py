@@ -0,0 +1,68 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Caches of lookups in the index database.
+
+Most traffic is for the same few thousand sequences. Their index records are
+kept parsed in memory, as are the SHA ids of their MD5 ids, so that repeated
+queries need neither a database lookup nor parsing.
+"""
+
+from __future__ import annotations
+from typing import Generic, Hashable, List, Optional, TypeVar
+
+from cachetools import LRUCache
+
+from refget.metrics import INDEX_CACHE_HITS, INDEX_CACHE_MISSES
+
+T = TypeVar("T")
+
+
+class IndexCache(Generic[T]):
+    """
+    LRU cache of up to maxsize index lookups. A maxsize of 0 disables caching.
+
+    Only lookups that found something are cached. name labels the hit and miss
+    metrics of the cache.
+    """
+
+    def __init__(self, name: str, maxsize: int):
+        self._entries: Optional[LRUCache] = None
+        if maxsize > 0:
+            self._entries = LRUCache(maxsize=maxsize)
+        self._hits = INDEX_CACHE_HITS.labels(cache=name)
+        self._misses = INDEX_CACHE_MISSES.labels(cache=name)
+
+    def get(self, key: Hashable) -> Optional[T]:
+        if self._entries is not None:
+            value = self._entries.get(key)
+            if value is not None:
+                self._hits.inc()
+                return value
+        self._misses.inc()
+        return None
+
+    def put(self, key: Hashable, value: T):
+        if self._entries is not None:
+            self._entries[key] = value
+
+    def keys(self) -> List[Hashable]:
+        if self._entries is None:
+            return []
+        return list(self._entries.keys())
+
+    def clear(self):
+        if self._entries is not None:
+            self._entries.clear()
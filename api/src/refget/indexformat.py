@@ -0,0 +1,156 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Formats of the records in the index database.
+
+The index is written by pipeline/indexer/create_indexdb.py in one of two
+formats.
+
+text: keys are the hex SHA (TRUNC512) and MD5 ids. The MD5 key holds the hex
+    SHA id. The SHA key holds "path\tstart\tlength\tname\tmd5\tcircular".
+
+binary: keys are the raw 24 byte SHA and 16 byte MD5 digests. The MD5 key
+    holds the raw SHA digest. The SHA key holds a record of
+
+        version byte (1)
+        file id, unsigned LEB128 varint, index into the path table
+        start, u64 little endian
+        length, u64 little endian
+        flags, one byte. Bit 0: circular
+        md5, raw 16 bytes
+        name, UTF-8, up to the end of the value
+
+    The path table is stored under PATHS_KEY, one path per line. FORMAT_KEY
+    is set to BINARY_FORMAT.
+
+Reserved keys start with a null byte and never have the length of a key of
+either format.
+"""
+
+from __future__ import annotations
+from typing import List, NamedTuple, Optional, Protocol, Tuple
+import struct
+
+FORMAT_KEY = b"\x00refget:format"
+PATHS_KEY = b"\x00refget:paths"
+BINARY_FORMAT = b"1"
+
+RECORD_V1 = 1
+FLAG_CIRCULAR = 1
+_RECORD = struct.Struct("<QQB16s")
+
+
+# Lengths of the keys of ids in either format
+_ID_KEY_LENGTHS = (16, 24, 32, 48)
+
+
+def is_reserved(key: bytes) -> bool:
+    """
+    True for reserved keys. Raw digests may start with a null byte too.
+    """
+    return key[:1] == b"\x00" and len(key) not in _ID_KEY_LENGTHS
+
+
+class IndexRecord(NamedTuple):
+    """
+    Parsed record of a sequence in the index database.
+    """
+
+    path: str
+    start: int
+    length: int
+    name: str
+    md5: str
+    circular: bool
+
+
+class _DB(Protocol):
+    def Get(self, key: bytes) -> Optional[bytes]: ...
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """
+    Decode an unsigned LEB128 varint at pos. Returns the value and the position
+    after it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class IndexFormat:
+    """
+    Encoding of the keys and values of an index database, as found in db.
+    """
+
+    def __init__(self, db: _DB):
+        self.binary = db.Get(FORMAT_KEY) == BINARY_FORMAT
+        self.paths: List[str] = []
+        if self.binary:
+            paths = db.Get(PATHS_KEY)
+            if paths:
+                self.paths = paths.decode("utf-8").split("\n")
+
+    def key(self, hex_id: str) -> bytes:
+        """
+        Return the database key of a hex SHA or MD5 id.
+        """
+        if self.binary:
+            return bytes.fromhex(hex_id)
+        return hex_id.encode()
+
+    def hex_id(self, key: bytes) -> str:
+        """
+        Return the hex id of a database key. The reverse of key().
+        """
+        if self.binary:
+            return key.hex()
+        return key.decode("utf-8")
+
+    def decode_sha(self, value: bytes) -> str:
+        """
+        Return the hex SHA id stored under an MD5 key.
+        """
+        return self.hex_id(value)
+
+    def decode_record(self, value: bytes) -> IndexRecord:
+        """
+        Decode the record stored under a SHA key. Records of both formats are
+        accepted. Raises ValueError for invalid records.
+        """
+        if value[:1] != bytes((RECORD_V1,)):
+            fields = value.decode("utf-8").split("\t")
+            path, start_s, length_s, name, md5 = fields[:5]
+            is_circular = fields[5].strip() == "1" if len(fields) > 5 else False
+            return IndexRecord(
+                path, int(start_s), int(length_s), name, md5, is_circular
+            )
+
+        try:
+            file_id, pos = read_varint(value, 1)
+            start, length, flags, md5_b = _RECORD.unpack_from(value, pos)
+            path = self.paths[file_id]
+        except (IndexError, struct.error) as exc:
+            raise ValueError(f"Invalid binary record: {exc}") from exc
+        name = value[pos + _RECORD.size :].decode("utf-8")
+        return IndexRecord(
+            path, start, length, name, md5_b.hex(), bool(flags & FLAG_CIRCULAR)
+        )
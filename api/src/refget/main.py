@@ -18,14 +18,18 @@ limitations under the License.
 from __future__ import annotations
 from contextlib import asynccontextmanager
 from pathlib import Path as OsPath
-from typing import Optional, Tuple, List
+from typing import AsyncIterator, Dict, Optional, Tuple, List, Union
 from typing_extensions import Annotated
+import asyncio
 import base64
+import json
 import binascii
 import logging
 import os
 import re
 import resource
+import secrets
+import time
 
 from cachetools import LFUCache
 from fastapi import FastAPI, Header, HTTPException, Request, Path
@@ -40,21 +44,46 @@ from starlette.responses import StreamingResponse, PlainTextResponse, FileRespon
 import tkrzw
 import uvicorn
 
+from refget import tracing
+from refget.executor import ReadExecutor
+from refget.framecache import FrameCache
+from refget.indexcache import IndexCache
+from refget.indexformat import IndexFormat, IndexRecord
+from refget.metrics import (
+    DATAFILE_CACHE_EVICTIONS,
+    DATAFILE_CACHE_HITS,
+    DATAFILE_CACHE_MISSES,
+    DATAFILE_OPEN_SECONDS,
+    DECOMPRESSED_BYTES,
+    FRAME_READ_SECONDS,
+    FRAMES_PER_REQUEST,
+    INDEX_LOOKUP_SECONDS,
+    STREAM_SECONDS,
+    datatype_label,
+)
 from refget.models import (
     Metadata,
     Metadata1,
+    MetadataNotFound,
     Organization,
     Refget,
     RefgetServiceInfo,
+    SequenceQuery,
     ServiceType,
 )
+from refget.profiling import ProfilingMiddleware, pyinstrument
+from refget.readers import MmapFile, ReaderPool, zstandard
+from refget.shmcache import SharedFrameCache
+from refget.staticindex import SUFFIX as STATIC_INDEX_SUFFIX, StaticIndex
+from refget.tracing import TracingMiddleware
 
 
 class FHCache(LFUCache):
     def popitem(self):
-        filename, file = super().popitem()
-        file.close()
-        return filename, file
+        filename, datafile = super().popitem()
+        datafile.close()
+        DATAFILE_CACHE_EVICTIONS.labels(datatype=datatype_label(filename)).inc()
+        return filename, datafile
 
 
 # Refget server implementation
@@ -88,20 +117,191 @@ if not OsPath(SEQPATH).is_dir():
 softlimit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
 MAX_OPEN_FILEHANDLES = softlimit - 24
 
-# This cache stores opened file handles with the associated IndexedZstdFile
-# object. It will store up to MAX_OPEN_FILEHANDLES and automatically evict the
+# Number of independent readers that may be opened on the same data file. Each
+# one uses a file handle. Concurrent responses from the same file get their own
+# reader, up to this number. Further responses wait for a reader to be free.
+READERS_PER_FILE: int = config("READERS_PER_FILE", cast=int, default=4)
+
+# Serve data from an uncompressed copy of a data file if there is one, e.g.
+# seq.txt next to seq.txt.zst. The copy is memory mapped and needs no
+# decompression, at the cost of disk space. Create copies for the busiest files
+# or genomes only.
+SERVE_UNCOMPRESSED: bool = config("SERVE_UNCOMPRESSED", cast=bool, default=True)
+
+# This cache stores a ReaderPool (or MmapFile) for each opened data file. It will store up to
+# MAX_OPEN_FILEHANDLES / READERS_PER_FILE pools and automatically evict the
 # least frequently used ones when that limit is reached.
-CACHE = FHCache(maxsize=MAX_OPEN_FILEHANDLES)
+CACHE = FHCache(maxsize=max(1, MAX_OPEN_FILEHANDLES // READERS_PER_FILE))
+
+
+# Index backend: "tkrzw" for a tkrzw HashDBM, "static" for a static index file
+# (see refget.staticindex), or "auto" to use a static index if INDEXDBPATH ends
+# with .sidx and tkrzw otherwise.
+INDEX_BACKEND = config("INDEX_BACKEND", default="auto")
+if INDEX_BACKEND not in ("auto", "tkrzw", "static"):
+    raise SystemExit(
+        f"Error: Invalid INDEX_BACKEND {INDEX_BACKEND}. Use auto, tkrzw or static."
+    )
+
+
+def open_index(path: str) -> tkrzw.DBM | StaticIndex:
+    backend = INDEX_BACKEND
+    if backend == "auto":
+        backend = "static" if path.endswith(STATIC_INDEX_SUFFIX) else "tkrzw"
+    if backend == "static":
+        return StaticIndex(path)
+
+    db = tkrzw.DBM()
+    db.Open(
+        path, False, no_create=True, no_wait=True, truncate=False, dbm="HashDBM"
+    ).OrDie()
+    return db
+
+
+def index_identity(path: str) -> Tuple[int, int, int, int]:
+    """
+    Identity of the index DB file at path, following symlinks. Changes when
+    the file, or the target of the symlink, is replaced or modified.
+    """
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
 
 # Index database
-DB = tkrzw.DBM()
-DB.Open(
-    INDEXDBPATH, False, no_create=True, no_wait=True, truncate=False, dbm="HashDBM"
-).OrDie()
+INDEX_IDENTITY = index_identity(INDEXDBPATH)
+DB = open_index(INDEXDBPATH)
+# Text or binary keys and records, see refget.indexformat
+INDEX_FORMAT = IndexFormat(DB)
+
+# Seconds between checks whether INDEXDBPATH was replaced, e.g. by pointing a
+# symlink at a new index. The new index is then opened and swapped in without a
+# restart. Set to 0 to disable.
+INDEX_RELOAD_INTERVAL: float = config("INDEX_RELOAD_INTERVAL", cast=float, default=0)
+INDEX_RELOAD_LOCK = asyncio.Lock()
+
+# Token for the admin endpoints, sent as "Authorization: Bearer <token>". The
+# admin endpoints are disabled if not set.
+ADMIN_TOKEN = config("ADMIN_TOKEN", default="")
+
+# Profiling of selected sequence and metadata requests, written to PROFILE_DIR.
+# Requests with the header "X-Refget-Profile: <ADMIN_TOKEN>" are profiled, and
+# a PROFILE_SAMPLE_RATE fraction of all others. A worker profiles one request
+# at a time, and at most PROFILE_MAX_PER_MINUTE. PROFILER is "cprofile" or
+# "pyinstrument", which needs the pyinstrument module. Disabled if PROFILE_DIR
+# is not set.
+PROFILE_DIR = config("PROFILE_DIR", default="")
+PROFILE_SAMPLE_RATE: float = config("PROFILE_SAMPLE_RATE", cast=float, default=0)
+PROFILE_MAX_PER_MINUTE: int = config("PROFILE_MAX_PER_MINUTE", cast=int, default=6)
+PROFILE_MAX_FILES: int = config("PROFILE_MAX_FILES", cast=int, default=100)
+PROFILER = config("PROFILER", default="cprofile")
+if PROFILER not in ("cprofile", "pyinstrument"):
+    raise SystemExit(
+        f"Error: Unknown PROFILER {PROFILER}. Use cprofile or pyinstrument."
+    )
+if PROFILE_DIR and PROFILER == "pyinstrument" and pyinstrument is None:
+    raise SystemExit("Error: PROFILER pyinstrument needs the pyinstrument module.")
+
+# Tracing of requests, in spans over their index lookups, data file opens and
+# frame reads. TRACING_EXPORTER is "none", "file" to write spans to
+# TRACING_FILE as JSON lines, or "otlp" to export them with OpenTelemetry,
+# configured by the OTEL_EXPORTER_OTLP_* variables. otlp needs the tracing
+# extra.
+TRACING_EXPORTER = config("TRACING_EXPORTER", default="none")
+TRACING_FILE = config("TRACING_FILE", default="")
+TRACING_SERVICE_NAME = config("TRACING_SERVICE_NAME", default="refget")
+try:
+    tracing.configure(TRACING_EXPORTER, TRACING_FILE, TRACING_SERVICE_NAME)
+except (OSError, RuntimeError, ValueError) as exc:
+    raise SystemExit(f"Error: Cannot set up tracing: {exc}")
+
+# File with sequence ids and data files (relative to SEQPATH) to warm up the
+# caches with at startup, one per line. /ready answers 503 until warm-up is
+# done. POST /admin/dump-hotlist writes the current hot set to this file.
+WARMUP_HOTLIST = config("WARMUP_HOTLIST", default="")
+WARMED_UP = not WARMUP_HOTLIST
+
+# Number of parsed index records, and of MD5 to SHA id mappings, kept in memory.
+# Set to 0 to disable these caches.
+RECORD_CACHE_SIZE: int = config("RECORD_CACHE_SIZE", cast=int, default=100_000)
+RECORD_CACHE: IndexCache[IndexRecord] = IndexCache("record", RECORD_CACHE_SIZE)
+MD5_CACHE: IndexCache[str] = IndexCache("md5", RECORD_CACHE_SIZE)
 
 # Maximum number of (uncompressed) bytes to read per loop iteration. Also
 # controls the minimum response size to start compressing the response.
 CHUNKSIZE = 128 * 1024
+COMPRESS_MIN_SIZE = 2 * CHUNKSIZE
+
+# Sequence responses up to SMALL_RESPONSE_SIZE bytes are read in full and sent
+# with a Content-Length, instead of being streamed. Responses of at least
+# LARGE_RESPONSE_SIZE bytes are streamed in chunks of LARGE_CHUNKSIZE instead
+# of CHUNKSIZE. Chunks never span frames, so with the default of the frame
+# size (see pipeline/bin/compress.pl), each frame is sent as one chunk.
+SMALL_RESPONSE_SIZE: int = config("SMALL_RESPONSE_SIZE", cast=int, default=64 * 1024)
+LARGE_RESPONSE_SIZE: int = config("LARGE_RESPONSE_SIZE", cast=int, default=1024 * 1024)
+LARGE_CHUNKSIZE: int = config("LARGE_CHUNKSIZE", cast=int, default=512 * 1024)
+
+# Serve large reads from compressed data files zstd encoded to clients that
+# accept it (Accept-Encoding: zstd). Frames wholly within a read are sent as
+# they are in the file, only the partial frames at its edges are compressed
+# again. Other clients get gzip or identity encoding. Needs the zstandard module.
+ZSTD_ENCODING: bool = config("ZSTD_ENCODING", cast=bool, default=True)
+
+# Budget in bytes for decompressed zstd frames kept in memory, shared by all
+# requests of a worker. Set to 0 to disable the cache.
+FRAME_CACHE_SIZE: int = config("FRAME_CACHE_SIZE", cast=int, default=64 * 1024 * 1024)
+FRAME_CACHE = FrameCache(maxbytes=FRAME_CACHE_SIZE)
+
+# Number of frames after the current one that a long read from a compressed
+# data file decompresses in the background, while the current one is sent.
+# PREFETCH_MAX_BYTES caps the decompressed data of frames prefetched but not
+# sent yet, over all requests of a worker. Set PREFETCH_FRAMES to 0 to disable.
+PREFETCH_FRAMES: int = config("PREFETCH_FRAMES", cast=int, default=1)
+PREFETCH_MAX_BYTES: int = config(
+    "PREFETCH_MAX_BYTES", cast=int, default=32 * 1024 * 1024
+)
+PREFETCH_BYTES = 0
+
+# Optional second level frame cache in shared memory, used by all workers on a
+# host. Set the path to a file on a tmpfs, e.g. /dev/shm/refget-frames, to
+# enable it. The size counts against the memory of the host (or pod). When this
+# is used, FRAME_CACHE_SIZE can be kept small.
+SHARED_FRAME_CACHE_PATH = config("SHARED_FRAME_CACHE_PATH", default="")
+SHARED_FRAME_CACHE_SIZE: int = config(
+    "SHARED_FRAME_CACHE_SIZE", cast=int, default=1024 * 1024 * 1024
+)
+SHARED_FRAME_CACHE: Optional[SharedFrameCache] = None
+if SHARED_FRAME_CACHE_PATH:
+    try:
+        SHARED_FRAME_CACHE = SharedFrameCache(
+            SHARED_FRAME_CACHE_PATH, SHARED_FRAME_CACHE_SIZE
+        )
+    except (OSError, ValueError) as exc:
+        raise SystemExit(
+            f"Error: Cannot set up shared frame cache at {SHARED_FRAME_CACHE_PATH}: {exc}"
+        )
+
+# Reads on the compressed data files are blocking. They are run on a thread
+# pool so that they don't stall the event loop. READ_WORKERS is the number of
+# threads, READ_QUEUE_LIMIT the number of reads that may be queued or running
+# before new sequence requests are turned away with a 503.
+READ_WORKERS: int = config("READ_WORKERS", cast=int, default=4)
+READ_QUEUE_LIMIT: int = config("READ_QUEUE_LIMIT", cast=int, default=256)
+READ_EXECUTOR = ReadExecutor(max_workers=READ_WORKERS, max_pending=READ_QUEUE_LIMIT)
+
+# How frames of the compressed data files are read. With "indexed_zstd", a
+# reader is checked out from the pool of the file to seek to the frame and
+# decompress it, and a file has at most READERS_PER_FILE reads at a time. With
+# "pread", the compressed bytes of the frame are read with a positional read
+# and decompressed with the zstandard module, so reads of a file don't wait for
+# each other. This helps with many concurrent requests on slow (network)
+# storage. Needs the zstandard module.
+READ_MODE = config("READ_MODE", default="indexed_zstd")
+if READ_MODE not in ("indexed_zstd", "pread"):
+    raise SystemExit(
+        f"Error: Unknown READ_MODE {READ_MODE}. Use indexed_zstd or pread."
+    )
+if READ_MODE == "pread" and zstandard is None:
+    raise SystemExit("Error: READ_MODE pread needs the zstandard module.")
 
 # Version of this app. This is not the protocol version
 SERVICEVERSION = "1.0.2"
@@ -109,6 +309,12 @@ SERVICEVERSION = "1.0.2"
 # Refget media type
 REFGET_MEDIA_TYPE = "text/vnd.ga4gh.refget.v2.0.0+plain; charset=us-ascii"
 
+# Media type of batch responses, one JSON object per line
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Maximum number of queries in one batch request
+BATCH_MAX_QUERIES: int = config("BATCH_MAX_QUERIES", cast=int, default=10_000)
+
 MOUNTPATH = config("MOUNTPATH", default="/")
 DEBUG: bool = config("DEBUG", cast=bool, default=False)
 ROOT_PATH = "" if MOUNTPATH == "/" else MOUNTPATH.rstrip("/")
@@ -141,9 +347,23 @@ async def lifespan(app: FastAPI):
         logging.getLogger(logger).setLevel(LOGLEVEL)
 
     LOG.info("Logging configured. Refget version %s starting.", SERVICEVERSION)
+    if ZSTD_ENCODING and zstandard is None:
+        LOG.warning(
+            "ZSTD_ENCODING is set, but the zstandard module is missing."
+            " Responses are not zstd encoded."
+        )
+
+    tasks = []
+    if INDEX_RELOAD_INTERVAL > 0:
+        tasks.append(asyncio.create_task(watch_index(INDEX_RELOAD_INTERVAL)))
+    if WARMUP_HOTLIST:
+        tasks.append(asyncio.create_task(warm_up(WARMUP_HOTLIST)))
 
     yield
 
+    for task in tasks:
+        task.cancel()
+
 
 app = FastAPI(
     description=(
@@ -166,7 +386,7 @@ app = FastAPI(
 ################################################################################
 # Middleware
 ################################################################################
-app.add_middleware(GZipMiddleware, minimum_size=2 * CHUNKSIZE, compresslevel=1)
+app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE, compresslevel=1)
 
 app.add_middleware(
     CORSMiddleware,
@@ -177,6 +397,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(TracingMiddleware)
+
+if PROFILE_DIR:
+    app.add_middleware(
+        ProfilingMiddleware,
+        spool_dir=PROFILE_DIR,
+        token=ADMIN_TOKEN,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        profiler=PROFILER,
+        max_per_minute=PROFILE_MAX_PER_MINUTE,
+        max_files=PROFILE_MAX_FILES,
+    )
+
 Instrumentator(excluded_handlers=["/metrics"]).instrument(
     app,
     latency_lowr_buckets=(
@@ -204,19 +437,209 @@ Instrumentator(excluded_handlers=["/metrics"]).instrument(
 ################################################################################
 
 
-async def multi_read_zstd(file: IndexedZstdFile, requests: List[Tuple[int, int]]):
+async def open_datafile(filename: str) -> ReaderPool | MmapFile:
+    """
+    Return a reader for a data file from the CACHE, opening it if needed.
+
+    If SERVE_UNCOMPRESSED is set and there is an uncompressed copy of the data
+    file next to it (e.g. seq.txt for seq.txt.zst), the copy is opened as an
+    MmapFile. Otherwise, the file is opened as a ReaderPool.
+    """
+    with tracing.span("open_datafile", {"refget.file": filename}) as span:
+        span.set_attribute("refget.cached", filename in CACHE)
+        return await _open_datafile(filename)
+
+
+async def _open_datafile(filename: str) -> ReaderPool | MmapFile:
+    datatype = datatype_label(filename)
+    if filename in CACHE:
+        DATAFILE_CACHE_HITS.labels(datatype=datatype).inc()
+        return CACHE[filename]
+    DATAFILE_CACHE_MISSES.labels(datatype=datatype).inc()
+    started = time.perf_counter()
+
+    datafile: ReaderPool | MmapFile
+    uncompressed = filename.removesuffix(".zst")
+    if (
+        SERVE_UNCOMPRESSED
+        and uncompressed != filename
+        and OsPath(uncompressed).is_file()
+    ):
+        try:
+            datafile = await READ_EXECUTOR.run(uncompressed, MmapFile, uncompressed)
+        except Exception as exc:
+            LOG.error("Error mapping file: %s", uncompressed, exc_info=exc)
+            raise HTTPException(status_code=500, detail="Internal error. Bad data")
+    else:
+        if not OsPath(filename).is_file():
+            LOG.error("File not found: %s", filename)
+            raise HTTPException(
+                status_code=500, detail="Internal error. Data not found"
+            )
+
+        try:
+            datafile = await ReaderPool.open(
+                filename, READERS_PER_FILE, READ_EXECUTOR, READ_MODE == "pread"
+            )
+        except Exception as exc:
+            LOG.error(
+                "Error creating IndexedZstdFile for file: %s", filename, exc_info=exc
+            )
+            raise HTTPException(status_code=500, detail="Internal error. Bad data")
+
+    DATAFILE_OPEN_SECONDS.labels(datatype=datatype).observe(
+        time.perf_counter() - started
+    )
+
+    # Another request may have opened the same file while this one waited
+    cached = CACHE.setdefault(filename, datafile)
+    if cached is not datafile:
+        datafile.close()
+    return cached
+
+
+async def read_regions(
+    datafile: ReaderPool | MmapFile,
+    regions: List[Tuple[int, int]],
+    frames: Optional[Dict[int, bytes]] = None,
+    chunksize: Optional[int] = None,
+):
+    """
+    Read multiple regions from a data file, compressed or not, see
+    multi_read_zstd.
+    """
+    if isinstance(datafile, MmapFile):
+        for start, length in regions:
+            async for data in read_mmap(datafile, start, length, chunksize):
+                yield data
+    else:
+        async for data in multi_read_zstd(datafile, regions, frames, chunksize):
+            yield data
+
+
+async def read_all(content: AsyncIterator[bytes | memoryview | str]) -> bytes:
+    """
+    Read all chunks of a read, see read_regions. Raises HTTPException if the
+    read failed.
+    """
+    chunks = []
+    async for chunk in content:
+        # Reads report errors in a text chunk, as they may be streaming
+        if isinstance(chunk, str):
+            raise HTTPException(status_code=500, detail="Internal error. Bad data")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def read_mmap(
+    file: MmapFile, start: int, length: int, chunksize: Optional[int] = None
+):
+    """
+    Read from an uncompressed, memory mapped file in chunks.
+
+    Parameters
+    ----------
+    file : MmapFile
+        Uncompressed file to read
+
+    start : int
+        Starting position to read from
+
+    length : int
+        Length of the read
+
+    chunksize : int, optional
+        Maximum size of chunks, CHUNKSIZE by default
+
+    Returns
+    -------
+    Yields chunks as memoryview slices of the map, without copying the data.
+    Each chunk is paged in on the READ_EXECUTOR first.
+    """
+    LOG.debug("read_mmap: file=%s start=%s length=%s", file.name, start, length)
+
+    if start + length > file.size:
+        LOG.error(
+            (
+                "Short read for: file=%s start=%s length=%s. "
+                "Client may have received partial data"
+            ),
+            file.name,
+            start,
+            length,
+        )
+        yield "\n\nIO error. Sequence truncated.\n"
+        return
+
+    # The map stays open until the end of the read, even if the file is closed
+    # in the meantime. If it was closed before the read started, it is mapped
+    # again for this read only.
+    if not file.acquire():
+        try:
+            file = await READ_EXECUTOR.run(file.name, MmapFile, file.name)
+        except Exception as exc:
+            LOG.error("Error opening sequence data: file=%s", file.name, exc_info=exc)
+            yield "\n\nIO error. Sequence truncated.\n"
+            return
+        # Closed right away, so that it is unmapped at the end of the read
+        file.acquire()
+        file.close()
+
+    # The chunks of this read are paged in one after the other, but in
+    # parallel to those of other reads of the same file
+    queue = object()
+    chunkstart = 0
+    try:
+        while chunkstart < length:
+            readlen = min(chunksize or CHUNKSIZE, length - chunkstart)
+            offset = start + chunkstart
+            try:
+                await READ_EXECUTOR.run(queue, file.prefault, offset, readlen)
+                data = file.view[offset : offset + readlen]
+            except Exception as exc:
+                LOG.error(
+                    (
+                        "Error reading sequence data: file=%s start=%s length=%s. "
+                        "Client may have received partial data"
+                    ),
+                    file.name,
+                    start,
+                    length,
+                    exc_info=exc,
+                )
+                yield "\n\nIO error. Sequence truncated.\n"
+                break
+
+            yield data
+            chunkstart += readlen
+    finally:
+        file.release()
+
+
+async def multi_read_zstd(
+    pool: ReaderPool,
+    requests: List[Tuple[int, int]],
+    frames: Optional[Dict[int, bytes]] = None,
+    chunksize: Optional[int] = None,
+):
     """
     Read multiple regions from from zst compressed file in chunks, yield uncompressed data.
 
     Parameters
     ----------
-    file : IndexedZstdFile
-        zst compressed file to read
+    pool : ReaderPool
+        Readers on the zst compressed file to read
 
     requests : List[Tuple[int,int]]
         Each tuple represents where to start to read the compressed zst from and
         length of the read. Both expressed in uncompressed positions
 
+    frames : Dict[int, bytes], optional
+        See read_zstd
+
+    chunksize : int, optional
+        See read_zstd
+
     Returns
     -------
     Yields uncompressed chunks as they are read. Requests are concatenated as a
@@ -224,18 +647,130 @@ async def multi_read_zstd(file: IndexedZstdFile, requests: List[Tuple[int, int]]
     """
     for request in requests:
         start, length = request
-        async for data in read_zstd(file, start, length):
+        async for data in read_zstd(pool, start, length, frames, chunksize):
             yield data
 
 
-async def read_zstd(file: IndexedZstdFile, start: int, length: int):
+def seek_read(file: IndexedZstdFile, offset: int, length: int) -> bytes:
+    """
+    Seek to offset and read length bytes. This blocks while the data is being
+    decompressed, so it is run on the READ_EXECUTOR.
+    """
+    file.seek(offset)
+    return file.read(length)
+
+
+async def read_frame(pool: ReaderPool, index: int, keep: bool = True) -> bytes:
+    """
+    Return frame number index of a zst compressed file, decompressed. The frame
+    is taken from the FRAME_CACHE or the SHARED_FRAME_CACHE if it is there.
+    Otherwise, a reader is checked out from the pool to decompress it on the
+    READ_EXECUTOR. With READ_MODE pread, the frame is read and decompressed on
+    the READ_EXECUTOR without a reader, in parallel to other reads of the file.
+    Frames read are added to the FRAME_CACHE if keep is set.
+    """
+
+    async def load() -> bytes:
+        shared_key = f"{pool.name}:{pool.size}:{index}".encode()
+        if SHARED_FRAME_CACHE is not None:
+            frame = SHARED_FRAME_CACHE.get(shared_key)
+            if frame is not None:
+                return frame
+
+        start = pool.frame_starts[index]
+        length = pool.frame_starts[index + 1] - start
+        started = time.perf_counter()
+        if READ_MODE == "pread":
+            frame = await READ_EXECUTOR.run(object(), pool.read_frame, index)
+        else:
+            async with pool.reader() as file:
+                frame = await READ_EXECUTOR.run(file, seek_read, file, start, length)
+        if len(frame) != length:
+            raise IOError(f"Short read of frame {index} in {pool.name}")
+        datatype = datatype_label(pool.name)
+        FRAME_READ_SECONDS.labels(datatype=datatype).observe(
+            time.perf_counter() - started
+        )
+        DECOMPRESSED_BYTES.labels(datatype=datatype).inc(length)
+
+        if SHARED_FRAME_CACHE is not None:
+            SHARED_FRAME_CACHE.put(shared_key, frame)
+        return frame
+
+    return await FRAME_CACHE.get((pool.name, index), load, keep)
+
+
+def prefetch_frames(
+    pool: ReaderPool,
+    prefetched: Dict[int, Tuple[asyncio.Task, int]],
+    first: int,
+    last: int,
+    frames: Optional[Dict[int, bytes]] = None,
+    keep: bool = True,
+):
+    """
+    Start reading up to PREFETCH_FRAMES frames from first to last (included)
+    in the background, see read_frame. Tasks are added to prefetched by frame
+    index, with the size of their frame. Frames already prefetched or in
+    frames are skipped. Stops at PREFETCH_MAX_BYTES.
+    """
+    global PREFETCH_BYTES
+
+    for index in range(first, min(last + 1, first + PREFETCH_FRAMES, pool.frames)):
+        if index in prefetched or (frames is not None and index in frames):
+            continue
+        size = pool.frame_starts[index + 1] - pool.frame_starts[index]
+        if PREFETCH_BYTES + size > PREFETCH_MAX_BYTES:
+            break
+        PREFETCH_BYTES += size
+        prefetched[index] = (asyncio.ensure_future(read_frame(pool, index, keep)), size)
+
+
+async def take_prefetched(
+    prefetched: Dict[int, Tuple[asyncio.Task, int]], index: int
+) -> Optional[bytes]:
+    """
+    Return the frame prefetched for index, or None if it was not prefetched.
+    """
+    global PREFETCH_BYTES
+
+    if index not in prefetched:
+        return None
+    task, size = prefetched.pop(index)
+    try:
+        return await task
+    finally:
+        PREFETCH_BYTES -= size
+
+
+def cancel_prefetched(prefetched: Dict[int, Tuple[asyncio.Task, int]]):
+    """
+    Cancel prefetches that are no longer needed.
+    """
+    global PREFETCH_BYTES
+
+    for task, size in prefetched.values():
+        task.cancel()
+        # Don't warn about errors of frames nobody is waiting for
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        PREFETCH_BYTES -= size
+    prefetched.clear()
+
+
+async def read_zstd(
+    pool: ReaderPool,
+    start: int,
+    length: int,
+    frames: Optional[Dict[int, bytes]] = None,
+    chunksize: Optional[int] = None,
+):
     """
     Read from zst compressed file in chunks, yield uncompressed data.
 
     Parameters
     ----------
-    file : IndexedZstdFile
-        zst compressed file to read
+    pool : ReaderPool
+        Readers on the zst compressed file to read
 
     start : int
         Starting position to read from
@@ -243,80 +778,444 @@ async def read_zstd(file: IndexedZstdFile, start: int, length: int):
     length : int
         Length of the read
 
+    frames : Dict[int, bytes], optional
+        Frames of this file by index, kept by the caller over several reads.
+        Frames are taken from here first, and frames read are added to it.
+
+    chunksize : int, optional
+        Maximum size of chunks, CHUNKSIZE by default. Chunks don't span frames.
+
     Returns
     -------
-    Yields uncompressed chunks as they are read
+    Yields uncompressed chunks as they are read. The data is
+    read one frame at a time, see read_frame. While the chunks of a frame are
+    consumed, up to PREFETCH_FRAMES further frames of the read are read in the
+    background. Reads of LARGE_RESPONSE_SIZE or more don't add their frames to
+    the FRAME_CACHE.
     """
-    LOG.debug("read_zstd: file=%s start=%s length=%s", file.name, start, length)
-
-    chunkstart = 0
-    while chunkstart < length:
-        try:
-            file.seek(start + chunkstart)
-            readlen = CHUNKSIZE
-            if length - chunkstart < CHUNKSIZE:
-                readlen = length - chunkstart
-            data = file.read(readlen)
-            if len(data) != readlen:
+    LOG.debug("read_zstd: file=%s start=%s length=%s", pool.name, start, length)
+
+    end = start + length
+    position = start
+    index = pool.frame_index(start)
+    last = pool.frame_index(end - 1)
+    keep = length < LARGE_RESPONSE_SIZE
+    prefetched: Dict[int, Tuple[asyncio.Task, int]] = {}
+    try:
+        while position < end:
+            if index >= pool.frames:
                 LOG.error(
                     (
                         "Short read for: file=%s start=%s length=%s. "
                         "Client may have received partial data"
                     ),
-                    file.name,
+                    pool.name,
                     start,
                     length,
                 )
-                # This is a streaming request. A 200 OK header has already been
-                # sent, so there is no way of sending a 500 now. This is the best we
-                # can do.
+                # This is a streaming request. A 200 OK header has already
+                # been sent, so there is no way of sending a 500 now. This is
+                # the best we can do.
                 yield "\n\nIO error. Sequence truncated.\n"
                 break
 
-            chunkstart += readlen
-        except Exception as exc:
-            LOG.error(
-                (
-                    "Error reading sequence data: file=%s start=%s length=%s. "
-                    "Client may have received partial data"
-                ),
-                file.name,
-                start,
-                length,
-                exc_info=exc,
-            )
-            # Same as above, this is the best we can do.
-            # can do.
-            yield "\n\nIO error. Sequence truncated.\n"
-            break
+            if PREFETCH_FRAMES > 0:
+                prefetch_frames(pool, prefetched, index + 1, last, frames, keep)
+
+            try:
+                with tracing.span(
+                    "read_zstd.frame",
+                    {
+                        "refget.file": pool.name,
+                        "refget.frame": index,
+                        "refget.start": max(start, pool.frame_starts[index]),
+                        "refget.end": min(end, pool.frame_starts[index + 1]),
+                    },
+                ) as span:
+                    frame = frames.get(index) if frames is not None else None
+                    if frame is None:
+                        frame = await take_prefetched(prefetched, index)
+                    if frame is None:
+                        frame = await read_frame(pool, index, keep)
+                    if frames is not None:
+                        frames[index] = frame
+                    span.set_attribute("refget.bytes", len(frame))
+            except Exception as exc:
+                LOG.error(
+                    (
+                        "Error reading sequence data: file=%s start=%s length=%s. "
+                        "Client may have received partial data"
+                    ),
+                    pool.name,
+                    start,
+                    length,
+                    exc_info=exc,
+                )
+                # Same as above, this is the best we can do.
+                yield "\n\nIO error. Sequence truncated.\n"
+                break
+
+            # Hand out slices of the frame without copying it
+            view = memoryview(frame)
+            frame_start = pool.frame_starts[index]
+            frame_end = min(end, pool.frame_starts[index + 1])
+            while position < frame_end:
+                readlen = min(chunksize or CHUNKSIZE, frame_end - position)
+                yield view[position - frame_start : position - frame_start + readlen]
+                position += readlen
+
+            index += 1
+    finally:
+        cancel_prefetched(prefetched)
+
+
+def compress_frame(data: bytes | memoryview) -> bytes:
+    """
+    Compress data into a single zstd frame. Blocking.
+    """
+    return zstandard.ZstdCompressor(level=1).compress(data)
 
-        yield data
 
+async def read_zstd_encoded(pool: ReaderPool, regions: List[Tuple[int, int]]):
+    """
+    Read multiple regions from a zst compressed file, yield zstd encoded data.
+
+    Frames wholly within a region are read and sent as they are in the file,
+    without decompressing them. The partial frames at the edges of a region are
+    read with read_frame, cut to the region and compressed again. The chunks
+    are zstd frames, which together decompress to the regions concatenated.
 
-def get_record(qid: str) -> Tuple[str, int, int, str, str, bool]:
+    Returns
+    -------
+    Yields one zstd frame per frame of the data file read.
+    """
+    queue = object()
+    for start, length in regions:
+        LOG.debug(
+            "read_zstd_encoded: file=%s start=%s length=%s", pool.name, start, length
+        )
+        end = start + length
+        for index in range(pool.frame_index(start), pool.frame_index(end - 1) + 1):
+            try:
+                if index >= pool.frames:
+                    raise IOError(f"Read beyond the last frame of {pool.name}")
+                frame_start = pool.frame_starts[index]
+                frame_end = pool.frame_starts[index + 1]
+                if start <= frame_start and frame_end <= end:
+                    data = await READ_EXECUTOR.run(queue, pool.read_compressed, index)
+                else:
+                    frame = memoryview(await read_frame(pool, index))
+                    first = max(start, frame_start) - frame_start
+                    last = min(end, frame_end) - frame_start
+                    part = frame[first:last]
+                    data = await READ_EXECUTOR.run(queue, compress_frame, part)
+            except Exception as exc:
+                LOG.error(
+                    (
+                        "Error reading sequence data: file=%s start=%s length=%s. "
+                        "Client may have received partial data"
+                    ),
+                    pool.name,
+                    start,
+                    length,
+                    exc_info=exc,
+                )
+                # As in read_zstd. This is not valid zstd data, so the client
+                # fails to decode the response instead of taking it as whole.
+                yield "\n\nIO error. Sequence truncated.\n"
+                return
+
+            yield data
+
+
+def frames_touched(pool: ReaderPool, regions: List[Tuple[int, int]]) -> int:
+    """
+    Number of frames of a compressed data file that a read of regions needs.
+    """
+    return sum(
+        pool.frame_index(start + length - 1) - pool.frame_index(start) + 1
+        for start, length in regions
+    )
+
+
+async def timed_stream(content, datatype: str):
+    """
+    Pass the chunks of content through, and record the time until the last one
+    was sent, or the response was aborted, in STREAM_SECONDS.
+    """
+    started = time.perf_counter()
+    try:
+        async for chunk in content:
+            yield chunk
+    finally:
+        STREAM_SECONDS.labels(datatype=datatype).observe(time.perf_counter() - started)
+
+
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """
+    Whether an Accept-Encoding header value accepts the content coding, i.e.
+    lists it without a q value of 0.
+    """
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() != coding:
+            continue
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def get_record(qid: str) -> IndexRecord:
     """
     Do a lookup for a SHA (TRUNC512) query id in the index database.
     Returns a tuple containing the data for the entry.
     """
 
-    record_b = DB.Get(qid.encode())
+    with tracing.span("get_record", {"refget.id": qid}) as span:
+        cached = RECORD_CACHE.get(qid)
+        span.set_attribute("refget.cached", cached is not None)
+        if cached is not None:
+            return cached
 
-    if record_b is None:
-        LOG.info("ID not found: %s", qid)
-        raise HTTPException(status_code=404, detail="Sequence ID not found")
-    record = record_b.decode("utf-8")
-    fields = record.split("\t")
-    path, seqstart, seqlength, name, md5 = fields[:5]
-    is_circular = fields[5].strip() == "1" if len(fields) > 5 else False
+        with INDEX_LOOKUP_SECONDS.labels(lookup="record").time():
+            record_b = DB.Get(INDEX_FORMAT.key(qid))
+
+        if record_b is None:
+            LOG.info("ID not found: %s", qid)
+            raise HTTPException(status_code=404, detail="Sequence ID not found")
+        record = parse_record(qid, record_b)
+        RECORD_CACHE.put(qid, record)
+        return record
+
+
+def parse_record(qid: str, record_b: bytes) -> IndexRecord:
+    """
+    Parse the index database entry record_b of a SHA (TRUNC512) query id.
+    """
 
-    if md5 is None:
-        LOG.error("Invalid record in index DB. qid=%s record=%s", qid, record)
+    try:
+        return INDEX_FORMAT.decode_record(record_b)
+    except ValueError as exc:
+        LOG.error(
+            "Invalid record in index DB. qid=%s record=%r: %s", qid, record_b, exc
+        )
         raise HTTPException(status_code=500, detail="Internal DB error")
 
-    seqstart_i = int(seqstart)
-    seqlength_i = int(seqlength)
 
-    return (path, seqstart_i, seqlength_i, name, md5, is_circular)
+async def reload_index(force: bool = False) -> bool:
+    """
+    Open the index DB at INDEXDBPATH again if it was replaced, or always if
+    force is set, and swap it in for the current one. Returns True if the index
+    was reloaded.
+
+    Lookups in the DB never wait on anything, so no request is using the old
+    DB once it has been swapped out and it can be closed right away. Records
+    and data files of the old index that are in use by responses stay valid.
+    """
+    global DB, INDEX_FORMAT, INDEX_IDENTITY
+
+    async with INDEX_RELOAD_LOCK:
+        try:
+            identity = index_identity(INDEXDBPATH)
+        except OSError as exc:
+            LOG.error("Cannot check index DB %s: %s", INDEXDBPATH, exc)
+            return False
+        if identity == INDEX_IDENTITY and not force:
+            return False
+
+        try:
+            db = await asyncio.to_thread(open_index, INDEXDBPATH)
+            index_format = IndexFormat(db)
+        except (tkrzw.StatusException, OSError, ValueError) as exc:
+            LOG.error("Cannot open new index DB %s: %s", INDEXDBPATH, exc)
+            return False
+
+        old_db = DB
+        DB, INDEX_FORMAT, INDEX_IDENTITY = db, index_format, identity
+        RECORD_CACHE.clear()
+        MD5_CACHE.clear()
+        old_db.Close()
+
+        # Data files of the old index may be gone
+        for filename, datafile in list(CACHE.items()):
+            if not (os.path.exists(filename) and os.path.exists(datafile.name)):
+                del CACHE[filename]
+                datafile.close()
+
+    LOG.info("Index DB %s reloaded", INDEXDBPATH)
+    return True
+
+
+async def watch_index(interval: float):
+    """
+    Reload the index whenever INDEXDBPATH is replaced. Checks every interval
+    seconds.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        await reload_index()
+
+
+def read_hotlist(path: str) -> Tuple[List[str], List[str]]:
+    """
+    Read a hot list file. Returns the sequence ids and the data files in it.
+    Data files are the lines ending in .zst, paths relative to SEQPATH. Empty
+    lines and lines starting with # are skipped.
+    """
+    ids = []
+    files = []
+    with open(path) as hotlist:
+        for line in hotlist:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.endswith(".zst"):
+                files.append(line)
+            else:
+                ids.append(line)
+    return ids, files
+
+
+async def warm_datafile(path: str, start: int = 0):
+    """
+    Open a data file into the CACHE and read the data at start of it, so that
+    the first frame of a sequence is in the frame caches.
+    """
+    datafile = await open_datafile(os.path.join(SEQPATH, path))
+    if isinstance(datafile, ReaderPool):
+        await read_frame(datafile, datafile.frame_index(start))
+    elif start < datafile.size:
+        await READ_EXECUTOR.run(
+            object(), datafile.prefault, start, min(CHUNKSIZE, datafile.size - start)
+        )
+
+
+async def warm_up(path: str):
+    """
+    Warm up the caches with the sequences and data files of the hot list at
+    path, see read_hotlist(). For sequences, this loads their index records and
+    the first frame of their data. For data files, their first frame.
+    """
+    global WARMED_UP
+
+    WARMED_UP = False
+    try:
+        try:
+            ids, files = read_hotlist(path)
+        except OSError as exc:
+            LOG.error("Cannot read warm-up hot list %s: %s", path, exc)
+            return
+        LOG.info("Warming up %s sequences and %s data files", len(ids), len(files))
+
+        warmed = 0
+        for qid in ids:
+            try:
+                sha_id = id_to_sha(qid)
+                if sha_id is None:
+                    continue
+                record = get_record(sha_id)
+                await warm_datafile(record.path, record.start)
+            except (HTTPException, OSError) as exc:
+                LOG.debug("Warm-up of %s failed: %s", qid, exc)
+                continue
+            warmed += 1
+        for file in files:
+            try:
+                await warm_datafile(file)
+            except (HTTPException, OSError) as exc:
+                LOG.debug("Warm-up of %s failed: %s", file, exc)
+                continue
+            warmed += 1
+        LOG.info("Warm-up done. %s of %s entries warmed", warmed, len(ids) + len(files))
+    finally:
+        WARMED_UP = True
+
+
+def write_hotlist(path: str) -> Tuple[int, int]:
+    """
+    Write the sequences and data files in the caches to the hot list at path.
+    Returns the number of each written.
+    """
+    ids = RECORD_CACHE.keys()
+    files = [os.path.relpath(filename, SEQPATH) for filename in CACHE.keys()]
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as hotlist:
+        for line in ids + files:
+            print(line, file=hotlist)
+    os.replace(tmp, path)
+    return len(ids), len(files)
+
+
+def check_read_queue(qid: str):
+    """
+    Don't queue more reads if the read executor is already backed up. Raises
+    HTTPException with a 503 in that case.
+    """
+    if READ_EXECUTOR.full():
+        LOG.warning("Read queue full. Rejecting query for: %s", qid)
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy. Please try again later.",
+            headers={"Retry-After": "1"},
+        )
+
+
+def sequence_regions(
+    start: int, end: Optional[int], seqstart: int, seqlength: int, is_circular: bool
+) -> List[Tuple[int, int]]:
+    """
+    Work out which regions of the data file to read for the part start to end
+    of a sequence. The sequence is found at seqstart in the data file, with
+    length seqlength. An end of None means the end of the sequence.
+
+    Returns a list of (start, length) tuples, in data file positions. Raises
+    HTTPException if the range can't be satisfied.
+    """
+
+    # Treat range constraints
+    if start >= seqlength:
+        LOG.info("Invalid client query with start > end of sequence")
+        # Should be 422, but spec forces 400
+        raise HTTPException(
+            status_code=400, detail="Requested start is beyond end of sequence"
+        )
+
+    if end is None:
+        end = seqlength
+
+    # Refget encodes circular locations as start > end i.e. range goes through the
+    # ori. Since sequences are held linear we split region into two requests
+    #
+    # 1). start to sequence length
+    # 2). 0 to end
+    if start > end:
+        if not is_circular:
+            raise HTTPException(
+                status_code=416,
+                detail="Requested range is not satisfiable for a linear sequence",
+            )
+
+        LOG.debug(
+            f"Circular location detected: {start}-{end}. Splitting into two requests"
+        )
+        regions = [((seqstart + start), (seqlength - start))]
+        # End of 0 is a no-op
+        if end != 0:
+            regions.append((seqstart, end))
+    else:
+        seqstart += start
+        seqlength -= start
+        end = end - start
+        seqlength = min(seqlength, end)
+        regions = [(seqstart, seqlength)]
+
+    return regions
 
 
 def parse_range(range_raw_line: str) -> Tuple[int, int | None]:
@@ -361,14 +1260,33 @@ def id_to_sha(qid: str):
     lookup for the SHA id.
     """
 
+    with tracing.span("id_to_sha", {"refget.id": qid}) as span:
+        md5, sha = parse_id(qid)
+        if md5 is not None:
+            sha = MD5_CACHE.get(md5)
+            span.set_attribute("refget.cached", sha is not None)
+            if sha is None:
+                with INDEX_LOOKUP_SECONDS.labels(lookup="md5").time():
+                    record = DB.Get(INDEX_FORMAT.key(md5))
+                if record is None:
+                    return None
+                sha = INDEX_FORMAT.decode_sha(record)
+                MD5_CACHE.put(md5, sha)
+        return sha
+
+
+def parse_id(qid: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Work out the type of a query id. Returns a tuple (md5, sha), of which at
+    most one is set: the sha (TRUNC512) for SHA and ga4gh type ids, or the MD5
+    for MD5 ids, which need a lookup for the SHA id. Both are None for ids of
+    unknown type.
+    """
+
     if len(qid) == 48 and _is_hex(qid):
-        return qid.lower()
+        return None, qid.lower()
     if len(qid) == 32 and _is_hex(qid):
-        qid = qid.lower()
-        record = DB.Get(qid.encode())
-        if record is None:
-            return None
-        return record.decode("utf-8")
+        return qid.lower(), None
 
     namespace = "ga4gh"
     if ":" in qid:
@@ -378,16 +1296,13 @@ def id_to_sha(qid: str):
     namespace = namespace.lower()
 
     if namespace == "trunc512" and len(qid) == 48 and _is_hex(qid):
-        return qid
+        return None, qid
     if namespace == "md5" and len(qid) == 32 and _is_hex(qid):
-        record = DB.Get(qid.encode())
-        if record is None:
-            return None
-        return record.decode("utf-8")
+        return qid, None
     if namespace == "ga4gh" and (len(qid) == 32 or len(qid) == 35):
-        return ga4gh_to_sha(qid)
+        return None, ga4gh_to_sha(qid)
 
-    return None
+    return None, None
 
 
 def ga4gh_to_sha(qid: str):
@@ -426,7 +1341,7 @@ async def root(request: Request):
 
     root_path = request.scope.get("root_path") or "/"
     root_path = root_path.rstrip("/")
-    doc_path = '/'.join((root_path, 'docs'))
+    doc_path = "/".join((root_path, "docs"))
 
     return HTMLResponse(f"""
         <html>
@@ -445,8 +1360,18 @@ async def root(request: Request):
                 </ul>
             </body>
         </html>
-        """
-    )
+        """)
+
+
+# readiness
+@app.api_route("/ready", methods=["GET", "HEAD"], include_in_schema=False)
+async def ready() -> PlainTextResponse:
+    """
+    Readiness probe. Not ready while the caches are warmed up.
+    """
+    if not WARMED_UP:
+        return PlainTextResponse("Warming up", status_code=503)
+    return PlainTextResponse("Ready")
 
 
 # Serve the favicon
@@ -586,43 +1511,8 @@ async def sequence(
     # Fetch data
     path, seqstart, seqlength, _, _, is_circular = get_record(sha_id)
 
-    # Treat range constraints
-    if start >= seqlength:
-        LOG.info("Invalid client query with start > end of sequence")
-        # Should be 422, but spec forces 400
-        raise HTTPException(
-            status_code=400, detail="Requested start is beyond end of sequence"
-        )
-
-    if end is None:
-        end = seqlength
-
-    # Refget encodes circular locations as start > end i.e. range goes through the
-    # ori. Since sequences are held linear we split region into two requests
-    #
-    # 1). start to sequence length
-    # 2). 0 to end
-    if start > end:
-        if not is_circular:
-            raise HTTPException(
-                status_code=416, detail="Requested range is not satisfiable for a linear sequence"
-            )
-
-        LOG.debug(
-            f"Circular location detected: {start}-{end}. Splitting into two requests"
-        )
-        regions = [((seqstart + start), (seqlength - start))]
-        # End of 0 is a no-op
-        if end != 0:
-            regions.append((seqstart, end))
-        total_seqlength = sum(region[1] for region in regions)
-    else:
-        seqstart += start
-        seqlength -= start
-        end = end - start
-        seqlength = min(seqlength, end)
-        regions = [(seqstart, seqlength)]
-        total_seqlength = seqlength
+    regions = sequence_regions(start, end, seqstart, seqlength, is_circular)
+    total_seqlength = sum(length for _, length in regions)
 
     if total_seqlength == 0:
         return PlainTextResponse("", media_type=REFGET_MEDIA_TYPE)
@@ -639,32 +1529,44 @@ async def sequence(
             headers={"allow": "OPTIONS, GET, HEAD"},
         )
 
-    filename = os.path.join(SEQPATH, path)
-
-    if filename in CACHE:
-        filehandle = CACHE[filename]
-    else:
-        if not OsPath(filename).is_file():
-            LOG.error("File not found: %s", filename)
-            raise HTTPException(
-                status_code=500, detail="Internal error. Data not found"
-            )
-
-        try:
-            filehandle = IndexedZstdFile(filename)
-        except Exception as exc:
-            LOG.error(
-                "Error creating IndexedZstdFile for file: %s", filename, exc_info=exc
-            )
-            raise HTTPException(status_code=500, detail="Internal error. Bad data")
-        CACHE[filename] = filehandle
+    check_read_queue(qid)
 
-    if len(regions) > 1:
-        content = multi_read_zstd(filehandle, regions)
-    else:
-        start, length = regions[0]
-        content = read_zstd(filehandle, start, length)
+    filename = os.path.join(SEQPATH, path)
+    datafile = await open_datafile(filename)
+    datatype = datatype_label(filename)
+    span = tracing.current_span()
+    span.set_attribute("refget.file", filename)
+    span.set_attribute("refget.regions", json.dumps(regions))
+    span.set_attribute("refget.bytes", total_seqlength)
+    if isinstance(datafile, ReaderPool):
+        frames = frames_touched(datafile, regions)
+        FRAMES_PER_REQUEST.labels(datatype=datatype).observe(frames)
+        span.set_attribute("refget.frames", frames)
+
+    # Small reads are sent in one piece, large ones in large chunks
+    if total_seqlength <= SMALL_RESPONSE_SIZE:
+        data = await read_all(timed_stream(read_regions(datafile, regions), datatype))
+        return PlainTextResponse(data, media_type=REFGET_MEDIA_TYPE)
+
+    # Large reads from a compressed file are sent in the compression of the
+    # file to clients that accept it. This response is not compressed again.
+    if (
+        ZSTD_ENCODING
+        and zstandard is not None
+        and isinstance(datafile, ReaderPool)
+        and total_seqlength >= COMPRESS_MIN_SIZE
+        and accepts_encoding(request.headers.get("accept-encoding", ""), "zstd")
+    ):
+        return StreamingResponse(
+            timed_stream(read_zstd_encoded(datafile, regions), datatype),
+            media_type=REFGET_MEDIA_TYPE,
+            headers={"content-encoding": "zstd", "vary": "Accept-Encoding"},
+        )
 
+    chunksize = LARGE_CHUNKSIZE if total_seqlength >= LARGE_RESPONSE_SIZE else None
+    content = timed_stream(
+        read_regions(datafile, regions, chunksize=chunksize), datatype
+    )
     return StreamingResponse(content, media_type=REFGET_MEDIA_TYPE)
 
 
@@ -705,5 +1607,286 @@ async def metadata(qid: str) -> Metadata:
     )
 
 
+# admin
+@app.post("/admin/reload-index", include_in_schema=False)
+async def admin_reload_index(
+    authorization: Optional[str] = Header(None),
+) -> Dict[str, bool]:
+    """
+    Reload the index DB, even if it did not change. Only the worker that
+    handles the request reloads. To reload all workers, use
+    INDEX_RELOAD_INTERVAL.
+    """
+
+    check_admin(authorization)
+    reloaded = await reload_index(force=True)
+    if not reloaded:
+        raise HTTPException(status_code=500, detail="Index reload failed")
+    return {"reloaded": reloaded}
+
+
+@app.post("/admin/dump-hotlist", include_in_schema=False)
+async def admin_dump_hotlist(
+    authorization: Optional[str] = Header(None),
+) -> Dict[str, int]:
+    """
+    Write the sequences and data files in the caches of the worker that
+    handles the request to WARMUP_HOTLIST, for the warm-up of later starts.
+    """
+
+    check_admin(authorization)
+    if not WARMUP_HOTLIST:
+        raise HTTPException(status_code=400, detail="WARMUP_HOTLIST is not set")
+    try:
+        ids, files = await asyncio.to_thread(write_hotlist, WARMUP_HOTLIST)
+    except OSError as exc:
+        LOG.error("Cannot write hot list %s: %s", WARMUP_HOTLIST, exc)
+        raise HTTPException(status_code=500, detail="Cannot write hot list")
+    return {"ids": ids, "files": files}
+
+
+@app.get("/admin/profiles", include_in_schema=False)
+async def admin_profiles(
+    authorization: Optional[str] = Header(None),
+) -> List[str]:
+    """
+    List the profiles in PROFILE_DIR, newest first. Profiles of all workers on
+    the host are listed.
+    """
+
+    check_admin(authorization)
+    if not PROFILE_DIR:
+        raise HTTPException(status_code=400, detail="PROFILE_DIR is not set")
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.is_file()]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [entry.name for entry in entries]
+
+
+@app.get("/admin/profiles/{name}", include_in_schema=False)
+async def admin_profile(
+    name: str,
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Return a profile from PROFILE_DIR, see admin_profiles.
+    """
+
+    check_admin(authorization)
+    if not PROFILE_DIR:
+        raise HTTPException(status_code=400, detail="PROFILE_DIR is not set")
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not OsPath(path).is_file():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path)
+
+
+def check_admin(authorization: Optional[str]):
+    """
+    Check the token of an admin request. The admin endpoints don't exist if
+    no ADMIN_TOKEN is set.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(
+        (authorization or "").encode(), f"Bearer {ADMIN_TOKEN}".encode()
+    ):
+        LOG.warning("Admin request with invalid token")
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+# batch sequence metadata
+@app.post(
+    "/sequence/batch/metadata",
+    response_model=List[Union[Metadata1, MetadataNotFound]],
+    tags=["Sequence metadata"],
+)
+async def metadata_batch(qids: List[str]) -> List[Union[Metadata1, MetadataNotFound]]:
+    """
+    Return the metadata of many query hashes at once, in the order of the
+    query. Hashes that are not found get an entry with an "error" instead of
+    failing the whole request.
+    """
+
+    if len(qids) > BATCH_MAX_QUERIES:
+        LOG.info("Batch query with too many queries: %s", len(qids))
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many queries. At most {BATCH_MAX_QUERIES} are allowed",
+        )
+
+    # One bulk lookup for all MD5 ids not in the cache, then one for all
+    # records not in the cache
+    parsed = [parse_id(qid) for qid in qids]
+    md5_to_sha: Dict[str, str] = {}
+    for md5, _ in parsed:
+        if md5 is not None and md5 not in md5_to_sha:
+            sha = MD5_CACHE.get(md5)
+            if sha is not None:
+                md5_to_sha[md5] = sha
+    md5_keys = {
+        INDEX_FORMAT.key(md5) for md5, _ in parsed if md5 and md5 not in md5_to_sha
+    }
+    if md5_keys:
+        with INDEX_LOOKUP_SECONDS.labels(lookup="md5_batch").time():
+            found = DB.GetMulti(*md5_keys)
+        for md5_b, sha_b in found.items():
+            md5, sha = INDEX_FORMAT.hex_id(md5_b), INDEX_FORMAT.decode_sha(sha_b)
+            md5_to_sha[md5] = sha
+            MD5_CACHE.put(md5, sha)
+    sha_ids = [md5_to_sha.get(md5) if md5 else sha for md5, sha in parsed]
+
+    records: Dict[str, IndexRecord] = {}
+    for sha_id in sha_ids:
+        if sha_id is not None and sha_id not in records:
+            cached = RECORD_CACHE.get(sha_id)
+            if cached is not None:
+                records[sha_id] = cached
+    sha_keys = {INDEX_FORMAT.key(sha) for sha in sha_ids if sha and sha not in records}
+    if sha_keys:
+        with INDEX_LOOKUP_SECONDS.labels(lookup="record_batch").time():
+            found = DB.GetMulti(*sha_keys)
+        for sha_b, record_b in found.items():
+            sha_id = INDEX_FORMAT.hex_id(sha_b)
+            records[sha_id] = parse_record(sha_id, record_b)
+            RECORD_CACHE.put(sha_id, records[sha_id])
+
+    results: List[Union[Metadata1, MetadataNotFound]] = []
+    for qid, sha_id in zip(qids, sha_ids):
+        record = records.get(sha_id) if sha_id is not None else None
+        if sha_id is None or record is None:
+            LOG.info("ID not found: %s", qid)
+            results.append(MetadataNotFound(id=qid))
+            continue
+        results.append(
+            Metadata1(
+                id=qid,
+                md5=record.md5,
+                trunc512=sha_id,
+                ga4gh=sha_to_ga4gh(sha_id),
+                length=record.length,
+                aliases=[],
+            )
+        )
+
+    return results
+
+
+# batch sequence retrieval
+@app.post(
+    "/sequence/batch",
+    tags=["Sequence retrieval"],
+    response_class=StreamingResponse,
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+)
+async def sequence_batch(queries: List[SequenceQuery]) -> StreamingResponse:
+    """
+    Fetch sequence data for many identifiers and ranges in one request.
+
+    Returns one JSON object per line (NDJSON) for each query. The objects are
+    not in the order of the queries. Each has the index of its query in the
+    request, next to its id, start and end. Successful queries have a
+    "sequence", failed queries have the HTTP "status" and an "error" message
+    they would have had as a single request. A query whose read fails after
+    its sequence was partly sent has both, the partial "sequence" and the
+    status 500.
+    """
+
+    if len(queries) > BATCH_MAX_QUERIES:
+        LOG.info("Batch query with too many queries: %s", len(queries))
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many queries. At most {BATCH_MAX_QUERIES} are allowed",
+        )
+    check_read_queue("batch")
+
+    # Look up all queries first, and group them by data file
+    failed: List[Tuple[int, SequenceQuery, HTTPException]] = []
+    by_file: Dict[str, List[Tuple[int, SequenceQuery, List[Tuple[int, int]]]]] = {}
+    for index, query in enumerate(queries):
+        try:
+            sha_id = id_to_sha(query.id)
+            if sha_id is None:
+                LOG.info("ID not found: %s", query.id)
+                raise HTTPException(status_code=404, detail="Sequence ID not found")
+            path, seqstart, seqlength, _, _, is_circular = get_record(sha_id)
+            start = query.start or 0
+            if query.end is not None and start == query.end:
+                regions = []
+            else:
+                regions = sequence_regions(
+                    start, query.end, seqstart, seqlength, is_circular
+                )
+        except HTTPException as exc:
+            failed.append((index, query, exc))
+            continue
+        by_file.setdefault(path, []).append((index, query, regions))
+
+    return StreamingResponse(read_batch(failed, by_file), media_type=NDJSON_MEDIA_TYPE)
+
+
+def batch_line(index: int, query: SequenceQuery, **fields) -> str:
+    """
+    Return the JSON line for a query in a batch, without the newline.
+    """
+    return json.dumps(
+        {"index": index, "id": query.id, "start": query.start, "end": query.end}
+        | fields
+    )
+
+
+async def read_batch(
+    failed: List[Tuple[int, SequenceQuery, HTTPException]],
+    by_file: Dict[str, List[Tuple[int, SequenceQuery, List[Tuple[int, int]]]]],
+):
+    """
+    Yield the lines of a batch response, see sequence_batch. The queries of
+    each data file are read in the order of their position in the file, so
+    that a frame needed by several queries is only read once.
+    """
+    for index, query, exc in failed:
+        yield batch_line(index, query, status=exc.status_code, error=exc.detail) + "\n"
+
+    for path in sorted(by_file):
+        items = sorted(by_file[path], key=lambda item: item[2][0][0] if item[2] else 0)
+        try:
+            datafile = await open_datafile(os.path.join(SEQPATH, path))
+        except HTTPException as exc:
+            for index, query, _ in items:
+                yield (
+                    batch_line(index, query, status=exc.status_code, error=exc.detail)
+                    + "\n"
+                )
+            continue
+
+        frames: Dict[int, bytes] = {}
+        for index, query, regions in items:
+            if regions and isinstance(datafile, ReaderPool):
+                # Later queries start at the same frame or after it. Earlier
+                # frames are only needed again by circular queries, which can
+                # get them from the FRAME_CACHE.
+                first = datafile.frame_index(regions[0][0])
+                for frame_index in [i for i in frames if i < first]:
+                    del frames[frame_index]
+
+            # Stream the sequence into the JSON string as it is read
+            line = batch_line(index, query, sequence="")
+            yield line[: -len('"}')]
+            error = None
+            async for data in read_regions(datafile, regions, frames):
+                # Reads report errors in a text chunk, see read_all. The
+                # sequence sent so far is kept, and flagged as truncated.
+                if isinstance(data, str):
+                    error = {"status": 500, "error": "IO error. Sequence truncated"}
+                    break
+                yield json.dumps(bytes(data).decode("ascii"))[1:-1]
+            if error is None:
+                yield '"}\n'
+            else:
+                yield '", ' + json.dumps(error)[1:] + "\n"
+
+
 if __name__ == "__main__":
     uvicorn.run(app, log_config="logconfig.yaml")
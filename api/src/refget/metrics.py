@@ -0,0 +1,142 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Prometheus metrics for the refget hot paths.
+
+These live in their own module so that they are registered exactly once, even
+if refget.main is reloaded. They are exposed on /metrics together with the
+request metrics of the Instrumentator.
+"""
+
+import os
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Data types of the data files, used as label values. Files with other names
+# are labelled "other", so that the number of series stays bounded.
+DATATYPES = ("seq", "cdna", "cds", "pep")
+
+
+def datatype_label(filename: str) -> str:
+    """
+    Data type of a data file, e.g. cdna for .../seqs/cdna.txt.zst.
+    """
+    datatype = os.path.basename(filename).split(".", 1)[0]
+    return datatype if datatype in DATATYPES else "other"
+
+
+# Gauges are summed over the live uvicorn workers if PROMETHEUS_MULTIPROC_DIR
+# is set.
+READS_INFLIGHT = Gauge(
+    "refget_reads_inflight",
+    "Reads on compressed data files currently running on the read executor",
+    multiprocess_mode="livesum",
+)
+READS_QUEUED = Gauge(
+    "refget_reads_queued",
+    "Reads on compressed data files waiting for the read executor",
+    multiprocess_mode="livesum",
+)
+
+FRAME_CACHE_HITS = Counter(
+    "refget_frame_cache_hits",
+    "Reads of a zstd frame served from the decompressed frame cache",
+)
+FRAME_CACHE_MISSES = Counter(
+    "refget_frame_cache_misses",
+    "Reads of a zstd frame that had to decompress it",
+)
+FRAME_CACHE_EVICTIONS = Counter(
+    "refget_frame_cache_evictions",
+    "Frames evicted from the decompressed frame cache",
+)
+FRAME_CACHE_BYTES = Gauge(
+    "refget_frame_cache_bytes",
+    "Bytes of decompressed frames held in the frame cache",
+    multiprocess_mode="livesum",
+)
+
+SHARED_FRAME_CACHE_HITS = Counter(
+    "refget_shared_frame_cache_hits",
+    "Frames found in the frame cache shared between workers",
+)
+SHARED_FRAME_CACHE_MISSES = Counter(
+    "refget_shared_frame_cache_misses",
+    "Frames not found in the frame cache shared between workers",
+)
+
+INDEX_CACHE_HITS = Counter(
+    "refget_index_cache_hits",
+    "Index lookups served from the cache of parsed records or MD5 ids",
+    ["cache"],
+)
+INDEX_CACHE_MISSES = Counter(
+    "refget_index_cache_misses",
+    "Index lookups that had to go to the index database",
+    ["cache"],
+)
+
+INDEX_LOOKUP_SECONDS = Histogram(
+    "refget_index_lookup_seconds",
+    "Time of lookups in the index database, by kind of lookup",
+    ["lookup"],
+    buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 0.01, 0.05),
+)
+
+DATAFILE_CACHE_HITS = Counter(
+    "refget_datafile_cache_hits",
+    "Data files found open in the file handle cache",
+    ["datatype"],
+)
+DATAFILE_CACHE_MISSES = Counter(
+    "refget_datafile_cache_misses",
+    "Data files that had to be opened",
+    ["datatype"],
+)
+DATAFILE_CACHE_EVICTIONS = Counter(
+    "refget_datafile_cache_evictions",
+    "Data files closed to make room in the file handle cache",
+    ["datatype"],
+)
+DATAFILE_OPEN_SECONDS = Histogram(
+    "refget_datafile_open_seconds",
+    "Time to open a data file on a miss of the file handle cache",
+    ["datatype"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+FRAME_READ_SECONDS = Histogram(
+    "refget_frame_read_seconds",
+    "Time to read and decompress a zstd frame that was not cached",
+    ["datatype"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+DECOMPRESSED_BYTES = Counter(
+    "refget_decompressed_bytes",
+    "Bytes of sequence data decompressed from the data files",
+    ["datatype"],
+)
+FRAMES_PER_REQUEST = Histogram(
+    "refget_frames_per_request",
+    "Frames of a compressed data file touched by a sequence request",
+    ["datatype"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+STREAM_SECONDS = Histogram(
+    "refget_stream_seconds",
+    "Time to read and send the data of a sequence response",
+    ["datatype"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
@@ -116,6 +116,11 @@ class Metadata(BaseModel):
     metadata: Optional[Metadata1] = None
 
 
+class MetadataNotFound(BaseModel):
+    id: str = Field(..., description="Query identifier that was not found")
+    error: str = Field("Sequence ID not found", description="Reason for the failure")
+
+
 class Service(BaseModel):
     id: str = Field(
         ...,
@@ -170,3 +175,21 @@ class Service(BaseModel):
 
 class RefgetServiceInfo(Service):
     refget: Refget
+
+
+class SequenceQuery(BaseModel):
+    id: str = Field(
+        ...,
+        description="Query identifier. MD5, truncated SHA512 and ga4gh identifiers are accepted",
+        json_schema_extra={"example": "482a2b04485ec8c4b5f4eaba2c2002da"},
+    )
+    start: Optional[int] = Field(
+        None,
+        ge=0,
+        description="Start of the range to fetch, 0-based and inclusive. Defaults to 0",
+    )
+    end: Optional[int] = Field(
+        None,
+        ge=0,
+        description="End of the range to fetch, 0-based and exclusive. Defaults to the end of the sequence. If less than start, the range goes over the origin of a circular sequence",
+    )
@@ -0,0 +1,184 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Profiling of selected requests in production.
+
+Requests are profiled if they carry the profiling header with the right token,
+or at random with a sampling rate. Profiles are written to a spool directory,
+as pstats files for cProfile or HTML for pyinstrument.
+
+cProfile records everything that runs on the event loop while the request is
+handled, including other requests that run in between. pyinstrument only
+records the request itself. Neither sees the reads on the read executor
+threads, which show up as time spent waiting.
+"""
+
+from __future__ import annotations
+from collections import deque
+from typing import Any, Deque, Optional, Tuple
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import re
+import secrets
+import time
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import pyinstrument
+except ImportError:  # Optional, only needed for PROFILER=pyinstrument
+    pyinstrument = None  # type: ignore[assignment]
+
+PROFILE_HEADER = "x-refget-profile"
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests to paths starting with one of prefixes.
+
+    A request is profiled if its PROFILE_HEADER is token, or otherwise with a
+    probability of sample_rate. To bound the cost, a worker profiles at most
+    one request at a time and max_per_minute requests a minute. Others are
+    handled as usual. Only the newest max_files profiles are kept in
+    spool_dir. The response to a profiled request has the name of its profile
+    in PROFILE_HEADER.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        spool_dir: str,
+        token: str = "",
+        sample_rate: float = 0.0,
+        profiler: str = "cprofile",
+        max_per_minute: int = 6,
+        max_files: int = 100,
+        prefixes: Tuple[str, ...] = ("/sequence/",),
+    ):
+        if profiler not in ("cprofile", "pyinstrument"):
+            raise ValueError(f"Unknown profiler {profiler}")
+        if profiler == "pyinstrument" and pyinstrument is None:
+            raise RuntimeError("PROFILER pyinstrument needs the pyinstrument module")
+        self.app = app
+        self.spool_dir = spool_dir
+        self.token = token
+        self.sample_rate = sample_rate
+        self.profiler = profiler
+        self.max_per_minute = max_per_minute
+        self.max_files = max_files
+        self.prefixes = prefixes
+        self._active = False
+        self._started: Deque[float] = deque()
+        self._count = 0
+
+    def selected(self, scope: Scope) -> bool:
+        """
+        Whether to profile the request of scope.
+        """
+        if scope["type"] != "http" or self._active:
+            return False
+        if not scope["path"].startswith(self.prefixes):
+            return False
+
+        now = time.monotonic()
+        while self._started and self._started[0] < now - 60:
+            self._started.popleft()
+        if len(self._started) >= self.max_per_minute:
+            return False
+
+        header = Headers(scope=scope).get(PROFILE_HEADER)
+        if self.token and header is not None:
+            if not secrets.compare_digest(header.encode(), self.token.encode()):
+                return False
+        elif random.random() >= self.sample_rate:
+            return False
+
+        self._started.append(now)
+        return True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self.selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self._count += 1
+        path = _UNSAFE.sub("_", scope["path"].strip("/"))[:100]
+        name = (
+            f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._count}-"
+            f"{scope['method']}-{path}"
+        )
+        name += ".prof" if self.profiler == "cprofile" else ".html"
+
+        async def send_with_name(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_HEADER.encode(), name.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        self._active = True
+        profile: Optional[cProfile.Profile] = None
+        profiler: Optional[Any] = None
+        try:
+            if self.profiler == "cprofile":
+                profile = cProfile.Profile()
+                profile.enable()
+            else:
+                profiler = pyinstrument.Profiler(async_mode="enabled")
+                profiler.start()
+            try:
+                await self.app(scope, receive, send_with_name)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                elif profiler is not None:
+                    profiler.stop()
+        finally:
+            self._active = False
+        try:
+            await asyncio.to_thread(self.write, name, profile, profiler)
+        except OSError as exc:
+            logging.getLogger("uvicorn").error("Cannot write profile %s: %s", name, exc)
+
+    def write(
+        self, name: str, profile: Optional[cProfile.Profile], profiler: Optional[Any]
+    ):
+        """
+        Write a profile to the spool directory, and delete the oldest profiles
+        beyond max_files. Blocking.
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, name)
+        if profile is not None:
+            profile.dump_stats(path)
+        elif profiler is not None:
+            with open(path, "w") as output:
+                output.write(profiler.output_html())
+
+        profiles = sorted(
+            (entry for entry in os.scandir(self.spool_dir) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime_ns,
+        )
+        for entry in profiles[: max(0, len(profiles) - self.max_files)]:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,360 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Readers on the sequence data files.
+
+Data files are normally zstd compressed, and read through a ReaderPool. If an
+uncompressed copy of a data file is available, it is read through an MmapFile
+instead.
+"""
+
+from __future__ import annotations
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional
+import asyncio
+import bisect
+import mmap
+import os
+import struct
+import threading
+
+from indexed_zstd import IndexedZstdFile
+
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for positional reads
+    zstandard = None  # type: ignore[assignment]
+
+from refget.executor import ReadExecutor
+
+# Frame offsets sidecar file, written next to a data file by the indexer
+# (pipeline/indexer/create_indexdb.py --frame-offsets). Header of magic,
+# version, number of entries and size of the data file, followed by the
+# (compressed, uncompressed) offset of each frame and of the end of the last.
+FRAMES_SUFFIX = ".frames"
+FRAMES_MAGIC = b"RGFRAMES"
+FRAMES_VERSION = 1
+_FRAMES_HEADER = struct.Struct("<8sIIQ")
+_FRAMES_ENTRY = struct.Struct("<QQ")
+
+
+def read_frame_offsets(filename: str) -> Optional[Dict[int, int]]:
+    """
+    Read the frame offsets of a data file from its sidecar file, in the form
+    of IndexedZstdFile.block_offsets(). None if there is no sidecar file, or it
+    doesn't match the data file.
+    """
+    try:
+        with open(filename + FRAMES_SUFFIX, "rb") as file:
+            data = file.read()
+        size = os.path.getsize(filename)
+    except FileNotFoundError:
+        return None
+
+    if len(data) < _FRAMES_HEADER.size:
+        return None
+    magic, version, count, datasize = _FRAMES_HEADER.unpack_from(data)
+    if (
+        magic != FRAMES_MAGIC
+        or version != FRAMES_VERSION
+        or datasize != size
+        or len(data) != _FRAMES_HEADER.size + count * _FRAMES_ENTRY.size
+        or count == 0
+    ):
+        return None
+    return dict(_FRAMES_ENTRY.iter_unpack(data[_FRAMES_HEADER.size :]))
+
+
+class ReaderPool:
+    """
+    A pool of IndexedZstdFile readers on one data file.
+
+    Each reader has its own seek cursor, so concurrent streams from the same
+    file don't move each other's position and can be read in parallel. The
+    seek table of the file is discovered once, when the pool is created, and
+    given to every further reader. It is read from the frames sidecar file
+    if there is one, see read_frame_offsets().
+
+    Readers are checked out for the duration of a response with reader().
+    At most maxsize readers are opened. When they are all in use, further
+    checkouts wait in line for one to be returned.
+
+    With pread, the pool also keeps a plain file descriptor on the file, for
+    read_frame(). This doesn't need a reader, so any number of frames can be
+    read at the same time. The same descriptor serves read_compressed(), and is
+    opened on first use by pools not opened with pread.
+
+    Creating a pool is blocking, as it reads the sidecar file or scans the
+    data file for its frames. Use ReaderPool.open() from async code.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        maxsize: int,
+        executor: ReadExecutor,
+        pread: bool = False,
+    ):
+        self.name = filename
+        self.maxsize = maxsize
+        self.closed = False
+        self._executor = executor
+
+        first = IndexedZstdFile(filename)
+        offsets = read_frame_offsets(filename)
+        if offsets is not None:
+            first.set_block_offsets(offsets)
+        # Without the offsets, finding the size makes the reader go over all
+        # frames of the file, so the seek table is complete afterwards
+        self.size = first.size()
+        self.block_offsets: Dict[int, int] = first.block_offsets()
+        # Uncompressed start position of each frame, followed by the end of the
+        # last frame. Frame i holds the data from frame_starts[i] up to
+        # frame_starts[i + 1].
+        self.frame_starts: List[int] = sorted(
+            set(self.block_offsets.values()) | {self.size}
+        )
+        self.frames = len(self.frame_starts) - 1
+        # Compressed start position of each frame, followed by the end of the
+        # last frame. Frames that hold no data are skipped.
+        compressed = {
+            uncompressed: offset
+            for offset, uncompressed in sorted(self.block_offsets.items())
+        }
+        self.frame_offsets: List[int] = [
+            compressed[start] for start in self.frame_starts
+        ]
+
+        # File descriptor for positional reads, closed once the pool is closed
+        # and no read is using it any more
+        self._fd: Optional[int] = None
+        self._preads = 0
+        self._fd_lock = threading.Lock()
+        if pread:
+            if zstandard is None:
+                first.close()
+                raise RuntimeError("Positional reads need the zstandard module")
+            self._fd = os.open(filename, os.O_RDONLY)
+
+        self._readers: List[IndexedZstdFile] = [first]
+        self._idle: Deque[IndexedZstdFile] = deque([first])
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._opening = 0
+
+    def frame_index(self, position: int) -> int:
+        """
+        Index of the frame holding the uncompressed position.
+        """
+        return bisect.bisect_right(self.frame_starts, position) - 1
+
+    @classmethod
+    async def open(
+        cls, filename: str, maxsize: int, executor: ReadExecutor, pread: bool = False
+    ) -> ReaderPool:
+        """
+        Create a pool on the read executor.
+        """
+        return await executor.run(filename, cls, filename, maxsize, executor, pread)
+
+    def read_compressed(self, index: int) -> bytes:
+        """
+        Read the compressed data of frame number index as it is in the file,
+        with a positional read. The file descriptor for this is opened on first
+        use if the pool was not opened with pread. Once the pool is closed, it
+        is opened again for responses still streaming from the pool, and closed
+        after each of their reads. Blocking, and safe to run on any number of
+        threads at once.
+        """
+        with self._fd_lock:
+            if self._fd is None:
+                self._fd = os.open(self.name, os.O_RDONLY)
+            fd = self._fd
+            self._preads += 1
+        try:
+            offset = self.frame_offsets[index]
+            return os.pread(fd, self.frame_offsets[index + 1] - offset, offset)
+        finally:
+            self._release_fd()
+
+    def read_frame(self, index: int) -> bytes:
+        """
+        Read frame number index with a positional read of its compressed data,
+        and decompress it. Needs the zstandard module. Blocking, and safe to run
+        on any number of threads at once.
+        """
+        if zstandard is None:
+            raise RuntimeError("Positional reads need the zstandard module")
+        compressed = self.read_compressed(index)
+        length = self.frame_starts[index + 1] - self.frame_starts[index]
+        return zstandard.ZstdDecompressor().decompress(
+            compressed, max_output_size=length
+        )
+
+    def _release_fd(self):
+        with self._fd_lock:
+            self._preads -= 1
+            if self.closed and self._preads == 0 and self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def _new_reader(self) -> IndexedZstdFile:
+        reader = IndexedZstdFile(self.name)
+        reader.set_block_offsets(self.block_offsets)
+        return reader
+
+    async def checkout(self) -> IndexedZstdFile:
+        """
+        Take a reader from the pool. Opens a new one if all readers are in use
+        and the pool is not full yet, otherwise waits for one to be returned.
+        """
+        if self._idle:
+            return self._idle.popleft()
+
+        if len(self._readers) + self._opening < self.maxsize:
+            # Count the reader while it is being opened, so that concurrent
+            # checkouts don't overshoot maxsize.
+            self._opening += 1
+            try:
+                reader = await self._executor.run(self.name, self._new_reader)
+            finally:
+                self._opening -= 1
+            self._readers.append(reader)
+            return reader
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # The reader may have been handed to us just before the
+            # cancellation. Give it back.
+            if waiter.done() and not waiter.cancelled():
+                self.checkin(waiter.result())
+            raise
+
+    def checkin(self, reader: IndexedZstdFile):
+        """
+        Return a reader to the pool, or hand it to the next in line.
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(reader)
+                return
+
+        if self.closed:
+            self._readers.remove(reader)
+            self._executor.close_later(reader, reader)
+        else:
+            self._idle.append(reader)
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[IndexedZstdFile]:
+        """
+        Check out a reader for the duration of the with block.
+        """
+        reader = await self.checkout()
+        try:
+            yield reader
+        finally:
+            self.checkin(reader)
+
+    def close(self):
+        """
+        Close the pool. Idle readers are closed as soon as any reads queued on
+        them are done, readers in use are closed when they are returned.
+        """
+        self.closed = True
+        while self._idle:
+            reader = self._idle.popleft()
+            self._readers.remove(reader)
+            self._executor.close_later(reader, reader)
+        with self._fd_lock:
+            if self._preads == 0 and self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class MmapFile:
+    """
+    An uncompressed data file, memory mapped.
+
+    Reads are memoryview slices of the map. There is no decompression, and no
+    copy of the data is made before it is handed to the server.
+
+    Touching pages that are not in memory yet blocks until they have been read
+    from storage. Use prefault() on the read executor before handing out
+    slices to the event loop.
+    """
+
+    def __init__(self, filename: str):
+        self.name = filename
+        self.closed = False
+        with open(filename, "rb") as file:
+            self.size = os.fstat(file.fileno()).st_size
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self._map)
+        # Reads in progress. The map is closed once the file is closed and the
+        # last of them is done.
+        self._reads = 0
+
+    def acquire(self) -> bool:
+        """
+        Start a read of the file. False if the file is closed and its map is
+        gone. Every successful acquire() must be followed by a release() at
+        the end of the read.
+        """
+        if self.closed and self._reads == 0:
+            return False
+        self._reads += 1
+        return True
+
+    def release(self):
+        """
+        End a read of the file, see acquire().
+        """
+        self._reads -= 1
+        if self.closed and self._reads == 0:
+            self._unmap()
+
+    def prefault(self, start: int, length: int):
+        """
+        Make sure the pages holding start to start + length are in memory.
+        Blocking.
+        """
+        # Copying one byte per page reads them all in
+        bytes(self.view[start : start + length : mmap.PAGESIZE])
+
+    def close(self):
+        """
+        Close the file. The map is closed as soon as no read is using it.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self._reads == 0:
+            self._unmap()
+
+    def _unmap(self):
+        self.view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # Slices are still held, e.g. in a buffer of the server. Without
+            # a reference from here, the map is closed when the last of them
+            # is gone.
+            pass
+        del self._map
@@ -0,0 +1,161 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Cache of decompressed zstd frames in shared memory.
+
+Each uvicorn worker is a separate process with its own FrameCache. With many
+workers, the same frames get decompressed and held once per worker. The
+SharedFrameCache keeps frames in a memory mapped file, normally under /dev/shm,
+that all workers on a host map. A frame decompressed by one worker can then be
+served by all others.
+
+Layout of the file:
+
+    header page (4096 bytes): magic, version, slot size, number of slots
+    slots, each: slot header (sequence number, key digest, data length)
+                 followed by slot_size bytes of data
+
+A frame goes into the one slot chosen by the hash of its key, replacing what
+was there. Writers lock the slot's stripe with a non-blocking POSIX record
+lock and skip the write if another worker holds it. Readers don't lock. They
+use the sequence number of the slot like a seqlock: it is odd while a write
+is in progress and changes with every write, so a read that overlapped a
+write is detected and treated as a miss.
+"""
+
+from __future__ import annotations
+from typing import Optional, Tuple
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+
+from refget.metrics import SHARED_FRAME_CACHE_HITS, SHARED_FRAME_CACHE_MISSES
+
+MAGIC = b"RGFC"
+VERSION = 1
+PAGESIZE = 4096
+
+_HEADER = struct.Struct("<4sIQQ")
+# sequence number, key digest, data length
+_SLOT = struct.Struct("<Q16sI4x")
+_SEQ = struct.Struct("<Q")
+
+# Writers lock one byte per stripe, in the header page after the header
+LOCK_STRIPES = 64
+_LOCK_BASE = 1024
+
+
+class SharedFrameCache:
+    """
+    Frame cache shared between processes through a memory mapped file.
+
+    The file is named after path and the layout, so that workers configured
+    with a different size never map the same file. It is created if needed and
+    never shrunk, as other processes may have it mapped.
+
+    Frames larger than slot_size are not cached. Only used from the event
+    loop of each worker: the record locks are per process, so they don't
+    protect slots against other threads of the same process.
+    """
+
+    def __init__(self, path: str, size: int, slot_size: int = 512 * 1024):
+        slot_stride = -(-(_SLOT.size + slot_size) // PAGESIZE) * PAGESIZE
+        self.slots = max(1, size // slot_stride)
+        self.slot_size = slot_size
+        self._slot_stride = slot_stride
+        self.path = f"{path}-{self.slots}x{slot_size}"
+
+        total = PAGESIZE + self.slots * slot_stride
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Only one process sets up the file
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+            try:
+                if os.fstat(self._fd).st_size < total:
+                    os.ftruncate(self._fd, total)
+                self._map = mmap.mmap(self._fd, total)
+                magic, version, _, _ = _HEADER.unpack_from(self._map, 0)
+                if magic != MAGIC:
+                    _HEADER.pack_into(
+                        self._map, 0, MAGIC, VERSION, self.slot_size, self.slots
+                    )
+                elif version != VERSION:
+                    raise ValueError(
+                        f"Shared frame cache {self.path} has version {version}, "
+                        f"expected {VERSION}"
+                    )
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def _slot(self, key: bytes) -> Tuple[bytes, int, int]:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        slot = int.from_bytes(digest[:8], "little") % self.slots
+        return digest, slot, PAGESIZE + slot * self._slot_stride
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        """
+        Return a copy of the frame cached for key, or None.
+        """
+        digest, _, offset = self._slot(key)
+        seq, slot_digest, length = _SLOT.unpack_from(self._map, offset)
+        if seq & 1 or slot_digest != digest or length > self.slot_size:
+            SHARED_FRAME_CACHE_MISSES.inc()
+            return None
+
+        start = offset + _SLOT.size
+        frame = self._map[start : start + length]
+
+        # The slot may have been rewritten while it was being copied
+        if _SEQ.unpack_from(self._map, offset)[0] != seq:
+            SHARED_FRAME_CACHE_MISSES.inc()
+            return None
+
+        SHARED_FRAME_CACHE_HITS.inc()
+        return frame
+
+    def put(self, key: bytes, frame: bytes):
+        """
+        Store frame under key, unless it is too large or another worker is
+        writing to the same stripe right now.
+        """
+        if len(frame) > self.slot_size:
+            return
+
+        digest, slot, offset = self._slot(key)
+        lock_start = _LOCK_BASE + slot % LOCK_STRIPES
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, lock_start)
+        except OSError:
+            return
+        try:
+            (seq,) = _SEQ.unpack_from(self._map, offset)
+            # Odd while writing. A writer that died halfway left it odd.
+            seq = seq + 1 if seq % 2 == 0 else seq + 2
+            _SEQ.pack_into(self._map, offset, seq)
+            _SLOT.pack_into(self._map, offset, seq, digest, len(frame))
+            start = offset + _SLOT.size
+            self._map[start : start + len(frame)] = frame
+            _SEQ.pack_into(self._map, offset, seq + 1)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, lock_start)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
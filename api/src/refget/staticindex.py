@@ -0,0 +1,335 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Static, read-only index file.
+
+The server only reads the index. A static index holds the same keys and values
+as a tkrzw index DB, sorted by key and packed into pages, in a file that is
+memory mapped by all workers. A fence with the first key of every page is
+searched to find the one page a key can be in, and the slots of that page to
+find the key in it. Both are searched in the map, nothing is copied into the
+memory of a worker. The fence has one byte more than the longest key per page,
+and its pages are shared by all workers in the page cache like the rest of the
+file.
+
+Layout of the file:
+
+    header page: magic, version, page size, number of pages and entries,
+                 fence offset, meta offset and length, fence key width
+    pages: number of entries (u16), the offset of each entry in the page
+           (u16 slots), then the entries sorted by key, each key length (u8),
+           value length (u16), key, value
+    fence: one entry per page, key length (u8) then the first key of the
+           page padded to the fence key width
+    meta: the reserved keys of the index (see refget.indexformat), each key
+          length (u16), value length (u32), key, value
+
+Create one from a tkrzw index DB with
+
+    python -m refget.staticindex indexdb.tkh indexdb.sidx
+"""
+
+from __future__ import annotations
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+
+from refget.indexformat import is_reserved
+
+MAGIC = b"RGSIDX\0\0"
+VERSION = 2
+PAGESIZE = 4096
+SUFFIX = ".sidx"
+
+_HEADER = struct.Struct("<8sIIQQQQQI")
+_PAGE = struct.Struct("<H")
+_SLOT = struct.Struct("<H")
+_ENTRY = struct.Struct("<BH")
+_META = struct.Struct("<HI")
+
+# Entries sorted in memory at once by the exporter, before they are merged
+RUN_SIZE = 1_000_000
+
+
+class _Fence:
+    """
+    The first keys of the pages, as a sequence for bisect. Read from the map.
+    """
+
+    def __init__(self, data: mmap.mmap, offset: int, width: int, pages: int):
+        self._data = data
+        self._offset = offset
+        self._stride = 1 + width
+        self._pages = pages
+
+    def __len__(self) -> int:
+        return self._pages
+
+    def __getitem__(self, index: int) -> bytes:
+        offset = self._offset + index * self._stride
+        length = self._data[offset]
+        return self._data[offset + 1 : offset + 1 + length]
+
+
+class _PageKeys:
+    """
+    The keys of a page, as a sequence for bisect. Read from the map.
+    """
+
+    def __init__(self, data: mmap.mmap, offset: int):
+        self._data = data
+        self._offset = offset
+        (self._count,) = _PAGE.unpack_from(data, offset)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def entry(self, index: int) -> Tuple[int, int, int]:
+        """
+        Return the offset of the key of entry index, and its key and value
+        lengths.
+        """
+        (slot,) = _SLOT.unpack_from(
+            self._data, self._offset + _PAGE.size + index * _SLOT.size
+        )
+        offset = self._offset + slot
+        key_length, value_length = _ENTRY.unpack_from(self._data, offset)
+        return offset + _ENTRY.size, key_length, value_length
+
+    def __getitem__(self, index: int) -> bytes:
+        offset, key_length, _ = self.entry(index)
+        return self._data[offset : offset + key_length]
+
+
+class StaticIndex:
+    """
+    A static index file, opened read-only. Has the methods of tkrzw.DBM that
+    the server uses, so that it can be used in its place.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        try:
+            (
+                magic,
+                version,
+                self.page_size,
+                pages,
+                self.entries,
+                fence_offset,
+                meta_offset,
+                meta_length,
+                width,
+            ) = _HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a static index of version {VERSION}")
+            self.meta = dict(
+                _read_meta(self._view[meta_offset : meta_offset + meta_length])
+            )
+            self._fence = _Fence(self._map, fence_offset, width, pages)
+        except (ValueError, struct.error):
+            self._view.release()
+            self._map.close()
+            raise
+
+    def Get(self, key: bytes) -> Optional[bytes]:
+        if key in self.meta:
+            return self.meta[key]
+
+        page = bisect.bisect_right(self._fence, key) - 1
+        if page < 0:
+            return None
+        keys = _PageKeys(self._map, self.page_size * (page + 1))
+        index = bisect.bisect_left(keys, key)
+        if index == len(keys):
+            return None
+        offset, key_length, value_length = keys.entry(index)
+        if self._map[offset : offset + key_length] != key:
+            return None
+        offset += key_length
+        return self._map[offset : offset + value_length]
+
+    def GetMulti(self, *keys: bytes) -> Dict[bytes, bytes]:
+        found = {}
+        for key in keys:
+            value = self.Get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def Close(self):
+        self._view.release()
+        self._map.close()
+
+
+def _read_meta(data: memoryview) -> Iterator[Tuple[bytes, bytes]]:
+    offset = 0
+    while offset < len(data):
+        key_length, value_length = _META.unpack_from(data, offset)
+        offset += _META.size
+        key = bytes(data[offset : offset + key_length])
+        offset += key_length
+        yield key, bytes(data[offset : offset + value_length])
+        offset += value_length
+
+
+def write_static_index(
+    path: str, items: Iterable[Tuple[bytes, bytes]], page_size: int = PAGESIZE
+):
+    """
+    Write the key value pairs items to a static index at path. Reserved keys
+    go to the meta section.
+
+    items don't need to be sorted. They are sorted in runs of RUN_SIZE entries
+    in temporary files, which are then merged.
+    """
+    if page_size > 65536:
+        raise ValueError("Pages can't be larger than 64 KiB")
+    meta: List[Tuple[bytes, bytes]] = []
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp:
+        runs: List[BinaryIO] = []
+        run: List[Tuple[bytes, bytes]] = []
+        for key, value in items:
+            if is_reserved(key):
+                meta.append((key, value))
+                continue
+            size = _SLOT.size + _ENTRY.size + len(key) + len(value)
+            if len(key) > 255 or size > page_size - _PAGE.size:
+                raise ValueError(f"Entry for key {key!r} does not fit in a page")
+            run.append((key, value))
+            if len(run) >= RUN_SIZE:
+                runs.append(_write_run(tmp, len(runs), run))
+                run = []
+        if run:
+            runs.append(_write_run(tmp, len(runs), run))
+
+        try:
+            _write_pages(path, heapq.merge(*map(_read_run, runs)), meta, page_size)
+        finally:
+            for file in runs:
+                file.close()
+
+
+def _write_run(tmp: str, number: int, run: List[Tuple[bytes, bytes]]) -> BinaryIO:
+    run.sort()
+    file = open(os.path.join(tmp, f"run{number}"), "w+b")
+    for key, value in run:
+        file.write(_ENTRY.pack(len(key), len(value)) + key + value)
+    file.seek(0)
+    return file
+
+
+def _read_run(file: BinaryIO) -> Iterator[Tuple[bytes, bytes]]:
+    while header := file.read(_ENTRY.size):
+        key_length, value_length = _ENTRY.unpack(header)
+        yield file.read(key_length), file.read(value_length)
+
+
+def _write_pages(
+    path: str,
+    entries: Iterator[Tuple[bytes, bytes]],
+    meta: List[Tuple[bytes, bytes]],
+    page_size: int,
+):
+    fence: List[bytes] = []
+    count = 0
+    with open(path, "wb") as out:
+        out.write(bytes(page_size))
+
+        page = bytearray()
+        slots: List[int] = []
+        previous = None
+        for key, value in entries:
+            if key == previous:
+                raise ValueError(f"Duplicate key {key!r}")
+            previous = key
+            entry = _ENTRY.pack(len(key), len(value)) + key + value
+            used = _PAGE.size + (len(slots) + 1) * _SLOT.size + len(page)
+            if used + len(entry) > page_size:
+                out.write(_page(slots, page, page_size))
+                page = bytearray()
+                slots = []
+            if not slots:
+                fence.append(key)
+            slots.append(len(page))
+            page += entry
+            count += 1
+        if slots:
+            out.write(_page(slots, page, page_size))
+
+        width = max((len(key) for key in fence), default=0)
+        fence_offset = out.tell()
+        for key in fence:
+            out.write(bytes((len(key),)) + key.ljust(width, b"\x00"))
+        meta_offset = out.tell()
+        for key, value in meta:
+            out.write(_META.pack(len(key), len(value)) + key + value)
+        meta_length = out.tell() - meta_offset
+
+        out.seek(0)
+        out.write(
+            _HEADER.pack(
+                MAGIC,
+                VERSION,
+                page_size,
+                len(fence),
+                count,
+                fence_offset,
+                meta_offset,
+                meta_length,
+                width,
+            )
+        )
+
+
+def _page(slots: List[int], data: bytearray, page_size: int) -> bytes:
+    # Slots are the offsets of the entries from the start of the page
+    start = _PAGE.size + len(slots) * _SLOT.size
+    header = _PAGE.pack(len(slots)) + b"".join(
+        _SLOT.pack(start + slot) for slot in slots
+    )
+    return (header + data).ljust(page_size, b"\x00")
+
+
+def main():
+    import tkrzw
+
+    parser = argparse.ArgumentParser(
+        description="Export a tkrzw index DB to a static index file."
+    )
+    parser.add_argument("dbfile", help="Index DB to export")
+    parser.add_argument("output", help=f"Static index file to write, e.g. *{SUFFIX}")
+    args = parser.parse_args()
+
+    db = tkrzw.DBM()
+    db.Open(
+        args.dbfile, False, no_create=True, no_wait=True, truncate=False, dbm="HashDBM"
+    ).OrDie()
+    try:
+        write_static_index(args.output, iter(db))
+    finally:
+        db.Close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Tracing of requests, in spans over the lookups and reads of a request.
+
+Tracing is off by default, and spans cost next to nothing then. It can be
+configured to write spans to a file, one JSON object per line, or to export
+them with OpenTelemetry (OTLP over HTTP, which needs the tracing extra). A
+W3C traceparent header on a request continues the trace of the caller, so
+slow refget calls can be found in the traces of the jobs that made them.
+
+Use span() around a piece of work, and current_span() to add attributes to
+the span of the work in progress.
+"""
+
+from __future__ import annotations
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+import contextlib
+import json
+import random
+import re
+import threading
+import time
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    from opentelemetry import propagate, trace as otel_trace
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+        OTLPSpanExporter,
+    )
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+except ImportError:  # Optional, only needed for the otlp exporter
+    otel_trace = None  # type: ignore[assignment]
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Span:
+    """
+    A span that records nothing.
+    """
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def update_name(self, name: str):
+        pass
+
+    def __enter__(self) -> Span:
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NOOP_SPAN = Span()
+
+
+class Tracer:
+    """
+    A tracer that records nothing. See FileTracer and OtelTracer.
+    """
+
+    def span(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        """
+        Context manager for a span named name, a child of the current span.
+        Yields the span.
+        """
+        return NOOP_SPAN
+
+    def current_span(self) -> Span:
+        return NOOP_SPAN
+
+    def request_span(self, name: str, headers: Headers, attributes: Dict[str, Any]):
+        """
+        Like span, for the root span of a request, which continues the trace
+        of the traceparent header if there is one.
+        """
+        return NOOP_SPAN
+
+
+class FileSpan(Span):
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        attributes: Optional[Dict[str, Any]],
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time_ns()
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def update_name(self, name: str):
+        self.name = name
+
+
+class FileTracer(Tracer):
+    """
+    Write spans to a file when they end, one JSON object per line. For local
+    testing and debugging.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+        self._current: ContextVar[Optional[FileSpan]] = ContextVar(
+            "refget_span", default=None
+        )
+
+    @contextlib.contextmanager
+    def _span(
+        self,
+        name: str,
+        attributes: Optional[Dict[str, Any]],
+        parent: Optional[Tuple[str, Optional[str]]],
+    ) -> Iterator[FileSpan]:
+        if parent is None:
+            current = self._current.get()
+            if current is not None:
+                parent = (current.trace_id, current.span_id)
+            else:
+                parent = (f"{random.getrandbits(128):032x}", None)
+        span = FileSpan(name, parent[0], parent[1], attributes)
+        token = self._current.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as exc:
+            error = repr(exc)
+            raise
+        finally:
+            self._current.reset(token)
+            self._write(span, error)
+
+    def _write(self, span: FileSpan, error: Optional[str]):
+        record = {
+            "name": span.name,
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "start_ns": span.start,
+            "end_ns": time.time_ns(),
+            "attributes": span.attributes,
+        }
+        if error is not None:
+            record["error"] = error
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def span(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        return self._span(name, attributes, None)
+
+    def current_span(self) -> Span:
+        return self._current.get() or NOOP_SPAN
+
+    def request_span(self, name: str, headers: Headers, attributes: Dict[str, Any]):
+        parent = None
+        match = _TRACEPARENT.match(headers.get("traceparent", ""))
+        if match is not None:
+            parent = (match[1], match[2])
+        return self._span(name, attributes, parent)
+
+    def close(self):
+        self._file.close()
+
+
+class OtelSpan(Span):
+    def __init__(self, span):
+        self._span = span
+
+    def set_attribute(self, key: str, value: Any):
+        self._span.set_attribute(key, value)
+
+    def update_name(self, name: str):
+        self._span.update_name(name)
+
+
+class OtelTracer(Tracer):
+    """
+    Export spans with OpenTelemetry, over OTLP/HTTP. The exporter is configured
+    with the standard OTEL_EXPORTER_OTLP_* environment variables.
+    """
+
+    def __init__(self, service_name: str):
+        if otel_trace is None:
+            raise RuntimeError("The otlp exporter needs the opentelemetry modules")
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": service_name})
+        )
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        self._provider = provider
+        self._tracer = provider.get_tracer("refget")
+
+    @contextlib.contextmanager
+    def _span(self, name: str, attributes: Optional[Dict[str, Any]], context=None):
+        with self._tracer.start_as_current_span(
+            name, context=context, attributes=attributes
+        ) as span:
+            yield OtelSpan(span)
+
+    def span(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        return self._span(name, attributes)
+
+    def current_span(self) -> Span:
+        return OtelSpan(otel_trace.get_current_span())
+
+    def request_span(self, name: str, headers: Headers, attributes: Dict[str, Any]):
+        return self._span(name, attributes, propagate.extract(headers))
+
+    def close(self):
+        self._provider.shutdown()
+
+
+TRACER: Tracer = Tracer()
+
+
+def configure(exporter: str, path: str = "", service_name: str = "refget"):
+    """
+    Set up the TRACER: "none" for no tracing, "file" to write spans to path,
+    "otlp" to export them with OpenTelemetry.
+    """
+    global TRACER
+
+    if exporter == "none":
+        TRACER = Tracer()
+    elif exporter == "file":
+        if not path:
+            raise ValueError("The file exporter needs a path")
+        TRACER = FileTracer(path)
+    elif exporter == "otlp":
+        TRACER = OtelTracer(service_name)
+    else:
+        raise ValueError(f"Unknown exporter {exporter}")
+
+
+def span(name: str, attributes: Optional[Dict[str, Any]] = None):
+    """
+    Context manager for a span of the TRACER, see Tracer.span.
+    """
+    return TRACER.span(name, attributes)
+
+
+def current_span() -> Span:
+    return TRACER.current_span()
+
+
+class TracingMiddleware:
+    """
+    Trace each HTTP request in a span, with the spans of its work as children.
+
+    The span is named after the method and the route template, e.g.
+    "GET /sequence/{qid}", so that span names don't vary with the ids. Requests
+    that match no route only have the method as name. The path is kept in the
+    http.target attribute.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or type(TRACER) is Tracer:
+            await self.app(scope, receive, send)
+            return
+
+        attributes = {
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+        }
+        if scope.get("query_string"):
+            attributes["http.query"] = scope["query_string"].decode("latin-1")
+        method = scope["method"]
+        with TRACER.request_span(method, Headers(scope=scope), attributes) as span:
+
+            async def send_with_status(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Set by the router of FastAPI once the request is routed
+                route = getattr(scope.get("route"), "path", None)
+                if route is not None:
+                    span.set_attribute("http.route", route)
+                    span.update_name(f"{method} {route}")
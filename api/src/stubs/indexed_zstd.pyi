@@ -20,3 +20,6 @@ class IndexedZstdFile(BufferedReader):
     name: str
 
     def __init__(self, filename: str | Path) -> None: ...
+    def size(self) -> int: ...
+    def block_offsets(self) -> dict[int, int]: ...
+    def set_block_offsets(self, offsets: dict[int, int]) -> None: ...
@@ -13,6 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from typing import Dict
+
+class StatusException(RuntimeError): ...
+
 class DBM:
     name: str
 
@@ -28,3 +32,5 @@ class DBM:
     ) -> DBM: ...
     def OrDie(self): ...
     def Get(self, bytes) -> bytes: ...
+    def GetMulti(self, *keys: bytes) -> Dict[bytes, bytes]: ...
+    def Close(self): ...
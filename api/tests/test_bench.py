@@ -0,0 +1,100 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from refget.bench import Query, parse_line, read_queries, replay, route_of
+
+
+def test_parse_line():
+    access = (
+        "2025-01-01 10:00:00,000 [12] INFO      uvicorn.access: 10.0.0.1:5000 - "
+        '"GET /sequence/482a2b04485ec8c4b5f4eaba2c2002da?start=0&end=10 HTTP/1.1" 200'
+    )
+    assert parse_line(access) == Query(
+        "GET",
+        "/sequence/482a2b04485ec8c4b5f4eaba2c2002da?start=0&end=10",
+        "sequence_range",
+    )
+    assert parse_line('1.2.3.4:1 - "HEAD /sequence/abc HTTP/1.1" 200') == Query(
+        "HEAD", "/sequence/abc", "sequence_full"
+    )
+    # Batch requests have a body, which is not in the log
+    assert parse_line('1.2.3.4:1 - "POST /sequence/batch HTTP/1.1" 200') is None
+
+    assert parse_line("abc") == Query("GET", "/sequence/abc", "sequence_full")
+    assert parse_line("abc 10 20") == Query(
+        "GET", "/sequence/abc?start=10&end=20", "sequence_range"
+    )
+    assert parse_line("abc 10 -") == Query(
+        "GET", "/sequence/abc?start=10", "sequence_range"
+    )
+    assert parse_line("abc metadata") == Query(
+        "GET", "/sequence/abc/metadata", "metadata"
+    )
+    for line in ("", "# comment", "abc 10", "abc x y"):
+        assert parse_line(line) is None
+
+
+def test_route_of():
+    assert route_of("/api/refget/sequence/abc") == "sequence_full"
+    assert route_of("/sequence/abc?end=5") == "sequence_range"
+    assert route_of("/sequence/abc/metadata") == "metadata"
+    assert route_of("/sequence/service-info") == "other"
+    assert route_of("/sequence/batch/metadata") == "other"
+    assert route_of("/metrics") == "other"
+
+
+def test_replay():
+    async def sequence(request):
+        if request.path_params["qid"] == "broken":
+            return PlainTextResponse("", status_code=500)
+        if request.path_params["qid"] == "unknown":
+            return PlainTextResponse("", status_code=404)
+        return PlainTextResponse("ACGT" * 100)
+
+    async def metadata(request):
+        return PlainTextResponse("{}")
+
+    app = Starlette(
+        routes=[
+            Route("/sequence/{qid}", sequence),
+            Route("/sequence/{qid}/metadata", metadata),
+        ]
+    )
+    queries = read_queries(
+        ["abc", "abc 0 10", "abc metadata", "unknown", "broken", "abc"]
+    )
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+            return await replay(client, queries, 3)
+
+    report = asyncio.run(run())
+    assert set(report) == {"sequence_full", "sequence_range", "metadata", "total"}
+    assert report["total"]["requests"] == 6
+    assert report["sequence_full"]["requests"] == 4
+    assert report["sequence_full"]["bytes"] == 800
+    assert report["sequence_full"]["client_errors"] == 1
+    assert report["sequence_full"]["errors"] == 1
+    assert report["metadata"]["bytes"] == 2
+    assert report["total"]["errors"] == 1
+    assert report["total"]["p50_ms"] <= report["total"]["p99_ms"]
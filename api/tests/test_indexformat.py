@@ -0,0 +1,239 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pathlib import Path
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+import tkrzw
+
+from refget.executor import ReadExecutor
+from refget.indexformat import IndexFormat, is_reserved
+from refget.readers import ReaderPool, read_frame_offsets
+
+INDEXER = Path(__file__).parents[2] / "pipeline" / "indexer" / "create_indexdb.py"
+GENOME = "a73351f7-93e7-11ec-a39d-005056b38ce3"
+
+
+def build_index(tmp_path, index_format, *args, name=None):
+    dbfile = str(tmp_path / f"{name or index_format}.tkh")
+    args = args or ("--datadir", "./testdata/", GENOME)
+    run_indexer(dbfile, "--format", index_format, *args)
+    return open_index(dbfile)
+
+
+def run_indexer(dbfile, *args):
+    result = subprocess.run(
+        [sys.executable, str(INDEXER), "--dbfile", dbfile, "--dbsize", "1000", *args],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout
+
+
+def open_index(dbfile):
+    db = tkrzw.DBM()
+    db.Open(
+        dbfile, False, no_create=True, no_wait=True, truncate=False, dbm="HashDBM"
+    ).OrDie()
+    return db
+
+
+def test_binary_format(tmp_path):
+    text_db = build_index(tmp_path, "text")
+    binary_db = build_index(tmp_path, "binary")
+    text = IndexFormat(text_db)
+    binary = IndexFormat(binary_db)
+    assert not text.binary
+    assert binary.binary
+
+    # Every text record has a binary record that decodes to the same
+    records = []
+    for key, value in text_db:
+        if is_reserved(key):
+            continue
+        hex_id = key.decode()
+        binary_value = binary_db.Get(binary.key(hex_id))
+        if len(hex_id) == 32:
+            assert binary.decode_sha(binary_value) == text.decode_sha(value)
+        else:
+            assert binary.decode_record(binary_value) == text.decode_record(value)
+            assert len(binary_value) < len(value)
+            records.append(value)
+    assert records
+
+    # Text records are still understood with a binary index
+    assert binary.decode_record(records[0]) == text.decode_record(records[0])
+
+
+def test_invalid_binary_record(tmp_path):
+    binary = IndexFormat(build_index(tmp_path, "binary"))
+    with pytest.raises(ValueError):
+        binary.decode_record(b"\x01\x00\x01")
+    with pytest.raises(ValueError):
+        binary.decode_record(b"\x01\x7f" + bytes(33))
+
+
+@pytest.mark.parametrize("index_format", ["text", "binary"])
+def test_parallel_build(tmp_path, index_format):
+    # A few genomes, all with the data of the test genome
+    datadir = tmp_path / "data"
+    datadir.mkdir()
+    for n in range(5):
+        genome = datadir / f"{n:08d}-93e7-11ec-a39d-005056b38ce3"
+        genome.symlink_to(Path("testdata", GENOME).resolve())
+
+    args = ("--datadir", str(datadir))
+    sequential = build_index(tmp_path, index_format, *args, name="sequential")
+    parallel = build_index(
+        tmp_path, index_format, "--jobs", "3", *args, name="parallel"
+    )
+    assert dict(parallel) == dict(sequential)
+    assert len(dict(sequential)) > 0
+
+
+def index_contents(db):
+    """
+    Return the decoded records and MD5 to SHA mappings of an index, by hex id.
+    """
+    index = IndexFormat(db)
+    contents = {}
+    for key, value in db:
+        if is_reserved(key):
+            continue
+        hex_id = index.hex_id(key)
+        if len(hex_id) == 32:
+            contents[hex_id] = index.decode_sha(value)
+        else:
+            contents[hex_id] = index.decode_record(value)
+    db.Close()
+    return contents
+
+
+@pytest.mark.parametrize("index_format", ["text", "binary"])
+def test_incremental_build(tmp_path, index_format):
+    source = Path("testdata", GENOME)
+    datadir = tmp_path / "data"
+
+    def add_genome(n, lines=None):
+        genome = datadir / f"{n:08d}-93e7-11ec-a39d-005056b38ce3"
+        genome.mkdir(parents=True)
+        for hashes in source.glob("*.hashes"):
+            if lines is None:
+                (genome / hashes.name).write_bytes(hashes.read_bytes())
+            elif hashes.name == "pep.hashes":
+                with open(hashes, "rb") as file:
+                    (genome / hashes.name).write_bytes(
+                        b"".join(file.readlines()[:lines])
+                    )
+        return genome
+
+    dbfile = str(tmp_path / "incremental.tkh")
+    args = ("--format", index_format, "--datadir", str(datadir))
+
+    def check():
+        # The incremental update gives the same index as a new build
+        output = run_indexer(dbfile, "--incremental", *args)
+        scratch = str(tmp_path / "scratch.tkh")
+        for path in tmp_path.glob("scratch.tkh*"):
+            path.unlink()
+        run_indexer(scratch, *args)
+        assert index_contents(open_index(dbfile)) == index_contents(open_index(scratch))
+        return output
+
+    first = add_genome(1)
+    second = add_genome(2, lines=100)
+    output = check()
+    assert "2 new, 0 changed, 0 removed and 0 unchanged genomes" in output
+
+    output = check()
+    assert "0 new, 0 changed, 0 removed and 2 unchanged genomes" in output
+    assert "DB insert" not in output
+
+    # Fewer peptides in the second genome. Those still in the first genome are
+    # restored.
+    with open(second / "pep.hashes", "rb") as file:
+        lines = file.readlines()
+    (second / "pep.hashes").write_bytes(b"".join(lines[:50]))
+    output = check()
+    assert "0 new, 1 changed, 0 removed and 1 unchanged genomes" in output
+    assert "Restoring 50 records" in output
+
+    add_genome(3, lines=10)
+    output = check()
+    assert "1 new, 0 changed, 0 removed and 2 unchanged genomes" in output
+
+    # A touched but unchanged file is not indexed again
+    os.utime(second / "pep.hashes")
+    output = check()
+    assert "0 new, 0 changed, 0 removed and 3 unchanged genomes" in output
+
+    shutil.rmtree(second)
+    output = check()
+    assert "0 new, 0 changed, 1 removed and 2 unchanged genomes" in output
+
+    # A changed genome that sorts before another genome with the same
+    # sequences. Those keep the record of the later genome.
+    with open(first / "pep.hashes", "rb") as file:
+        lines = file.readlines()
+    (first / "pep.hashes").write_bytes(b"".join(lines[:-1]))
+    output = check()
+    assert "0 new, 1 changed, 0 removed and 1 unchanged genomes" in output
+
+    # Deleted sequences that are in several genomes are restored from the last
+    fifth = add_genome(5, lines=20)
+    check()
+    with open(fifth / "pep.hashes", "rb") as file:
+        lines = file.readlines()
+    (fifth / "pep.hashes").write_bytes(b"".join(lines[:5]))
+    output = check()
+    assert "0 new, 1 changed, 0 removed and 2 unchanged genomes" in output
+    assert "Restoring 15 records" in output
+
+
+def test_frame_offsets(tmp_path):
+    datadir = tmp_path / "data"
+    shutil.copytree(Path("testdata", GENOME), datadir / GENOME)
+    seqfile = str(datadir / GENOME / "seqs" / "seq.txt.zst")
+    executor = ReadExecutor(1, 1)
+
+    scanned = ReaderPool(seqfile, 1, executor)
+    assert read_frame_offsets(seqfile) is None
+
+    run_indexer(
+        str(tmp_path / "index.tkh"), "--datadir", str(datadir), "--frame-offsets"
+    )
+    offsets = read_frame_offsets(seqfile)
+    assert offsets == scanned.block_offsets
+
+    pool = ReaderPool(seqfile, 1, executor)
+    assert pool.size == scanned.size == 4641652
+    assert pool.frame_starts == scanned.frame_starts
+    first, second = scanned._idle[0], pool._idle[0]
+    for position in (0, 524288 - 10, scanned.size - 100):
+        first.seek(position)
+        second.seek(position)
+        assert first.read(100) == second.read(100)
+
+    # A sidecar file that doesn't match its data file is ignored
+    with open(seqfile, "ab") as file:
+        file.write(b"\0")
+    assert read_frame_offsets(seqfile) is None
+    first.close()
+    second.close()
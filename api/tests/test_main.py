@@ -13,18 +13,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import httpx
+import json
 import os
 import refget
 import logging
 import hashlib
 import pytest
+import weakref
 from importlib import reload
+from prometheus_client import REGISTRY
 
 os.environ["INDEXDBPATH"] = "./testdata/indexdb.tkh"
 os.environ["SEQPATH"] = "./testdata/"
 
 from fastapi.testclient import TestClient
+from indexed_zstd import IndexedZstdFile
 from refget.main import app
+from refget.executor import ReadExecutor
+from refget.readers import MmapFile
+from refget.staticindex import StaticIndex, write_static_index
 
 
 client = TestClient(app)
@@ -50,6 +59,17 @@ def test_lifecycle(caplog):
         caplog.records.pop(0)
 
 
+def test_lifecycle_zstd_encoding_missing(caplog, monkeypatch):
+    monkeypatch.setattr(refget.main, "zstandard", None)
+    with TestClient(app):
+        pass
+    assert any(
+        record.levelname == "WARNING" and "ZSTD_ENCODING is set" in record.message
+        for record in caplog.records
+    )
+    caplog.clear()
+
+
 def test_read_main():
     response = client.get("/")
     assert response.status_code == 200
@@ -392,6 +412,820 @@ def test_read_meta():
     assert response.status_code == 404
 
 
+def test_concurrent_reads():
+    # Ranges of the same sequence, read concurrently, are the same as when read
+    # one after the other
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    ranges = [{"start": s, "end": s + 300_000} for s in range(0, 4_000_000, 500_000)]
+    expected = [client.get(url, params=params).text for params in ranges]
+
+    async def fetch_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as aclient:
+            return await asyncio.gather(
+                *(aclient.get(url, params=params) for params in ranges)
+            )
+
+    responses = asyncio.run(fetch_all())
+    assert [response.status_code for response in responses] == [200] * len(ranges)
+    assert [response.text for response in responses] == expected
+
+    # All readers went back to the pool, and no more than allowed were opened
+    pool = refget.main.CACHE[
+        os.path.join(
+            refget.main.SEQPATH, "a73351f7-93e7-11ec-a39d-005056b38ce3/seqs/seq.txt.zst"
+        )
+    ]
+    assert 1 <= len(pool._idle) <= refget.main.READERS_PER_FILE
+
+
+def test_frame_cache(monkeypatch):
+    def sample(name):
+        return REGISTRY.get_sample_value(f"refget_frame_cache_{name}_total") or 0
+
+    # A range spanning a frame boundary (frames are 512 KiB) reads two frames
+    params = {"start": 524_000, "end": 525_000}
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    response = client.get(url, params=params)
+    assert response.status_code == 200
+    assert len(response.text) == 1000
+
+    # The second time, both come from the cache
+    hits, misses = sample("hits"), sample("misses")
+    response_cached = client.get(url, params=params)
+    assert response_cached.text == response.text
+    assert sample("hits") == hits + 2
+    assert sample("misses") == misses
+
+    # Data is the same with the cache disabled
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+    response_uncached = client.get(url, params=params)
+    assert response_uncached.text == response.text
+    assert sample("misses") == misses + 2
+
+
+def test_frame_cache_long_reads(monkeypatch):
+    # A cache of 8 frames, smaller than the sequence (9 frames)
+    cache = refget.main.FrameCache(4 * 1024 * 1024)
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", cache)
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    filename = os.path.join(refget.main.SEQPATH, GENOME, "seqs", "seq.txt.zst")
+
+    # A hot range in the first frame is cached
+    assert client.get(url, params={"start": 0, "end": 100}).status_code == 200
+    assert len(cache._frames) == 1
+
+    # Full downloads don't add their frames, and leave the hot frame cached
+    response = client.get(url)
+    assert response.status_code == 200
+    assert len(response.text) == 4641652
+    assert list(cache._frames.keys()) == [(filename, 0)]
+
+    # Frames over an eighth of the cache are not cached
+    small = refget.main.FrameCache(1024 * 1024)
+    small.put(("file", 0), b"A" * (small.max_frame + 1))
+    assert len(small._frames) == 0
+
+
+def test_shared_frame_cache(monkeypatch, tmp_path):
+    def sample(name):
+        return REGISTRY.get_sample_value(f"refget_shared_frame_cache_{name}_total") or 0
+
+    # Frames decompressed by one worker are found by the others. Disable the
+    # frame cache of this worker to see that.
+    shared = refget.main.SharedFrameCache(str(tmp_path / "frames"), 8 * 1024 * 1024)
+    monkeypatch.setattr(refget.main, "SHARED_FRAME_CACHE", shared)
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    params = {"start": 2_000_000, "end": 2_000_100}
+    response = client.get(url, params=params)
+    assert response.status_code == 200
+    hits = sample("hits")
+    response_shared = client.get(url, params=params)
+    assert response_shared.text == response.text
+    assert sample("hits") == hits + 1
+    shared.close()
+
+
+def test_prefetch(monkeypatch):
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+    monkeypatch.setattr(refget.main, "PREFETCH_FRAMES", 0)
+    # Decompressed responses. zstd encoded ones are tested below.
+    headers = {"Accept-Encoding": "gzip"}
+    expected = client.get(url, headers=headers).text
+
+    # Count the frames being read at the same time
+    read_frame = refget.main.read_frame
+    inflight = []
+    most = 0
+
+    async def counting_read_frame(pool, index, keep=True):
+        nonlocal most
+        inflight.append(index)
+        most = max(most, len(inflight))
+        try:
+            return await read_frame(pool, index, keep)
+        finally:
+            inflight.remove(index)
+
+    monkeypatch.setattr(refget.main, "read_frame", counting_read_frame)
+    response = client.get(url, headers=headers)
+    assert response.text == expected
+    assert most == 1
+
+    monkeypatch.setattr(refget.main, "PREFETCH_FRAMES", 2)
+    response = client.get(url, headers=headers)
+    assert response.text == expected
+    assert most == 3
+    assert refget.main.PREFETCH_BYTES == 0
+
+    # Nothing is prefetched beyond the memory cap
+    most = 0
+    monkeypatch.setattr(refget.main, "PREFETCH_MAX_BYTES", 1000)
+    params = {"start": 100_000, "end": 2_000_000}
+    response = client.get(url, params=params, headers=headers)
+    assert response.text == expected[100_000:2_000_000]
+    assert most == 1
+    assert refget.main.PREFETCH_BYTES == 0
+
+
+def test_prefetch_zstd_encoding(monkeypatch):
+    pytest.importorskip("zstandard")
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+    monkeypatch.setattr(refget.main, "PREFETCH_FRAMES", 2)
+
+    read_frame = refget.main.read_frame
+    decompressed = []
+
+    async def counting_read_frame(pool, index, keep=True):
+        decompressed.append(index)
+        return await read_frame(pool, index, keep)
+
+    monkeypatch.setattr(refget.main, "read_frame", counting_read_frame)
+    headers = {"Accept-Encoding": "zstd"}
+
+    # Whole frames are sent as they are in the file, nothing is decompressed
+    # or prefetched
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert decompressed == []
+
+    # Only the frames at the edges of a range are decompressed
+    params = {"start": 100_000, "end": 2_000_000}
+    response = client.get(url, params=params, headers=headers)
+    assert response.status_code == 200
+    assert decompressed == [0, 3]
+    assert refget.main.PREFETCH_BYTES == 0
+
+
+def test_read_mode_pread(monkeypatch):
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    ranges = [
+        {"start": 0, "end": 1000},
+        {"start": 524_000, "end": 1_600_000},
+        {"start": 4_641_000, "end": 4_641_652},
+    ]
+    expected = [client.get(url, params=params).text for params in ranges]
+
+    # Frames are read from a fresh pool, without checking out its readers
+    monkeypatch.setattr(refget.main, "READ_MODE", "pread")
+    monkeypatch.setattr(refget.main, "CACHE", refget.main.FHCache(maxsize=10))
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+    monkeypatch.setattr(refget.main.ReaderPool, "checkout", None, raising=False)
+    for params, text in zip(ranges, expected):
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        assert response.text == text
+
+    pool = next(iter(refget.main.CACHE.values()))
+    assert pool._fd is not None
+    assert len(pool._readers) == 1
+
+
+def test_pool_closed_during_read(monkeypatch):
+    zstandard = pytest.importorskip("zstandard")
+    # Reads run on their own event loop
+    monkeypatch.setattr(refget.main, "READ_EXECUTOR", ReadExecutor(2, 100))
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+    monkeypatch.setattr(refget.main, "READ_MODE", "pread")
+    filename = os.path.join(refget.main.SEQPATH, GENOME, "seqs", "seq.txt.zst")
+    with IndexedZstdFile(filename) as file:
+        expected = file.read(2_000_000)
+
+    async def read(encoded):
+        pool = await refget.main.ReaderPool.open(
+            filename, 2, refget.main.READ_EXECUTOR, pread=True
+        )
+        if encoded:
+            content = refget.main.read_zstd_encoded(pool, [(0, 2_000_000)])
+        else:
+            content = refget.main.read_zstd(pool, 0, 2_000_000)
+        chunks = []
+        async for chunk in content:
+            assert not isinstance(chunk, str)
+            chunks.append(bytes(chunk))
+            # Evicted from the cache while the response is streaming
+            pool.close()
+        assert pool._fd is None
+        return b"".join(chunks)
+
+    assert asyncio.run(read(False)) == expected
+    data = asyncio.run(read(True))
+    reader = zstandard.ZstdDecompressor().stream_reader(data, read_across_frames=True)
+    assert reader.read() == expected
+
+
+def test_zstd_encoding(monkeypatch):
+    zstandard = pytest.importorskip("zstandard")
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    expected = client.get(url).text
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+
+    # Count the frames that are decompressed
+    read_frame = refget.main.read_frame
+    decompressed = []
+
+    async def counting_read_frame(pool, index, keep=True):
+        decompressed.append(index)
+        return await read_frame(pool, index, keep)
+
+    monkeypatch.setattr(refget.main, "read_frame", counting_read_frame)
+
+    def get(params, accept_encoding):
+        headers = {"Accept-Encoding": accept_encoding}
+        with client.stream("GET", url, params=params, headers=headers) as response:
+            assert response.status_code == 200
+            return response.headers, b"".join(response.iter_raw())
+
+    # Only the frames at the edges of the read are decompressed
+    params = {"start": 100_000, "end": 2_000_000}
+    headers, body = get(params, "gzip, zstd")
+    assert headers["content-encoding"] == "zstd"
+    reader = zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True)
+    assert reader.read().decode() == expected[100_000:2_000_000]
+    assert len(decompressed) == 2
+
+    # Circular reads, and whole sequences
+    cases = [
+        (
+            {"start": 4_000_000, "end": 600_000},
+            expected[4_000_000:] + expected[:600_000],
+        ),
+        ({}, expected),
+    ]
+    for params, text in cases:
+        headers, body = get(params, "zstd")
+        assert headers["content-encoding"] == "zstd"
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            body, read_across_frames=True
+        )
+        assert reader.read().decode() == text
+
+    # Other clients get gzip, as do small reads
+    headers, _ = get(params, "gzip, zstd;q=0")
+    assert headers["content-encoding"] == "gzip"
+    headers, _ = get({"start": 0, "end": 100_000}, "zstd")
+    assert "content-encoding" not in headers
+
+    monkeypatch.setattr(refget.main, "ZSTD_ENCODING", False)
+    headers, _ = get(params, "gzip, zstd")
+    assert headers["content-encoding"] == "gzip"
+
+
+def test_accepts_encoding():
+    accepts_encoding = refget.main.accepts_encoding
+    assert accepts_encoding("zstd", "zstd")
+    assert accepts_encoding("gzip, deflate, br, zstd", "zstd")
+    assert accepts_encoding("gzip;q=1.0, ZSTD ; q=0.5", "zstd")
+    assert not accepts_encoding("gzip, zstd;q=0", "zstd")
+    assert not accepts_encoding("gzip, zstd;q=0.0", "zstd")
+    assert not accepts_encoding("gzip, br", "zstd")
+    assert not accepts_encoding("", "zstd")
+
+
+GENOME = "a73351f7-93e7-11ec-a39d-005056b38ce3"
+
+
+def uncompressed_copy(seqpath, datatype):
+    """
+    Write an uncompressed copy of a data file of the test genome to seqpath.
+    """
+    seqs = seqpath / GENOME / "seqs"
+    seqs.mkdir(parents=True, exist_ok=True)
+    with IndexedZstdFile(f"./testdata/{GENOME}/seqs/{datatype}.txt.zst") as compressed:
+        (seqs / f"{datatype}.txt").write_bytes(compressed.read())
+    return seqs / f"{datatype}.txt"
+
+
+def test_read_uncompressed(monkeypatch, tmp_path):
+    # Only an uncompressed copy of the peptide data. Reads are served from it
+    # without decompression.
+    uncompressed_copy(tmp_path, "pep")
+
+    url = "/sequence/0b49cb6558b97aea58066cbb482c6790"
+    expected = client.get(url).text
+    expected_range = client.get(url, params={"start": 10}).text
+
+    monkeypatch.setattr(refget.main, "SEQPATH", str(tmp_path))
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.text == expected
+    response = client.get(url, params={"start": 10})
+    assert response.status_code == 200
+    assert response.text == expected_range
+
+    filename = os.path.join(str(tmp_path), GENOME, "seqs", "pep.txt.zst")
+    assert isinstance(refget.main.CACHE[filename], refget.main.MmapFile)
+
+    # Data that is not there in uncompressed form still needs the compressed file
+    response = client.get("/sequence/482a2b04485ec8c4b5f4eaba2c2002da")
+    assert response.status_code == 500
+
+
+def test_read_uncompressed_large(monkeypatch, tmp_path):
+    # A whole chromosome from an uncompressed copy is streamed from the map,
+    # gzip compressed for clients that accept it
+    uncompressed_copy(tmp_path, "seq")
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    expected = client.get(url).text
+    monkeypatch.setattr(refget.main, "SEQPATH", str(tmp_path))
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == expected
+    response = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.text == expected
+
+
+def test_mmap_closed_during_read(monkeypatch, tmp_path):
+    # Reads run on their own event loop
+    monkeypatch.setattr(refget.main, "READ_EXECUTOR", ReadExecutor(2, 100))
+    uncompressed = uncompressed_copy(tmp_path, "pep")
+    expected = uncompressed.read_bytes()[:4000]
+
+    async def read(datafile, evict):
+        chunks = []
+        async for chunk in refget.main.read_mmap(datafile, 0, 4000, chunksize=1000):
+            chunks.append(bytes(chunk))
+            if evict:
+                # Evicted from the cache while the response is streaming
+                datafile.close()
+                evict = False
+        return b"".join(chunks)
+
+    # The map stays open until the read is done, then it is closed
+    datafile = MmapFile(str(uncompressed))
+    mapped = weakref.ref(datafile._map)
+    assert asyncio.run(read(datafile, True)) == expected
+    assert mapped() is None or mapped().closed
+
+    # A file closed before the read started is mapped again for the read
+    assert asyncio.run(read(datafile, False)) == expected
+
+
+def test_response_size(monkeypatch):
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    expected = client.get(url).text
+
+    # Requests below run on their own event loops. Don't share state with the
+    # loop of the test client.
+    monkeypatch.setattr(refget.main, "CACHE", refget.main.FHCache(maxsize=10))
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+    monkeypatch.setattr(refget.main, "READ_EXECUTOR", ReadExecutor(2, 100))
+
+    def get(query_string):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.4"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": url,
+            "raw_path": url.encode(),
+            "root_path": "",
+            "query_string": query_string,
+            "headers": [(b"host", b"testserver")],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(app(scope, receive, send))
+        start, *bodies = messages
+        assert start["status"] == 200
+        chunks = [body["body"] for body in bodies if body["body"]]
+        return dict(start["headers"]), chunks
+
+    # Small reads are sent in one piece, with a Content-Length
+    headers, chunks = get(b"start=100&end=60000")
+    assert headers[b"content-length"] == b"59900"
+    assert chunks == [expected[100:60000].encode()]
+
+    # Medium reads are streamed in chunks of CHUNKSIZE
+    headers, chunks = get(b"start=0&end=500000")
+    assert b"content-length" not in headers
+    assert max(map(len, chunks)) == refget.main.CHUNKSIZE
+    assert b"".join(chunks) == expected[:500000].encode()
+
+    # Large reads in whole frames
+    headers, chunks = get(b"")
+    assert max(map(len, chunks)) == 512 * 1024
+    assert b"".join(chunks) == expected.encode()
+
+    # The thresholds can be changed
+    monkeypatch.setattr(refget.main, "SMALL_RESPONSE_SIZE", 0)
+    monkeypatch.setattr(refget.main, "LARGE_RESPONSE_SIZE", 1)
+    monkeypatch.setattr(refget.main, "LARGE_CHUNKSIZE", 1000)
+    headers, chunks = get(b"start=100&end=60000")
+    assert b"content-length" not in headers
+    assert len(chunks) == 60
+
+
+def test_sequence_batch():
+    queries = [
+        {"id": "482a2b04485ec8c4b5f4eaba2c2002da", "start": 4000000, "end": 4600000},
+        {"id": "0b49cb6558b97aea58066cbb482c6790"},
+        {"id": "482a2b04485ec8c4b5f4eaba2c2002da", "start": 0, "end": 40},
+        {"id": "unknown"},
+        {"id": "482a2b04485ec8c4b5f4eaba2c2002da", "start": 5000000},
+        # circular, over the origin
+        {"id": "482a2b04485ec8c4b5f4eaba2c2002da", "start": 4641600, "end": 10},
+        {"id": "482a2b04485ec8c4b5f4eaba2c2002da", "start": 10, "end": 10},
+    ]
+    response = client.post("/sequence/batch", json=queries)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    results = {}
+    for line in response.text.splitlines():
+        result = json.loads(line)
+        results[result.pop("index")] = result
+    assert sorted(results) == list(range(len(queries)))
+
+    # Each result is what a single request would have returned
+    for index, query in enumerate(queries):
+        params = {key: value for key, value in query.items() if key != "id"}
+        single = client.get(f"/sequence/{query['id']}", params=params)
+        result = results[index]
+        assert result["id"] == query["id"]
+        assert result["start"] == query.get("start")
+        assert result["end"] == query.get("end")
+        if single.status_code == 200:
+            assert result["sequence"] == single.text
+        else:
+            assert result["status"] == single.status_code
+            assert result["error"] == single.json()["detail"]
+    assert results[3]["status"] == 404
+    assert results[4]["status"] == 400
+    assert results[6]["sequence"] == ""
+
+    # Invalid and too many queries are rejected as a whole
+    response = client.post("/sequence/batch", json=[{"id": "x", "start": -1}])
+    assert response.status_code == 422
+    response = client.post(
+        "/sequence/batch",
+        json=[{"id": "x"}] * (refget.main.BATCH_MAX_QUERIES + 1),
+    )
+    assert response.status_code == 400
+
+
+def test_sequence_batch_read_error(monkeypatch):
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+    read_frame = refget.main.read_frame
+
+    # Fail from the second frame on
+    async def failing_read_frame(pool, index, keep=True):
+        if index > 0:
+            raise OSError("read failed")
+        return await read_frame(pool, index, keep)
+
+    monkeypatch.setattr(refget.main, "read_frame", failing_read_frame)
+    seqid = "482a2b04485ec8c4b5f4eaba2c2002da"
+    expected = client.get(f"/sequence/{seqid}", params={"end": 40}).text
+    queries = [{"id": seqid, "end": 40}, {"id": seqid, "end": 1_000_000}]
+    response = client.post("/sequence/batch", json=queries)
+    assert response.status_code == 200
+
+    results = {}
+    for line in response.text.splitlines():
+        result = json.loads(line)
+        results[result.pop("index")] = result
+    assert results[0] == {"id": seqid, "start": None, "end": 40, "sequence": expected}
+    assert results[1]["status"] == 500
+    assert results[1]["error"] == "IO error. Sequence truncated"
+    assert results[1]["sequence"].startswith(expected)
+    assert len(results[1]["sequence"]) < 1_000_000
+
+
+def test_metadata_batch():
+    qids = [
+        "482a2b04485ec8c4b5f4eaba2c2002da",
+        "024d0fa06f5ef897aad15f9bf6553aaf2664e178e1b5adc0",
+        "ga4gh:SQ.NjjHtoQ2gYdy2RVkAZBKURBiV7xp-8ZS",
+        "md5:0b49cb6558b97aea58066cbb482c6790",
+        "024d0fa06f5ef897aad15f9bf6553aaf2664e178e1b5adc1",
+        "00000000000000000000000000000000",
+        "unknown",
+        "482a2b04485ec8c4b5f4eaba2c2002da",
+    ]
+    response = client.post("/sequence/batch/metadata", json=qids)
+    assert response.status_code == 200
+    results = response.json()
+    assert len(results) == len(qids)
+
+    # Each entry is what a single request would have returned
+    for qid, result in zip(qids, results):
+        single = client.get(f"/sequence/{qid}/metadata")
+        if single.status_code == 200:
+            assert result == single.json()["metadata"]
+        else:
+            assert single.status_code == 404
+            assert result == {"id": qid, "error": "Sequence ID not found"}
+    assert [("error" in result) for result in results] == [
+        False,
+        False,
+        False,
+        False,
+        True,
+        True,
+        True,
+        False,
+    ]
+
+    response = client.post("/sequence/batch/metadata", json=[])
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = client.post(
+        "/sequence/batch/metadata",
+        json=["x"] * (refget.main.BATCH_MAX_QUERIES + 1),
+    )
+    assert response.status_code == 400
+
+
+def test_record_cache():
+    def sample(name, cache):
+        return (
+            REGISTRY.get_sample_value(
+                f"refget_index_cache_{name}_total", {"cache": cache}
+            )
+            or 0
+        )
+
+    url = "/sequence/0b49cb6558b97aea58066cbb482c6790/metadata"
+    expected = client.get(url).json()
+    hits = {cache: sample("hits", cache) for cache in ("record", "md5")}
+    misses = {cache: sample("misses", cache) for cache in ("record", "md5")}
+
+    # Repeated lookups don't go to the index database
+    assert client.get(url).json() == expected
+    response = client.post(
+        "/sequence/batch/metadata", json=[expected["metadata"]["id"]]
+    )
+    assert response.json() == [expected["metadata"]]
+    for cache in ("record", "md5"):
+        assert sample("hits", cache) == hits[cache] + 2
+        assert sample("misses", cache) == misses[cache]
+
+    record = refget.main.get_record("024d0fa06f5ef897aad15f9bf6553aaf2664e178e1b5adc0")
+    assert isinstance(record, refget.main.IndexRecord)
+    assert (record.length, record.md5) == (21, "0b49cb6558b97aea58066cbb482c6790")
+
+
+def test_hot_path_metrics(monkeypatch):
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(f"refget_{name}", labels) or 0
+
+    monkeypatch.setattr(refget.main, "CACHE", refget.main.FHCache(maxsize=1))
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+    monkeypatch.setattr(refget.main, "RECORD_CACHE", refget.main.IndexCache("r", 0))
+    names = [
+        ("index_lookup_seconds_count", {"lookup": "record"}),
+        ("datafile_cache_hits_total", {"datatype": "seq"}),
+        ("datafile_cache_misses_total", {"datatype": "seq"}),
+        ("datafile_cache_evictions_total", {"datatype": "seq"}),
+        ("datafile_open_seconds_count", {"datatype": "seq"}),
+        ("frame_read_seconds_count", {"datatype": "seq"}),
+        ("decompressed_bytes_total", {"datatype": "seq"}),
+        ("frames_per_request_sum", {"datatype": "seq"}),
+        ("stream_seconds_count", {"datatype": "seq"}),
+    ]
+    before = {name: sample(name, **labels) for name, labels in names}
+
+    # Two frames of the chromosome, then a peptide that evicts its data file
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    response = client.get(url, params={"start": 524_000, "end": 525_000})
+    assert response.status_code == 200
+    response = client.get(url, params={"start": 0, "end": 10})
+    assert response.status_code == 200
+    response = client.get("/sequence/d3380e9e3ca970d9dfbed22064b59906")
+    assert response.status_code == 200
+
+    after = {name: sample(name, **labels) for name, labels in names}
+    changes = {name: after[name] - before[name] for name in after}
+    assert changes == {
+        "index_lookup_seconds_count": 3,
+        "datafile_cache_hits_total": 1,
+        "datafile_cache_misses_total": 1,
+        "datafile_cache_evictions_total": 1,
+        "datafile_open_seconds_count": 1,
+        "frame_read_seconds_count": 3,
+        "decompressed_bytes_total": 3 * 512 * 1024,
+        "frames_per_request_sum": 3,
+        "stream_seconds_count": 2,
+    }
+    assert sample("decompressed_bytes_total", datatype="pep") > 0
+
+
+def test_tracing(monkeypatch, tmp_path):
+    from refget import tracing
+
+    path = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(tracing, "TRACER", tracing.FileTracer(str(path)))
+    monkeypatch.setattr(refget.main, "CACHE", refget.main.FHCache(maxsize=10))
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(0))
+    url = "/sequence/482a2b04485ec8c4b5f4eaba2c2002da"
+    response = client.get(url, params={"start": 524_000, "end": 625_000})
+    assert response.status_code == 200
+    tracing.TRACER.close()
+
+    with open(path) as file:
+        spans = [json.loads(line) for line in file]
+    request = next(span for span in spans if span["name"] == "GET /sequence/{qid}")
+    assert request["attributes"]["http.target"] == url
+    assert request["attributes"]["refget.frames"] == 2
+    assert request["attributes"]["refget.bytes"] == 101_000
+    assert request["attributes"]["http.status_code"] == 200
+    assert {span["trace_id"] for span in spans} == {request["trace_id"]}
+
+    names = [span["name"] for span in spans if span is not request]
+    assert names.count("id_to_sha") == 1
+    assert names.count("get_record") == 1
+    assert names.count("open_datafile") == 1
+    frames = [span for span in spans if span["name"] == "read_zstd.frame"]
+    assert [span["attributes"]["refget.frame"] for span in frames] == [0, 1]
+    assert frames[0]["attributes"]["refget.start"] == 524_000
+    assert frames[1]["attributes"]["refget.end"] == 625_000
+    assert all(span["attributes"]["refget.bytes"] == 512 * 1024 for span in frames)
+
+
+def test_reload_index(monkeypatch, tmp_path):
+    # The index is served through a symlink
+    index = tmp_path / "indexdb.tkh"
+    index.symlink_to(os.path.abspath(refget.main.INDEXDBPATH))
+    monkeypatch.setattr(refget.main, "INDEXDBPATH", str(index))
+
+    # Same file, nothing to do
+    assert not asyncio.run(refget.main.reload_index())
+
+    # A different file behind the symlink is swapped in
+    db = refget.main.DB
+    monkeypatch.setattr(refget.main, "INDEX_IDENTITY", (0, 0, 0, 0))
+    assert asyncio.run(refget.main.reload_index())
+    assert refget.main.DB is not db
+    assert refget.main.INDEX_IDENTITY == refget.main.index_identity(str(index))
+    response = client.get("/sequence/0b49cb6558b97aea58066cbb482c6790/metadata")
+    assert response.status_code == 200
+
+    # Data files that are gone are closed and dropped from the cache
+    datafile = tmp_path / "seq.txt.zst"
+    datafile.write_bytes(b"ACGT")
+    refget.main.CACHE[str(datafile)] = MmapFile(str(datafile))
+    datafile.unlink()
+
+    # Admin endpoint, disabled without a token
+    url = "/admin/reload-index"
+    assert client.post(url).status_code == 404
+    monkeypatch.setattr(refget.main, "ADMIN_TOKEN", "secret")
+    assert client.post(url).status_code == 403
+    response = client.post(url, headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 403
+    response = client.post(url, headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.json() == {"reloaded": True}
+    assert str(datafile) not in refget.main.CACHE
+
+    response = client.get("/sequence/0b49cb6558b97aea58066cbb482c6790")
+    assert response.status_code == 200
+
+
+def test_static_index(monkeypatch, tmp_path):
+    queries = [
+        "/sequence/482a2b04485ec8c4b5f4eaba2c2002da?start=100&end=200",
+        "/sequence/0b49cb6558b97aea58066cbb482c6790",
+        "/sequence/024d0fa06f5ef897aad15f9bf6553aaf2664e178e1b5adc0/metadata",
+        "/sequence/024d0fa06f5ef897aad15f9bf6553aaf2664e178e1b5adc1/metadata",
+    ]
+    expected = [client.get(query) for query in queries]
+
+    static = tmp_path / "indexdb.sidx"
+    write_static_index(str(static), iter(refget.main.DB))
+    monkeypatch.setattr(refget.main, "INDEXDBPATH", str(static))
+    assert asyncio.run(refget.main.reload_index(force=True))
+    assert isinstance(refget.main.DB, StaticIndex)
+
+    for query, response in zip(queries, expected):
+        static_response = client.get(query)
+        assert static_response.status_code == response.status_code
+        assert static_response.text == response.text
+
+    monkeypatch.undo()
+    assert asyncio.run(refget.main.reload_index(force=True))
+    assert not isinstance(refget.main.DB, StaticIndex)
+
+
+def test_warm_up(monkeypatch, tmp_path):
+    # Start cold
+    monkeypatch.setattr(refget.main, "CACHE", refget.main.FHCache(maxsize=10))
+    monkeypatch.setattr(
+        refget.main, "RECORD_CACHE", refget.main.IndexCache("record", 100)
+    )
+    monkeypatch.setattr(refget.main, "FRAME_CACHE", refget.main.FrameCache(1 << 26))
+
+    hotlist = tmp_path / "hotlist"
+    hotlist.write_text(
+        "# hot sequences\n"
+        "0b49cb6558b97aea58066cbb482c6790\n"
+        "unknown\n"
+        "\n"
+        f"{GENOME}/seqs/cds.txt.zst\n"
+        f"{GENOME}/seqs/missing.txt.zst\n"
+    )
+    monkeypatch.setattr(refget.main, "WARMED_UP", False)
+    assert client.get("/ready").status_code == 503
+
+    asyncio.run(refget.main.warm_up(str(hotlist)))
+    assert client.get("/ready").status_code == 200
+    assert refget.main.RECORD_CACHE.keys() == [
+        "024d0fa06f5ef897aad15f9bf6553aaf2664e178e1b5adc0"
+    ]
+    files = {os.path.relpath(name, refget.main.SEQPATH) for name in refget.main.CACHE}
+    assert files == {f"{GENOME}/seqs/pep.txt.zst", f"{GENOME}/seqs/cds.txt.zst"}
+    for name in files:
+        pool = refget.main.CACHE[os.path.join(refget.main.SEQPATH, name)]
+        assert refget.main.FRAME_CACHE._frames.get((pool.name, 0)) is not None
+
+    # The hot set is written back for the next start
+    dump = tmp_path / "dump"
+    monkeypatch.setattr(refget.main, "WARMUP_HOTLIST", str(dump))
+    monkeypatch.setattr(refget.main, "ADMIN_TOKEN", "secret")
+    url = "/admin/dump-hotlist"
+    assert client.post(url).status_code == 403
+    response = client.post(url, headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.json() == {"ids": 1, "files": 2}
+    ids, files = refget.main.read_hotlist(str(dump))
+    assert ids == refget.main.RECORD_CACHE.keys()
+    assert set(files) == {f"{GENOME}/seqs/pep.txt.zst", f"{GENOME}/seqs/cds.txt.zst"}
+
+
+def test_admin_profiles(monkeypatch, tmp_path):
+    url = "/admin/profiles"
+    monkeypatch.setattr(refget.main, "ADMIN_TOKEN", "secret")
+    headers = {"Authorization": "Bearer secret"}
+    assert client.get(url, headers=headers).status_code == 400
+
+    monkeypatch.setattr(refget.main, "PROFILE_DIR", str(tmp_path))
+    (tmp_path / "a.prof").write_bytes(b"profile")
+    assert client.get(url).status_code == 403
+    assert client.get(url, headers=headers).json() == ["a.prof"]
+    response = client.get(f"{url}/a.prof", headers=headers)
+    assert response.content == b"profile"
+    assert client.get(f"{url}/b.prof", headers=headers).status_code == 404
+    assert client.get(f"{url}/..%2Fa.prof", headers=headers).status_code == 404
+
+
+def test_read_queue_full(monkeypatch):
+    # With no room in the read queue, sequence requests are turned away
+    monkeypatch.setattr(refget.main.READ_EXECUTOR, "max_pending", 0)
+    response = client.get("/sequence/0b49cb6558b97aea58066cbb482c6790")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+    # Metadata does not read sequence data and is still served
+    response = client.get("/sequence/0b49cb6558b97aea58066cbb482c6790/metadata")
+    assert response.status_code == 200
+
+    monkeypatch.undo()
+    response = client.get("/sequence/0b49cb6558b97aea58066cbb482c6790")
+    assert response.status_code == 200
+    assert refget.main.READ_EXECUTOR.pending == 0
+
+
 def test_startup():
     os.environ["INDEXDBPATH"] = "./testdata/no-db"
     os.environ["SEQPATH"] = "./testdata/"
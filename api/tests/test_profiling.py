@@ -0,0 +1,72 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pstats
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from refget.profiling import PROFILE_HEADER, ProfilingMiddleware
+
+
+def profiled_client(tmp_path, **options):
+    async def sequence(request):
+        return PlainTextResponse("ACGT" * 100)
+
+    app = Starlette(
+        routes=[Route("/sequence/{qid}", sequence), Route("/other", sequence)]
+    )
+    app.add_middleware(ProfilingMiddleware, spool_dir=str(tmp_path), **options)
+    return TestClient(app)
+
+
+def test_profile_with_token(tmp_path):
+    client = profiled_client(tmp_path, token="secret")
+
+    # Only with the right token
+    assert PROFILE_HEADER not in client.get("/sequence/abc").headers
+    response = client.get("/sequence/abc", headers={PROFILE_HEADER: "wrong"})
+    assert PROFILE_HEADER not in response.headers
+    assert not list(tmp_path.iterdir())
+
+    response = client.get("/sequence/abc", headers={PROFILE_HEADER: "secret"})
+    assert response.text == "ACGT" * 100
+    name = response.headers[PROFILE_HEADER]
+    assert name.endswith("-GET-sequence_abc.prof")
+    assert [path.name for path in tmp_path.iterdir()] == [name]
+    stats = pstats.Stats(str(tmp_path / name))
+    assert stats.total_calls > 0
+
+    # Other paths are never profiled
+    response = client.get("/other", headers={PROFILE_HEADER: "secret"})
+    assert PROFILE_HEADER not in response.headers
+
+
+def test_profile_limits(tmp_path):
+    # Everything is sampled, but only max_per_minute requests are profiled
+    client = profiled_client(tmp_path, sample_rate=1.0, max_per_minute=3, max_files=2)
+    names = [client.get("/sequence/abc").headers.get(PROFILE_HEADER) for _ in range(5)]
+    assert all(names[:3]) and names[3:] == [None, None]
+
+    # The oldest profile was deleted
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(names[1:3])
+
+
+def test_profiler_choice(tmp_path):
+    with pytest.raises(ValueError):
+        ProfilingMiddleware(None, str(tmp_path), profiler="unknown")
@@ -0,0 +1,46 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from refget.shmcache import SharedFrameCache
+
+
+def test_shared_frame_cache(tmp_path):
+    path = str(tmp_path / "frames")
+    cache = SharedFrameCache(path, size=1024 * 1024, slot_size=64 * 1024)
+    assert cache.slots == 15
+
+    assert cache.get(b"file:1") is None
+    cache.put(b"file:1", b"ACGT" * 100)
+    assert cache.get(b"file:1") == b"ACGT" * 100
+    assert cache.get(b"file:2") is None
+
+    # Frames that don't fit a slot are not cached
+    cache.put(b"file:3", b"A" * (64 * 1024 + 1))
+    assert cache.get(b"file:3") is None
+
+    # A second mapping, as opened by another worker, sees the same frames
+    other = SharedFrameCache(path, size=1024 * 1024, slot_size=64 * 1024)
+    assert other.path == cache.path
+    assert other.get(b"file:1") == b"ACGT" * 100
+    other.put(b"file:1", b"TTTT")
+    assert cache.get(b"file:1") == b"TTTT"
+
+    # A different layout doesn't share the file
+    resized = SharedFrameCache(path, size=2 * 1024 * 1024, slot_size=64 * 1024)
+    assert resized.path != cache.path
+    assert resized.get(b"file:1") is None
+
+    for c in (cache, other, resized):
+        c.close()
@@ -0,0 +1,92 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+
+import pytest
+import tkrzw
+
+from refget import staticindex
+from refget.staticindex import StaticIndex, write_static_index
+
+
+def test_static_index(tmp_path, monkeypatch):
+    # Sort in several runs, and spread the keys over many pages
+    monkeypatch.setattr(staticindex, "RUN_SIZE", 100)
+    items = {
+        hashlib.md5(str(n).encode()).digest(): b"x" * (n % 50) for n in range(1000)
+    }
+    meta = {b"\x00refget:format": b"1", b"\x00refget:paths": b"a\nb"}
+    path = str(tmp_path / "index.sidx")
+    write_static_index(path, list(items.items()) + list(meta.items()), page_size=256)
+
+    index = StaticIndex(path)
+    assert index.entries == len(items)
+    for key, value in items.items():
+        assert index.Get(key) == value
+    for key, value in meta.items():
+        assert index.Get(key) == value
+    assert index.Get(b"") is None
+    assert index.Get(b"\xff" * 17) is None
+    for key in sorted(items)[:10]:
+        assert index.Get(key[:-1]) is None
+        assert index.Get(key + b"\x00") is None
+    assert index.GetMulti(*list(items)[:5], b"missing") == {
+        key: items[key] for key in list(items)[:5]
+    }
+    index.Close()
+
+    # Keys of different lengths, some prefixes of others, in one page
+    keys = [b"a", b"ab", b"abc", b"b", b"ba", b"c"]
+    write_static_index(path, [(key, key.upper()) for key in reversed(keys)])
+    index = StaticIndex(path)
+    for key in keys:
+        assert index.Get(key) == key.upper()
+    for key in [b"", b"aa", b"abcd", b"bb", b"d"]:
+        assert index.Get(key) is None
+    index.Close()
+
+    with pytest.raises(ValueError):
+        write_static_index(path, [(b"a", b"1"), (b"a", b"2")])
+    with pytest.raises(ValueError):
+        write_static_index(path, [(b"a", bytes(300))], page_size=256)
+
+    (tmp_path / "other").write_bytes(bytes(8192))
+    with pytest.raises(ValueError):
+        StaticIndex(str(tmp_path / "other"))
+
+
+def test_export(tmp_path):
+    db = tkrzw.DBM()
+    db.Open(
+        os.path.join("testdata", "indexdb.tkh"),
+        False,
+        no_create=True,
+        no_wait=True,
+        truncate=False,
+        dbm="HashDBM",
+    ).OrDie()
+    path = str(tmp_path / "indexdb.sidx")
+    write_static_index(path, iter(db))
+
+    index = StaticIndex(path)
+    count = 0
+    for key, value in db:
+        assert index.Get(key) == value
+        count += 1
+    assert index.entries == count
+    db.Close()
+    index.Close()
@@ -0,0 +1,127 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+from fastapi import FastAPI
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.testclient import TestClient
+
+from refget import tracing
+
+
+def read_spans(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+@pytest.fixture
+def traced(tmp_path, monkeypatch):
+    path = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(tracing, "TRACER", tracing.FileTracer(str(path)))
+    yield path
+    tracing.TRACER.close()
+
+
+def test_noop():
+    tracer = tracing.Tracer()
+    with tracer.span("work", {"a": 1}) as span:
+        span.set_attribute("b", 2)
+    assert tracer.current_span() is tracing.NOOP_SPAN
+
+
+def test_file_tracer(traced):
+    with tracing.span("outer", {"a": 1}) as outer:
+        with tracing.span("inner") as inner:
+            tracing.current_span().set_attribute("b", 2)
+        outer.set_attribute("c", 3)
+    with pytest.raises(KeyError):
+        with tracing.span("failed"):
+            raise KeyError("x")
+    assert tracing.current_span() is tracing.NOOP_SPAN
+
+    spans = {span["name"]: span for span in read_spans(traced)}
+    assert spans["inner"]["attributes"] == {"b": 2}
+    assert spans["inner"]["parent_id"] == spans["outer"]["span_id"] == outer.span_id
+    assert spans["inner"]["trace_id"] == spans["outer"]["trace_id"]
+    assert inner.span_id != outer.span_id
+    assert spans["outer"]["attributes"] == {"a": 1, "c": 3}
+    assert spans["outer"]["parent_id"] is None
+    assert spans["outer"]["start_ns"] <= spans["outer"]["end_ns"]
+    assert spans["failed"]["trace_id"] != spans["outer"]["trace_id"]
+    assert "KeyError" in spans["failed"]["error"]
+
+
+def test_middleware(traced):
+    async def stream():
+        with tracing.span("chunk"):
+            pass
+        yield "ACGT"
+
+    app = FastAPI()
+
+    @app.get("/sequence/{qid}")
+    async def sequence(qid: str):
+        with tracing.span("lookup"):
+            pass
+        return StreamingResponse(stream())
+
+    @app.get("/missing")
+    async def missing():
+        return PlainTextResponse("", status_code=404)
+
+    app.add_middleware(tracing.TracingMiddleware)
+    client = TestClient(app)
+
+    # Continues the trace of the caller
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    traceparent = f"00-{trace_id}-{parent_id}-01"
+    response = client.get("/sequence/abc?start=1", headers={"traceparent": traceparent})
+    assert response.text == "ACGT"
+    assert client.get("/missing").status_code == 404
+    assert client.get("/unknown").status_code == 404
+
+    # Spans are named after the route, not the path
+    spans = {span["name"]: span for span in read_spans(traced)}
+    request = spans["GET /sequence/{qid}"]
+    assert request["trace_id"] == trace_id
+    assert request["parent_id"] == parent_id
+    assert request["attributes"] == {
+        "http.method": "GET",
+        "http.target": "/sequence/abc",
+        "http.query": "start=1",
+        "http.route": "/sequence/{qid}",
+        "http.status_code": 200,
+    }
+    for name in ("lookup", "chunk"):
+        assert spans[name]["parent_id"] == request["span_id"]
+        assert spans[name]["trace_id"] == trace_id
+    assert spans["GET /missing"]["attributes"]["http.status_code"] == 404
+    assert spans["GET /missing"]["trace_id"] != trace_id
+    assert spans["GET"]["attributes"]["http.target"] == "/unknown"
+
+
+def test_configure(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACER", tracing.TRACER)
+    with pytest.raises(ValueError):
+        tracing.configure("unknown")
+    with pytest.raises(ValueError):
+        tracing.configure("file")
+    tracing.configure("file", str(tmp_path / "spans.jsonl"))
+    assert isinstance(tracing.TRACER, tracing.FileTracer)
+    tracing.TRACER.close()
+    tracing.configure("none")
+    assert type(tracing.TRACER) is tracing.Tracer
@@ -16,19 +16,169 @@
 # limitations under the License.
 
 import argparse
+import hashlib
+import json
+import multiprocessing
 import os
 import sys
 import re
 import tempfile
 import shutil
+import struct
+import time
 import tkrzw
+from collections import deque
 from pathlib import Path
 
+# Binary index format. See api/src/refget/indexformat.py, which decodes it.
+FORMAT_KEY = b"\x00refget:format"
+PATHS_KEY = b"\x00refget:paths"
+BINARY_FORMAT = b"1"
+RECORD_V1 = b"\x01"
+FLAG_CIRCULAR = 1
+RECORD = struct.Struct("<QQB16s")
 
-def add_data(db, basedir, dirname):
-    print(f"DB insert for {dirname}")
+# Manifests of the hashes files of each indexed genome, and the list of
+# indexed genomes. Used by --incremental.
+MANIFEST_KEY_PREFIX = b"\x00refget:manifest:"
+GENOMES_KEY = b"\x00refget:genomes"
 
-    for datatype in ['seq', 'cdna', 'cds', 'pep']:
+DATATYPES = ['seq', 'cdna', 'cds', 'pep']
+
+# Frame offsets sidecar files, next to each data file. See
+# api/src/refget/readers.py, which reads them.
+FRAMES_SUFFIX = ".frames"
+FRAMES_MAGIC = b"RGFRAMES"
+FRAMES_VERSION = 1
+FRAMES_HEADER = struct.Struct("<8sIIQ")
+FRAMES_ENTRY = struct.Struct("<QQ")
+
+# Footer of the seek table of the zstd seekable format, as written by t2sz
+SEEKABLE_MAGIC = 0x8F92EAB1
+SEEKABLE_FOOTER = struct.Struct("<IBI")
+SEEKABLE_CHECKSUM_FLAG = 0x80
+
+
+def varint(value):
+    """Encode an unsigned int as LEB128 varint."""
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def read_varint(data, pos):
+    """Decode a LEB128 varint at pos. Returns the value and the next pos."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class PathTable:
+    """
+    Table of data file paths of the binary format. Records refer to their
+    data file by its index in this table.
+    """
+
+    def __init__(self, db):
+        value = db.Get(PATHS_KEY)
+        self.paths = value.decode('utf-8').split("\n") if value else []
+        self.ids = {path: file_id for file_id, path in enumerate(self.paths)}
+
+    def file_id(self, path):
+        if path not in self.ids:
+            self.ids[path] = len(self.paths)
+            self.paths.append(path)
+        return self.ids[path]
+
+    def save(self, db):
+        db[PATHS_KEY] = "\n".join(self.paths).encode('utf-8')
+
+
+class Manifests:
+    """
+    Manifests of the indexed genomes. A manifest records the size, mtime and
+    SHA256 checksum of each hashes file of a genome at the time it was indexed.
+    """
+
+    def __init__(self, db):
+        value = db.Get(GENOMES_KEY)
+        self.genomes = set(value.decode('utf-8').split("\n")) if value else set()
+
+    def get(self, db, dirname):
+        value = db.Get(MANIFEST_KEY_PREFIX + dirname.encode('utf-8'))
+        return json.loads(value) if value else None
+
+    def put(self, db, dirname, manifest):
+        db[MANIFEST_KEY_PREFIX + dirname.encode('utf-8')] = json.dumps(manifest).encode('utf-8')
+        self.genomes.add(dirname)
+        self.save(db)
+
+    def remove(self, db, dirname):
+        db.Remove(MANIFEST_KEY_PREFIX + dirname.encode('utf-8'))
+        self.genomes.discard(dirname)
+        self.save(db)
+
+    def save(self, db):
+        db[GENOMES_KEY] = "\n".join(sorted(self.genomes)).encode('utf-8')
+
+
+def genome_manifest(basedir, dirname, previous=None):
+    """
+    Return the manifest of the hashes files of genome dirname. Checksums are
+    taken from the previous manifest for files whose size and mtime did not
+    change, and computed otherwise.
+    """
+    manifest = {}
+    for datatype in DATATYPES:
+        hashfile = f"{datatype}.hashes"
+        infile = os.path.join(basedir, dirname, hashfile)
+        if not os.path.isfile(infile):
+            continue
+        stat = os.stat(infile)
+        known = (previous or {}).get(hashfile)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            checksum = known["sha256"]
+        else:
+            digest = hashlib.sha256()
+            with open(infile, "rb") as file:
+                for block in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(block)
+            checksum = digest.hexdigest()
+        manifest[hashfile] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": checksum,
+        }
+    return manifest
+
+
+def same_content(manifest, other):
+    """True if two manifests are for hashes files with the same content."""
+    def content(m):
+        return {name: (entry["size"], entry["sha256"]) for name, entry in m.items()}
+    return content(manifest) == content(other)
+
+
+def read_genome(basedir, dirname, binary=False):
+    """
+    Read the hashes files of genome dirname and encode their records. This
+    does not need the DB, so that it can run in a worker process.
+
+    Returns a list of (seqfile, records) per data file, with records a list
+    of (md5 key, sha key, value). In the binary format, values are missing
+    their version byte and file id, which are only known to the writer.
+    """
+    genome = []
+    for datatype in DATATYPES:
 
         hashfile = f"{datatype}.hashes"
         seqname = datatype
@@ -40,6 +190,7 @@ def add_data(db, basedir, dirname):
             print(f"Warning, missing file {infile}. Skipping.", file=sys.stderr)
             continue
 
+        records = []
         with open(infile, "rb") as file:
             startpos = 0
             for line in file:
@@ -47,19 +198,202 @@ def add_data(db, basedir, dirname):
 
                 is_circular = b"1" if circular.strip() == b"1" else b"0"
 
-                value = b"\t".join(
-                    [
-                        seqfile.encode('utf-8'),
-                        str(startpos).encode('utf-8'),
-                        length,
-                        name,
-                        md5,
-                        is_circular
-                    ]
-                )
-                db[md5] = sha
-                db[sha] = value
+                if binary:
+                    md5_raw = bytes.fromhex(md5.decode('utf-8'))
+                    sha_raw = bytes.fromhex(sha.decode('utf-8'))
+                    value = RECORD.pack(
+                        startpos,
+                        int(length),
+                        FLAG_CIRCULAR if is_circular == b"1" else 0,
+                        md5_raw,
+                    ) + name
+                    records.append((md5_raw, sha_raw, value))
+                else:
+                    value = b"\t".join(
+                        [
+                            seqfile.encode('utf-8'),
+                            str(startpos).encode('utf-8'),
+                            length,
+                            name,
+                            md5,
+                            is_circular
+                        ]
+                    )
+                    records.append((md5, sha, value))
                 startpos += int(length.decode('utf-8'))
+        genome.append((seqfile, records))
+
+    return genome
+
+
+def write_genome(db, genome, paths=None):
+    """
+    Write the records of a genome from read_genome() to the DB. Records are
+    written in the binary format if a PathTable is given as paths, as text
+    otherwise. Returns the number of records written.
+    """
+    count = 0
+    for seqfile, records in genome:
+        prefix = b""
+        if paths is not None:
+            prefix = RECORD_V1 + varint(paths.file_id(seqfile))
+        for md5, sha, value in records:
+            db[md5] = sha
+            db[sha] = prefix + value
+        count += len(records)
+
+    if paths is not None:
+        paths.save(db)
+    return count
+
+
+def delete_genomes(db, dirnames, paths=None):
+    """
+    Delete the records of the genomes dirnames, found by a scan of the whole
+    DB. Returns the set of deleted SHA keys.
+
+    The MD5 key of each record is taken from the record itself, so that one
+    scan finds both. A sequence that is in several genomes only has one
+    record, which points at the data of one of them. See restore_records() to
+    restore those.
+    """
+    prefixes = tuple(f"{dirname}/".encode('utf-8') for dirname in dirnames)
+    file_ids = set()
+    if paths is not None:
+        file_ids = {
+            file_id for file_id, path in enumerate(paths.paths)
+            if path.encode('utf-8').startswith(prefixes)
+        }
+    sha_length = 24 if paths is not None else 48
+
+    records = {}
+    for key, value in db:
+        if len(key) != sha_length:
+            continue
+        if paths is not None and value[:1] == RECORD_V1:
+            file_id, pos = read_varint(value, 1)
+            if file_id in file_ids:
+                records[key] = RECORD.unpack_from(value, pos)[3]
+        elif value.startswith(prefixes):
+            records[key] = value.split(b"\t")[4]
+
+    for sha, md5 in records.items():
+        if db.Get(md5) == sha:
+            db.Remove(md5)
+        db.Remove(sha)
+    return set(records)
+
+
+def restore_records(db, basedir, dirnames, owners, paths=None):
+    """
+    Give the SHA keys of owners the record a build from scratch would give
+    them: that of the last genome holding the sequence, in sorted order.
+
+    owners maps each SHA key to the genome its record was written from, None
+    if it has no record. The record is written again from the last of genomes
+    dirnames holding the sequence, if that sorts after its owner. Returns the
+    SHA keys without an owner that are in none of the genomes.
+    """
+    pending = dict(owners)
+    unowned = sum(owner is None for owner in pending.values())
+    lowest = min((owner for owner in pending.values() if owner is not None), default=None)
+    for dirname in sorted(dirnames, reverse=True):
+        if not pending or (unowned == 0 and dirname < lowest):
+            break
+        latest = {}
+        for seqfile, records in read_genome(basedir, dirname, paths is not None):
+            for record in records:
+                if record[1] in pending:
+                    # The last record of a sequence in a genome is the one kept
+                    latest[record[1]] = (seqfile, record)
+        genome = []
+        for sha, (seqfile, record) in latest.items():
+            owner = pending.pop(sha)
+            if owner is None:
+                unowned -= 1
+            if owner is None or owner < dirname:
+                genome.append((seqfile, [record]))
+        write_genome(db, genome, paths)
+    return {sha for sha, owner in pending.items() if owner is None}
+
+
+def frame_offsets(datafile):
+    """
+    Read the frame offsets of a data file from its seek table, a skippable frame
+    at the end of files in the zstd seekable format. Returns a list of
+    (compressed offset, uncompressed offset) of each frame, followed by the
+    end of the last frame. None if the file has no seek table.
+    """
+    with open(datafile, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        if file.tell() < SEEKABLE_FOOTER.size:
+            return None
+        file.seek(-SEEKABLE_FOOTER.size, os.SEEK_END)
+        frames, descriptor, magic = SEEKABLE_FOOTER.unpack(file.read(SEEKABLE_FOOTER.size))
+        if magic != SEEKABLE_MAGIC:
+            return None
+        entry_size = 12 if descriptor & SEEKABLE_CHECKSUM_FLAG else 8
+        file.seek(-SEEKABLE_FOOTER.size - frames * entry_size, os.SEEK_END)
+        table = file.read(frames * entry_size)
+
+    offsets = []
+    compressed = uncompressed = 0
+    for frame in range(frames):
+        compressed_size, uncompressed_size = struct.unpack_from("<II", table, frame * entry_size)
+        offsets.append((compressed, uncompressed))
+        compressed += compressed_size
+        uncompressed += uncompressed_size
+    offsets.append((compressed, uncompressed))
+    return offsets
+
+
+def write_frame_offsets(datafile):
+    """
+    Write the frames sidecar file of a data file, so that the server doesn't
+    need to scan the data file for its frames.
+    """
+    offsets = frame_offsets(datafile)
+    if offsets is None:
+        print(f"Warning, {datafile} has no seek table. No frame offsets written.", file=sys.stderr)
+        return
+
+    tmp = f"{datafile}{FRAMES_SUFFIX}.tmp"
+    with open(tmp, "wb") as out:
+        out.write(FRAMES_HEADER.pack(
+            FRAMES_MAGIC, FRAMES_VERSION, len(offsets), os.path.getsize(datafile)
+        ))
+        for compressed, uncompressed in offsets:
+            out.write(FRAMES_ENTRY.pack(compressed, uncompressed))
+    os.replace(tmp, f"{datafile}{FRAMES_SUFFIX}")
+
+
+def _read_genome_job(job):
+    basedir, dirname, binary = job
+    manifest = genome_manifest(basedir, dirname)
+    return dirname, read_genome(basedir, dirname, binary), manifest
+
+
+def read_genomes(basedir, dirnames, binary, processes=1):
+    """
+    Yield (dirname, genome, manifest) for each of dirnames, in order, see
+    read_genome() and genome_manifest().
+    With more than one process, genomes are read by a pool of worker processes,
+    a few genomes ahead of the writer.
+    """
+    jobs = [(basedir, dirname, binary) for dirname in dirnames]
+    if processes <= 1:
+        yield from map(_read_genome_job, jobs)
+        return
+
+    with multiprocessing.Pool(processes) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.apply_async(_read_genome_job, (job,)))
+            # Don't let the workers get too far ahead of the writer
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
 
 
 def main():
@@ -109,6 +443,46 @@ def main():
         ),
         nargs='*'
     )
+    parser.add_argument("--format",
+        help=(
+            'Format of the index records. "binary" stores raw digests as keys'
+            ' and compact binary records, which makes for a much smaller DB.'
+            ' An existing DB must be extended in the format it was created with.'
+            ' Default is "text".'
+        ),
+        choices=['text', 'binary'],
+        default='text',
+    )
+    parser.add_argument("--jobs",
+        help=(
+            'Number of processes reading and encoding the hashes files. The DB'
+            ' is still written by the main process alone, and the records are'
+            ' sent to it from the workers. This only pays off on a machine with'
+            ' spare cores, when reading the hashes files and not writing the DB'
+            ' is the slow part. It has not been measured to speed up a build.'
+            ' The result is the same as with one process. Default is 1.'
+        ),
+        default=1,
+        type=int
+    )
+    parser.add_argument("--incremental",
+        help=(
+            'Only index genomes that are new or whose hashes files changed since'
+            ' they were indexed. Records of changed genomes, and of genomes that'
+            ' are no longer in datadir, are deleted first. Removed genomes are'
+            ' only looked for if no directories are selected.'
+        ),
+        action='store_true'
+    )
+    parser.add_argument("--frame-offsets",
+        help=(
+            'Also write the frame offsets of the data files of each indexed'
+            ' genome, read from their seek table, to a .frames file next to'
+            ' them. The server then doesn\'t need to scan a data file when it'
+            ' opens it.'
+        ),
+        action='store_true'
+    )
     args = parser.parse_args()
 
 
@@ -130,11 +504,23 @@ def main():
 
     print("DB open OK")
 
+    db_format = db.Get(FORMAT_KEY)
+    if db.Count() > 0 and (db_format == BINARY_FORMAT) != (args.format == 'binary'):
+        print(f"Error: {dbfile} is not in {args.format} format.", file=sys.stderr)
+        db.Close().OrDie()
+        sys.exit(1)
+    paths = None
+    if args.format == 'binary':
+        db[FORMAT_KEY] = BINARY_FORMAT
+        paths = PathTable(db)
+
     if select_dirs:
         dirs_to_index = [Path(datadir, dir) for dir in select_dirs]
     else:
-        dirs_to_index = os.scandir(datadir)
+        # Sorted, so that the order of the path table is reproducible
+        dirs_to_index = sorted(os.scandir(datadir), key=lambda entry: entry.name)
 
+    dirnames = []
     for file in dirs_to_index:
         if not file.is_dir():
             print(f"Skipped {file}. Not a directory.", file=sys.stderr)
@@ -143,10 +529,77 @@ def main():
         if not re.search(r'\w{8}-\w{4}-\w{4}-\w{4}-\w{12}', dirname):
             print(f"Skipped {file}. Does not look like a UUID.", file=sys.stderr)
             continue
-        add_data(db, datadir, dirname)
+        dirnames.append(dirname)
+
+    manifests = Manifests(db)
+    deleted = set()
+    if args.incremental:
+        unchanged = []
+        changed = []
+        new = []
+        for dirname in dirnames:
+            stored = manifests.get(db, dirname)
+            if stored is None:
+                new.append(dirname)
+                continue
+            manifest = genome_manifest(datadir, dirname, stored)
+            if not same_content(manifest, stored):
+                changed.append(dirname)
+                continue
+            if manifest != stored:
+                manifests.put(db, dirname, manifest)
+            unchanged.append(dirname)
+        removed = [] if select_dirs else sorted(manifests.genomes - set(dirnames))
+        print(
+            f"{len(new)} new, {len(changed)} changed, {len(removed)} removed and"
+            f" {len(unchanged)} unchanged genomes"
+        )
+
+        if changed or removed:
+            print(f"Deleting records of {len(changed) + len(removed)} genomes")
+            deleted = delete_genomes(db, changed + removed, paths)
+        for dirname in removed:
+            manifests.remove(db, dirname)
+        dirnames = sorted(new + changed)
+
+    # Genomes that are not indexed again. With --incremental, the records of
+    # sequences they share with the genomes indexed are fixed up afterwards.
+    others = sorted(manifests.genomes - set(dirnames)) if args.incremental else []
+    owners = {}
+
+    started = time.monotonic()
+    total = 0
+    genomes = read_genomes(datadir, dirnames, paths is not None, args.jobs)
+    for dirname, genome, manifest in genomes:
+        print(f"DB insert for {dirname}")
+        total += write_genome(db, genome, paths)
+        if others and dirname < others[-1]:
+            for _, records in genome:
+                owners.update((record[1], dirname) for record in records)
+        manifests.put(db, dirname, manifest)
+        if args.frame_offsets:
+            for datatype in DATATYPES:
+                datafile = os.path.join(datadir, dirname, "seqs", f"{datatype}.txt.zst")
+                if os.path.isfile(datafile):
+                    write_frame_offsets(datafile)
+        elapsed = time.monotonic() - started
+        print(f"{total} records in {elapsed:.1f}s, {total / elapsed:.0f} records/s")
+
+    # Sequences of deleted genomes may still be in genomes that were not
+    # indexed again. Sequences of the genomes indexed may also be in genomes
+    # that sort after them, which a build from scratch takes the record from.
+    missing = {sha for sha in deleted if db.Get(sha) is None}
+    if missing:
+        print(f"Restoring {len(missing)} records shared with deleted genomes")
+    if missing or owners:
+        owners.update(dict.fromkeys(missing))
+        lost = restore_records(db, datadir, others, owners, paths)
+        if missing:
+            print(f"Deleted {len(lost)} records")
 
     # Closes the database.
     db.Close().OrDie()
 
 
-main()
+if __name__ == "__main__":
+    main()